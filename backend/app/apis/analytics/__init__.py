@@ -1,13 +1,17 @@
 from fastapi import APIRouter, HTTPException, Query, Path
 from pydantic import BaseModel
-from typing import Dict, List, Optional, Any
+from typing import Callable, Dict, List, Optional, Any
+import heapq
 import time
 from datetime import datetime, timedelta
 from app.apis.firestore_repository import FirestoreRepository
 from app.apis.scan_event import ScanEvent
 from app.apis.scan_stats import ScanStats
-from app.apis.qr_code import QRCode
+from app.apis.qr_code import QRCode, get_qr_code_names
+from app.apis.scan_rollups import get_scan_date, get_rollup_generation, query_rollups
+from app.apis.scan_aggregation import ScanAggregator, get_local_tz_offset_seconds
 from collections import defaultdict
+from operator import itemgetter
 
 # Initialize repositories
 scan_event_repo = FirestoreRepository[ScanEvent](collection_name="scan_events", model_class=ScanEvent)
@@ -65,7 +69,52 @@ def get_date_range(period: str, from_date: Optional[int] = None, to_date: Option
     return start_timestamp, end_timestamp
 
 
-def get_analytics_from_scan_events(store_hash: str, start_timestamp: int, end_timestamp: int):
+def stream_scan_event_dicts(field: str, value: str, start_timestamp: int, end_timestamp: int):
+    """
+    Stream the raw scan_events documents matching a field within a time range
+    """
+    query_results = scan_event_repo.collection.where(
+        field, "==", value
+    ).where(
+        "timestamp", ">=", start_timestamp
+    ).where(
+        "timestamp", "<=", end_timestamp
+    ).stream()
+    
+    for doc in query_results:
+        yield doc.to_dict()
+
+
+def get_analytics_from_aggregator(aggregator: ScanAggregator, resolve_names: Callable[[List[str]], Dict[str, str]], start_timestamp: int, end_timestamp: int, top_k: Optional[int] = None):
+    """
+    Build the analytics response data from aggregated scan events
+    
+    Args:
+        aggregator: Aggregator holding the counts of the period's scan events
+        resolve_names: Callable returning display names for a list of QR code IDs
+        start_timestamp: Start timestamp for the period
+        end_timestamp: End timestamp for the period
+        top_k: Number of QR codes to include in top_qr_codes, all if None
+        
+    Returns:
+        Dictionary with aggregated analytics data
+    """
+    total_scans = aggregator.total_scans
+    days_in_period = (end_timestamp - start_timestamp) / (60 * 60 * 24)
+    avg_daily_scans = total_scans / days_in_period if days_in_period > 0 else 0
+    
+    return {
+        "total_scans": total_scans,
+        "avg_daily_scans": round(avg_daily_scans, 1),
+        "top_device": ScanAggregator.top(aggregator.device_counts),
+        "top_location": ScanAggregator.top(aggregator.location_counts),
+        "series": [DateSeriesPoint(date=date, count=count) for date, count in aggregator.daily_counts.items()],
+        "top_qr_codes": build_top_qr_codes(aggregator.qr_code_counts, resolve_names, top_k),
+        "device_breakdown": dict(aggregator.device_counts)
+    }
+
+
+def get_analytics_from_scan_events(store_hash: str, start_timestamp: int, end_timestamp: int, tz_offset_seconds: Optional[int] = None, top_k: Optional[int] = None):
     """
     Generate analytics by aggregating data from scan_events
     
@@ -73,95 +122,107 @@ def get_analytics_from_scan_events(store_hash: str, start_timestamp: int, end_ti
         store_hash: The store hash to filter by
         start_timestamp: Start timestamp for the period
         end_timestamp: End timestamp for the period
+        tz_offset_seconds: Offset from UTC used to group scans by day, server time if None
+        top_k: Number of QR codes to include in top_qr_codes, all if None
         
     Returns:
         Dictionary with aggregated analytics data
     """
     print(f"Generating analytics from scan_events for store {store_hash} from {start_timestamp} to {end_timestamp}")
     
-    # Query all scan events within the time range for this store
-    events = []
-    query_results = scan_event_repo.collection.where(
-        "store_hash", "==", store_hash
-    ).where(
-        "timestamp", ">=", start_timestamp
-    ).where(
-        "timestamp", "<=", end_timestamp
-    ).stream()
-    
-    for doc in query_results:
-        event_data = doc.to_dict()
-        events.append(ScanEvent(**event_data))
+    aggregator = ScanAggregator(tz_offset_seconds).add_all(
+        stream_scan_event_dicts("store_hash", store_hash, start_timestamp, end_timestamp)
+    )
     
-    if not events:
+    if not aggregator.total_scans:
         print("No scan events found in the specified period")
         return create_empty_analytics()
     
-    # Aggregate data
-    total_scans = len(events)
-    days_in_period = (end_timestamp - start_timestamp) / (60 * 60 * 24)
-    avg_daily_scans = total_scans / days_in_period if days_in_period > 0 else 0
+    return get_analytics_from_aggregator(
+        aggregator, lambda qr_ids: get_qr_code_names(store_hash, qr_ids), start_timestamp, end_timestamp, top_k
+    )
+
+
+def get_analytics_from_rollups(rollups: List[Dict[str, Any]], resolve_names: Callable[[List[str]], Dict[str, str]], start_timestamp: int, end_timestamp: int, top_k: Optional[int] = None):
+    """
+    Generate analytics from daily rollup documents
     
-    # Count by device type
+    Args:
+        rollups: Raw scan_rollups_daily documents for the days of the period
+        resolve_names: Callable returning display names for a list of QR code IDs
+        start_timestamp: Start timestamp for the period
+        end_timestamp: End timestamp for the period
+        top_k: Number of QR codes to include in top_qr_codes, all if None
+        
+    Returns:
+        Dictionary with aggregated analytics data
+    """
     device_counts = defaultdict(int)
-    for event in events:
-        device_counts[event.device_type] += 1
-    
-    # Find top device
-    top_device = max(device_counts.items(), key=lambda x: x[1])[0] if device_counts else "No data"
-    
-    # Count by location
     location_counts = defaultdict(int)
-    for event in events:
-        if event.location and event.location.country:
-            location_counts[event.location.country] += 1
-    
-    # Find top location
-    top_location = max(location_counts.items(), key=lambda x: x[1])[0] if location_counts else "No data"
-    
-    # Group events by date
     daily_counts = defaultdict(int)
-    for event in events:
-        date = datetime.fromtimestamp(event.timestamp).strftime("%Y-%m-%d")
-        daily_counts[date] += 1
-    
-    # Convert to time series
-    series = [
-        DateSeriesPoint(date=date, count=count)
-        for date, count in sorted(daily_counts.items())
-    ]
-    
-    # Count by QR code and get names
     qr_code_counts = defaultdict(int)
-    for event in events:
-        qr_code_counts[event.qr_code_id] += 1
     
-    # Get QR code names
-    qr_code_map = {}
-    for qr_id in qr_code_counts.keys():
-        qr_codes = qr_code_repo.query_by_field("id", qr_id)
-        if qr_codes:
-            qr_code_map[qr_id] = qr_codes[0].name
-        else:
-            qr_code_map[qr_id] = f"Unknown QR Code ({qr_id})"
+    for rollup in rollups:
+        total = rollup.get("total_scans", 0)
+        if not total:
+            continue
+        qr_code_counts[rollup["qr_code_id"]] += total
+        daily_counts[rollup["date"]] += total
+        for device, count in rollup.get("device_breakdown", {}).items():
+            device_counts[device] += count
+        for country, count in rollup.get("location_breakdown", {}).items():
+            location_counts[country] += count
+    
+    if not qr_code_counts:
+        return create_empty_analytics()
     
-    # Create top QR codes list
-    top_qr_codes = [
-        QRCodeStat(qr_code_id=qr_id, name=qr_code_map.get(qr_id, "Unknown"), count=count)
-        for qr_id, count in sorted(qr_code_counts.items(), key=lambda x: x[1], reverse=True)
-    ]
+    total_scans = sum(qr_code_counts.values())
+    days_in_period = (end_timestamp - start_timestamp) / (60 * 60 * 24)
+    avg_daily_scans = total_scans / days_in_period if days_in_period > 0 else 0
     
     return {
         "total_scans": total_scans,
         "avg_daily_scans": round(avg_daily_scans, 1),
-        "top_device": top_device,
-        "top_location": top_location,
-        "series": series,
-        "top_qr_codes": top_qr_codes,
+        "top_device": max(device_counts.items(), key=lambda x: x[1])[0] if device_counts else "No data",
+        "top_location": max(location_counts.items(), key=lambda x: x[1])[0] if location_counts else "No data",
+        "series": [DateSeriesPoint(date=date, count=count) for date, count in sorted(daily_counts.items())],
+        "top_qr_codes": build_top_qr_codes(qr_code_counts, resolve_names, top_k),
         "device_breakdown": dict(device_counts)
     }
 
 
+def uses_server_days(tz_offset_seconds: Optional[int]) -> bool:
+    """
+    Check whether scans grouped with a timezone offset fall on the same days as the
+    pre-aggregated rollups and stats, which are bucketed by the server's local date
+    """
+    return tz_offset_seconds is None or tz_offset_seconds == get_local_tz_offset_seconds()
+
+
+def build_top_qr_codes(qr_code_counts: Dict[str, int], resolve_names: Callable[[List[str]], Dict[str, str]], top_k: Optional[int] = None) -> List[QRCodeStat]:
+    """
+    Select the QR codes with the most scans and name only those
+    
+    Args:
+        qr_code_counts: Map of QR code ID to scan count
+        resolve_names: Callable returning display names for a list of QR code IDs
+        top_k: Number of QR codes to return, all if None
+        
+    Returns:
+        QR code stats ordered by scan count, highest first
+    """
+    if top_k is None or top_k >= len(qr_code_counts):
+        winners = sorted(qr_code_counts.items(), key=itemgetter(1), reverse=True)
+    else:
+        winners = heapq.nlargest(top_k, qr_code_counts.items(), key=itemgetter(1))
+    
+    names = resolve_names([qr_id for qr_id, _ in winners]) if winners else {}
+    return [
+        QRCodeStat(qr_code_id=qr_id, name=names.get(qr_id, f"Unknown QR Code ({qr_id})"), count=count)
+        for qr_id, count in winners
+    ]
+
+
 def create_empty_analytics():
     """
     Create empty analytics response when no data is available
@@ -182,7 +243,9 @@ def get_analytics_overview(
     store_hash: str = Query(..., description="The store hash to filter by"),
     period: str = Query("7d", description="Time period to filter by (7d, 30d, custom)"),
     from_timestamp: Optional[int] = Query(None, description="Start timestamp for custom period"),
-    to_timestamp: Optional[int] = Query(None, description="End timestamp for custom period")
+    to_timestamp: Optional[int] = Query(None, description="End timestamp for custom period"),
+    tz_offset: Optional[int] = Query(None, description="Offset from UTC in minutes used to group scans by day, server time if omitted"),
+    top_k: int = Query(10, ge=1, le=1000, description="Number of QR codes to return in top_qr_codes")
 ):
     """
     Get analytics overview for a store within a specified time period
@@ -192,10 +255,21 @@ def get_analytics_overview(
     """
     # Calculate date range based on period
     start_timestamp, end_timestamp = get_date_range(period, from_timestamp, to_timestamp)
-    
-    # Generate analytics from scan events
-    analytics = get_analytics_from_scan_events(store_hash, start_timestamp, end_timestamp)
-    
+    tz_offset_seconds = tz_offset * 60 if tz_offset is not None else None
+    
+    if uses_server_days(tz_offset_seconds):
+        # Serve daily rollups once they have been backfilled for the store. Rollups are
+        # per day, so the period is widened to whole days.
+        generation = get_rollup_generation(store_hash)
+        if generation:
+            rollups = query_rollups("store_hash", store_hash, generation, get_scan_date(start_timestamp), get_scan_date(end_timestamp))
+            analytics = get_analytics_from_rollups(
+                rollups, lambda qr_ids: get_qr_code_names(store_hash, qr_ids), start_timestamp, end_timestamp, top_k
+            )
+            return AnalyticsOverviewResponse(**analytics)
+    
+    # Otherwise aggregate the raw scan events
+    analytics = get_analytics_from_scan_events(store_hash, start_timestamp, end_timestamp, tz_offset_seconds, top_k)
     return AnalyticsOverviewResponse(**analytics)
 
 
@@ -204,7 +278,8 @@ def get_qr_code_analytics(
     qr_code_id: str = Path(..., description="The QR code ID to get analytics for"),
     period: str = Query("7d", description="Time period to filter by (7d, 30d, custom)"),
     from_timestamp: Optional[int] = Query(None, description="Start timestamp for custom period"),
-    to_timestamp: Optional[int] = Query(None, description="End timestamp for custom period")
+    to_timestamp: Optional[int] = Query(None, description="End timestamp for custom period"),
+    tz_offset: Optional[int] = Query(None, description="Offset from UTC in minutes used to group scans by day, server time if omitted")
 ):
     """
     Get detailed analytics for a specific QR code
@@ -213,76 +288,35 @@ def get_qr_code_analytics(
     device breakdowns, and location data.
     """
     # First get the QR code to validate it exists and get the store_hash
-    qr_codes = qr_code_repo.query_by_field("id", qr_code_id)
-    if not qr_codes:
+    qr_code = qr_code_repo.get_by_id(qr_code_id)
+    if qr_code is None:
         raise HTTPException(status_code=404, detail=f"QR code with ID {qr_code_id} not found")
     
-    qr_code = qr_codes[0]
     store_hash = qr_code.store_hash
     
     # Calculate date range based on period
     start_timestamp, end_timestamp = get_date_range(period, from_timestamp, to_timestamp)
+    tz_offset_seconds = tz_offset * 60 if tz_offset is not None else None
+    
+    if uses_server_days(tz_offset_seconds):
+        # Serve daily rollups (one document per day of the period) once they have been backfilled
+        generation = get_rollup_generation(store_hash)
+        if generation:
+            rollups = query_rollups("qr_code_id", qr_code_id, generation, get_scan_date(start_timestamp), get_scan_date(end_timestamp))
+            analytics = get_analytics_from_rollups(rollups, lambda qr_ids: {qr_code_id: qr_code.name}, start_timestamp, end_timestamp)
+            if not analytics["top_qr_codes"]:
+                analytics["top_qr_codes"] = [QRCodeStat(qr_code_id=qr_code_id, name=qr_code.name, count=0)]
+            return AnalyticsOverviewResponse(**analytics)
+    
+    # Aggregate the scan events for this QR code within the time range
+    aggregator = ScanAggregator(tz_offset_seconds).add_all(
+        stream_scan_event_dicts("qr_code_id", qr_code_id, start_timestamp, end_timestamp)
+    )
     
-    # Query all scan events for this QR code within the time range
-    events = []
-    query_results = scan_event_repo.collection.where(
-        "qr_code_id", "==", qr_code_id
-    ).where(
-        "timestamp", ">=", start_timestamp
-    ).where(
-        "timestamp", "<=", end_timestamp
-    ).stream()
-    
-    for doc in query_results:
-        event_data = doc.to_dict()
-        events.append(ScanEvent(**event_data))
-    
-    if not events:
+    if not aggregator.total_scans:
         print(f"No scan events found for QR code {qr_code_id} in the specified period")
         empty_response = create_empty_analytics()
         empty_response["top_qr_codes"] = [QRCodeStat(qr_code_id=qr_code_id, name=qr_code.name, count=0)]
         return AnalyticsOverviewResponse(**empty_response)
     
-    # Aggregate data
-    total_scans = len(events)
-    days_in_period = (end_timestamp - start_timestamp) / (60 * 60 * 24)
-    avg_daily_scans = total_scans / days_in_period if days_in_period > 0 else 0
-    
-    # Count by device type
-    device_counts = defaultdict(int)
-    for event in events:
-        device_counts[event.device_type] += 1
-    
-    # Find top device
-    top_device = max(device_counts.items(), key=lambda x: x[1])[0] if device_counts else "No data"
-    
-    # Count by location
-    location_counts = defaultdict(int)
-    for event in events:
-        if event.location and event.location.country:
-            location_counts[event.location.country] += 1
-    
-    # Find top location
-    top_location = max(location_counts.items(), key=lambda x: x[1])[0] if location_counts else "No data"
-    
-    # Group events by date
-    daily_counts = defaultdict(int)
-    for event in events:
-        date = datetime.fromtimestamp(event.timestamp).strftime("%Y-%m-%d")
-        daily_counts[date] += 1
-    
-    # Convert to time series
-    series = [
-        DateSeriesPoint(date=date, count=count)
-        for date, count in sorted(daily_counts.items())
-    ]
-    
-    return AnalyticsOverviewResponse(
-        total_scans=total_scans,
-        avg_daily_scans=round(avg_daily_scans, 1),
-        top_device=top_device,
-        top_location=top_location,
-        series=series,
-        top_qr_codes=[QRCodeStat(qr_code_id=qr_code_id, name=qr_code.name, count=total_scans)],
-        device_breakdown=dict(device_counts)
-    )
+    return AnalyticsOverviewResponse(**get_analytics_from_aggregator(aggregator, lambda qr_ids: {qr_code_id: qr_code.name}, start_timestamp, end_timestamp))
@@ -0,0 +1,241 @@
+from typing import Any, Callable, Dict, List, Optional, Type, TypeVar
+import atexit
+import queue
+import threading
+import time
+
+from fastapi import APIRouter
+
+# Create an empty router to satisfy Databutton API module requirements
+# This is a utility module, not an API endpoint module
+router = APIRouter()
+
+# Registry of batch queues so they can be reported on and drained at shutdown
+_queues: Dict[str, "BatchQueue"] = {}
+
+# Callbacks run at shutdown before any queue is drained
+_before_drain: List[Callable[[], None]] = []
+
+QueueType = TypeVar("QueueType", bound="BatchQueue")
+
+
+class BatchQueue:
+    """
+    In-process queue that buffers items and hands them to a flush handler in batches.
+
+    A single background thread collects items until either max_batch_size items
+    are buffered or flush_interval_ms has passed since the batch was started, then
+    calls flush_handler with the batch. The queue is bounded: when it is full new
+    items are dropped and counted instead of blocking the caller that produced them.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        flush_handler: Callable[[List[Any]], None],
+        max_batch_size: int = 500,
+        flush_interval_ms: int = 250,
+        max_queue_size: int = 20000,
+        drain_last: bool = False
+    ):
+        """
+        Initialize the queue and register it under the given name
+
+        Args:
+            name: Name used to report the queue's metrics
+            flush_handler: Callable that persists a batch of items
+            max_batch_size: Maximum number of items passed to flush_handler at once
+            flush_interval_ms: Maximum time an item waits in a partial batch
+            max_queue_size: Maximum number of buffered items before new items are dropped
+            drain_last: Drain this queue at shutdown after all other queues, e.g. because
+                the other queues' flush handlers enqueue items into it
+        """
+        self.name = name
+        self.flush_handler = flush_handler
+        self.max_batch_size = max_batch_size
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_queue_size = max_queue_size
+        self.drain_last = drain_last
+        self._queue: "queue.Queue[Any]" = queue.Queue(maxsize=max_queue_size)
+        self._stop = threading.Event()
+        self._start_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+        # Metrics
+        self._metrics_lock = threading.Lock()
+        self.enqueued = 0
+        self.flushed = 0
+        self.dropped = 0
+        self.flushes = 0
+        self.flush_errors = 0
+        self.last_flush_latency_ms = 0.0
+        self.max_flush_latency_ms = 0.0
+        self.total_flush_latency_ms = 0.0
+
+        _queues[name] = self
+
+    def enqueue(self, item: Any) -> bool:
+        """
+        Add an item to the queue without blocking
+
+        Returns:
+            True if the item was queued, False if it was dropped because the queue is full or stopped
+        """
+        if self._stop.is_set():
+            self._count_dropped(1)
+            return False
+
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            self._count_dropped(1)
+            return False
+
+        with self._metrics_lock:
+            self.enqueued += 1
+        return True
+
+    def drain(self, timeout: float = 10.0) -> None:
+        """
+        Stop accepting items and flush everything still buffered
+
+        Args:
+            timeout: Maximum number of seconds to wait for the worker to finish
+        """
+        self._stop.set()
+        thread = self._thread
+        if thread is not None and thread.is_alive():
+            thread.join(timeout)
+        elif not self._queue.empty():
+            # The worker never started, flush what is left on the calling thread
+            self._run()
+
+    def metrics(self) -> Dict[str, Any]:
+        """
+        Get queue depth, throughput and flush latency metrics
+        """
+        with self._metrics_lock:
+            return {
+                "name": self.name,
+                "queue_depth": self._queue.qsize(),
+                "max_queue_size": self.max_queue_size,
+                "enqueued": self.enqueued,
+                "flushed": self.flushed,
+                "dropped": self.dropped,
+                "flushes": self.flushes,
+                "flush_errors": self.flush_errors,
+                "last_flush_latency_ms": round(self.last_flush_latency_ms, 2),
+                "max_flush_latency_ms": round(self.max_flush_latency_ms, 2),
+                "avg_flush_latency_ms": round(self.total_flush_latency_ms / self.flushes, 2) if self.flushes else 0.0,
+                "running": self._thread is not None and self._thread.is_alive(),
+            }
+
+    def _ensure_started(self) -> None:
+        """
+        Start the background worker on first use
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name=f"batch-{self.name}", daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        """
+        Worker loop: collect batches and flush them until stopped and empty
+        """
+        while not (self._stop.is_set() and self._queue.empty()):
+            batch = self._collect_batch()
+            if batch:
+                self._flush(batch)
+
+    def _collect_batch(self) -> List[Any]:
+        """
+        Collect up to max_batch_size items, waiting at most flush_interval for the batch to fill
+        """
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining <= 0 or self._stop.is_set():
+                    batch.append(self._queue.get_nowait())
+                else:
+                    batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _flush(self, batch: List[Any]) -> None:
+        """
+        Hand a batch to the flush handler, retrying once before dropping it
+        """
+        start = time.perf_counter()
+        for attempt in range(2):
+            try:
+                self.flush_handler(batch)
+                break
+            except Exception as e:
+                with self._metrics_lock:
+                    self.flush_errors += 1
+                print(f"[BATCH QUEUE] Error flushing {len(batch)} items from {self.name} (attempt {attempt + 1}): {str(e)}")
+        else:
+            self._count_dropped(len(batch))
+            return
+
+        latency_ms = (time.perf_counter() - start) * 1000
+        with self._metrics_lock:
+            self.flushed += len(batch)
+            self.flushes += 1
+            self.last_flush_latency_ms = latency_ms
+            self.max_flush_latency_ms = max(self.max_flush_latency_ms, latency_ms)
+            self.total_flush_latency_ms += latency_ms
+
+    def _count_dropped(self, count: int) -> None:
+        with self._metrics_lock:
+            self.dropped += count
+
+
+def get_queues(queue_type: Type[QueueType] = BatchQueue) -> List[QueueType]:
+    """
+    Get the registered queues of a type
+    """
+    return [batch_queue for batch_queue in _queues.values() if isinstance(batch_queue, queue_type)]
+
+
+def run_before_drain(callback: Callable[[], None]) -> None:
+    """
+    Run a callback at shutdown before the queues are drained
+
+    Shutdown work that still produces items, like a final flush that logs its
+    result, has to finish before the queues it writes to stop accepting items.
+    """
+    _before_drain.append(callback)
+
+
+def drain_all_queues() -> None:
+    """
+    Run the before-drain callbacks, then flush every registered queue
+
+    Queues created with drain_last are drained after all others. Every step only
+    runs once, so this is safe to call from both the shutdown event and atexit.
+    """
+    while _before_drain:
+        callback = _before_drain.pop(0)
+        try:
+            callback()
+        except Exception as e:
+            print(f"[BATCH QUEUE] Error in shutdown callback {getattr(callback, '__qualname__', callback)}: {str(e)}")
+
+    for batch_queue in sorted(_queues.values(), key=lambda batch_queue: batch_queue.drain_last):
+        try:
+            batch_queue.drain()
+        except Exception as e:
+            print(f"[BATCH QUEUE] Error draining {batch_queue.name}: {str(e)}")
+
+
+# Flush buffered items when the server shuts down, and as a fallback when the process exits
+router.add_event_handler("shutdown", drain_all_queues)
+atexit.register(drain_all_queues)
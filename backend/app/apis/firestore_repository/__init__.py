@@ -1,28 +1,38 @@
-from typing import TypeVar, Generic, Type, Dict, Any, List, Optional
+import logging
+from typing import TypeVar, Generic, Type, Dict, Any, List, Optional, Tuple, Callable
 from pydantic import BaseModel
 from app.apis.firebase_client import get_firestore_db
 from google.cloud.firestore_v1.base_query import FieldFilter
 from firebase_admin import firestore
+from google.api_core.exceptions import Conflict
 from fastapi import APIRouter
+from app.apis.in_memory_firestore import AlreadyExists as InMemoryAlreadyExists, InMemoryTransaction
 
 router = APIRouter()
 
+logger = logging.getLogger(__name__)
+
 
 T = TypeVar('T', bound=BaseModel)
+R = TypeVar('R')
+
+# Firestore accepts at most 30 values in an "in" filter
+MAX_IN_QUERY_VALUES = 30
 
 class FirestoreRepository(Generic[T]):
     """
     Generic repository for Firestore operations with Pydantic models
     """
-    def __init__(self, collection_name: str, model_class: Type[T]):
+    def __init__(self, collection_name: str, model_class: Type[T], db=None):
         """
         Initialize the repository with a collection name and model class
         
         Args:
             collection_name: The name of the Firestore collection
             model_class: The Pydantic model class to use for this repository
+            db: Optional Firestore client to use instead of the shared application client
         """
-        self.db = get_firestore_db()
+        self.db = db if db is not None else get_firestore_db()
         self.collection_name = collection_name
         self.model_class = model_class
         self.collection = self.db.collection(collection_name)
@@ -39,22 +49,63 @@ class FirestoreRepository(Generic[T]):
             The document ID of the added item
         """
         try:
-            print(f"[FIRESTORE_REPO] Adding item to collection {self.collection_name}")
+            logger.debug("Adding item to collection %s", self.collection_name)
             item_dict = item.to_dict() if hasattr(item, 'to_dict') else item.dict()
             
             if document_id:
-                print(f"[FIRESTORE_REPO] Using provided document ID: {document_id}")
+                logger.debug("Using provided document ID: %s", document_id)
                 self.collection.document(document_id).set(item_dict)
                 return document_id
             else:
                 doc_ref = self.collection.add(item_dict)[0]
-                print(f"[FIRESTORE_REPO] Generated document ID: {doc_ref.id}")
+                logger.debug("Generated document ID: %s", doc_ref.id)
                 return doc_ref.id
         except Exception as e:
-            print(f"[FIRESTORE_REPO] Error adding item: {str(e)}")
+            logger.error("Error adding item: %s", e)
             # Re-raise the exception as adding is a critical operation
             raise
     
+    def create(self, item: T, document_id: str) -> bool:
+        """
+        Add an item under a document ID only if no document has that ID yet
+        
+        The existence check and the write are one atomic operation, so concurrent
+        creates of the same ID cannot both succeed.
+        
+        Args:
+            item: The item to add
+            document_id: Document ID for the new item
+        
+        Returns:
+            True if the item was added, False if the document already exists
+        """
+        item_dict = item.to_dict() if hasattr(item, 'to_dict') else item.dict()
+        try:
+            self.collection.document(document_id).create(item_dict)
+            return True
+        except (Conflict, InMemoryAlreadyExists):
+            logger.debug("Document %s already exists in %s", document_id, self.collection_name)
+            return False
+    
+    def run_transaction(self, operation: Callable[[Any], R]) -> R:
+        """
+        Run a read-modify-write operation in a Firestore transaction
+        
+        The operation is given the transaction, must do all its reads with
+        get(transaction=...) before writing through the transaction, and may be
+        run again if a document it read changes before the commit.
+        
+        Args:
+            operation: Callable taking the transaction
+        
+        Returns:
+            The result of the operation's successful run
+        """
+        transaction = self.db.transaction()
+        if isinstance(transaction, InMemoryTransaction):
+            return transaction.run(operation)
+        return firestore.transactional(operation)(transaction)
+    
     def get(self, document_id: str) -> Optional[T]:
         """
         Get an item by its document ID
@@ -73,25 +124,126 @@ class FirestoreRepository(Generic[T]):
             return self.model_class(**data)
         return None
     
-    def update(self, document_id: str, item: T) -> bool:
+    def get_with_document_id(self, item_id: str, id_field: str = "id") -> Optional[Tuple[str, T]]:
+        """
+        Get an item by its model ID together with the ID of the document that stores it
+        
+        Items saved with document_id equal to their model ID are fetched with a single
+        point read. Legacy documents stored under a different document ID are found
+        with a field query on id_field as a fallback. A document under item_id whose
+        id_field does not hold item_id is not the item, so it never hides the fallback.
+        
+        Args:
+            item_id: The model ID of the item
+            id_field: The model field holding the ID
+        
+        Returns:
+            Tuple of (document ID, item) if found, None otherwise
+        """
+        try:
+            doc = self.collection.document(item_id).get()
+            if doc.exists:
+                data = doc.to_dict()
+                if data.get(id_field) == item_id:
+                    return doc.id, self._to_model(data)
+            
+            # Fall back to a field query for legacy documents with generated IDs
+            query = self.collection.where(filter=FieldFilter(id_field, "==", item_id)).limit(1)
+            for doc in query.stream():
+                logger.debug("Found %s in %s via field query (document %s)", item_id, self.collection_name, doc.id)
+                return doc.id, self._to_model(doc.to_dict())
+            
+            return None
+        except Exception as e:
+            logger.error("Error getting %s from %s: %s", item_id, self.collection_name, e)
+            return None
+    
+    def get_by_id(self, item_id: str, id_field: str = "id") -> Optional[T]:
+        """
+        Get an item by its model ID, using a point read before falling back to a field query
+        
+        Args:
+            item_id: The model ID of the item
+            id_field: The model field holding the ID
+        
+        Returns:
+            The item if found, None otherwise
+        """
+        result = self.get_with_document_id(item_id, id_field=id_field)
+        return result[1] if result else None
+    
+    def get_many(self, item_ids: List[str], id_field: str = "id") -> Dict[str, T]:
+        """
+        Get several items by their model IDs in as few round trips as possible
+        
+        All IDs are fetched with one batched point read (db.get_all). IDs that are not
+        stored under their own document ID are then looked up with chunked "in" queries.
+        
+        Args:
+            item_ids: The model IDs of the items
+            id_field: The model field holding the ID
+        
+        Returns:
+            Dictionary of model ID to item for the items that were found
+        """
+        unique_ids = list(dict.fromkeys(item_ids))
+        found: Dict[str, T] = {}
+        if not unique_ids:
+            return found
+        
+        try:
+            refs = [self.collection.document(item_id) for item_id in unique_ids]
+            for doc in self.db.get_all(refs):
+                if not doc.exists:
+                    continue
+                data = doc.to_dict()
+                item_id = data.get(id_field, doc.id)
+                if item_id == doc.id:
+                    found[item_id] = self._to_model(data)
+            
+            # Fall back to field queries for legacy documents with generated IDs
+            missing = [item_id for item_id in unique_ids if item_id not in found]
+            for i in range(0, len(missing), MAX_IN_QUERY_VALUES):
+                chunk = missing[i:i + MAX_IN_QUERY_VALUES]
+                for doc in self.collection.where(filter=FieldFilter(id_field, "in", chunk)).stream():
+                    data = doc.to_dict()
+                    found[data[id_field]] = self._to_model(data)
+            
+            logger.debug("Fetched %d of %d items from %s", len(found), len(unique_ids), self.collection_name)
+        except Exception as e:
+            logger.error("Error getting items from %s: %s", self.collection_name, e)
+        return found
+    
+    def _to_model(self, data: Dict[str, Any]) -> T:
+        """
+        Convert a Firestore document dictionary to the repository's model
+        """
+        if hasattr(self.model_class, 'from_dict'):
+            return self.model_class.from_dict(data)
+        return self.model_class(**data)
+    
+    def update(self, document_id: str, item: T, exclude: Optional[set] = None) -> bool:
         """
         Update an existing item
         
         Args:
             document_id: The document ID to update
             item: The updated item
+            exclude: Optional set of fields to leave untouched, e.g. counters maintained with increments
         
         Returns:
             True if updated successfully, False otherwise
         """
         try:
-            print(f"[FIRESTORE_REPO] Updating document {document_id} in collection {self.collection_name}")
+            logger.debug("Updating document %s in collection %s", document_id, self.collection_name)
             item_dict = item.to_dict() if hasattr(item, 'to_dict') else item.dict()
+            for field in exclude or ():
+                item_dict.pop(field, None)
             self.collection.document(document_id).update(item_dict)
-            print(f"[FIRESTORE_REPO] Successfully updated document {document_id}")
+            logger.debug("Successfully updated document %s", document_id)
             return True
         except Exception as e:
-            print(f"[FIRESTORE_REPO] Error updating document {document_id}: {str(e)}")
+            logger.error("Error updating document %s: %s", document_id, e)
             return False
     
     def delete(self, document_id: str) -> bool:
@@ -105,12 +257,12 @@ class FirestoreRepository(Generic[T]):
             True if deleted successfully, False otherwise
         """
         try:
-            print(f"[FIRESTORE] Attempting to delete document with ID: {document_id} from collection: {self.collection_name}")
+            logger.debug("Deleting document %s from collection %s", document_id, self.collection_name)
             self.collection.document(document_id).delete()
-            print(f"[FIRESTORE] Successfully deleted document with ID: {document_id} from collection: {self.collection_name}")
+            logger.debug("Successfully deleted document %s from collection %s", document_id, self.collection_name)
             return True
         except Exception as e:
-            print(f"[FIRESTORE] Error deleting document with ID: {document_id} from collection: {self.collection_name}. Error: {str(e)}")
+            logger.error("Error deleting document %s from collection %s: %s", document_id, self.collection_name, e)
             return False
     
     def list(self, limit: int = 100, offset: int = 0) -> List[T]:
@@ -125,7 +277,7 @@ class FirestoreRepository(Generic[T]):
             List of items
         """
         try:
-            print(f"[FIRESTORE_REPO] Listing from collection {self.collection_name} with limit={limit}, offset={offset}")
+            logger.debug("Listing from collection %s with limit=%s, offset=%s", self.collection_name, limit, offset)
             query = self.collection.limit(limit).offset(offset)
             docs = query.stream()
             result = []
@@ -141,10 +293,10 @@ class FirestoreRepository(Generic[T]):
                 else:
                     result.append(self.model_class(**data))
             
-            print(f"[FIRESTORE_REPO] List query returned {len(result)} results")
+            logger.debug("List query returned %d results", len(result))
             return result
         except Exception as e:
-            print(f"[FIRESTORE_REPO] Error listing documents: {str(e)}")
+            logger.error("Error listing documents: %s", e)
             # Return empty list on error to prevent app crashes
             return []
     
@@ -161,7 +313,7 @@ class FirestoreRepository(Generic[T]):
             List of matching items
         """
         try:
-            print(f"[FIRESTORE_REPO] Querying {self.collection_name} where {field} {operator} {value}")
+            logger.debug("Querying %s where %s %s %s", self.collection_name, field, operator, value)
             query = self.collection.where(filter=FieldFilter(field, operator, value))
             docs = query.stream()
             result = []
@@ -177,10 +329,10 @@ class FirestoreRepository(Generic[T]):
                 else:
                     result.append(self.model_class(**data))
             
-            print(f"[FIRESTORE_REPO] Query returned {len(result)} results")
+            logger.debug("Query returned %d results", len(result))
             return result
         except Exception as e:
-            print(f"[FIRESTORE_REPO] Error querying by field {field}: {str(e)}")
+            logger.error("Error querying by field %s: %s", field, e)
             # Return empty list on error to prevent app crashes
             return []
     
@@ -1,4 +1,7 @@
 from typing import Dict, List, Any, Optional, Callable, Union, Tuple
+import copy
+import logging
+import threading
 import uuid
 import time
 
@@ -8,6 +11,16 @@ from fastapi import APIRouter
 # This is a utility module, not an API endpoint module
 router = APIRouter()
 
+logger = logging.getLogger(__name__)
+
+
+class AlreadyExists(Exception):
+    """Raised when creating a document that already exists, like google.api_core.exceptions.AlreadyExists"""
+
+
+class NotFound(Exception):
+    """Raised when updating a document that does not exist, like google.api_core.exceptions.NotFound"""
+
 
 class FieldFilter:
     """Simplified implementation of Firestore's FieldFilter"""
@@ -44,6 +57,64 @@ class FieldFilter:
         return False
 
 
+def _to_field_filter(field_path=None, op_string=None, value=None, filter=None) -> FieldFilter:
+    """
+    Build an in-memory FieldFilter from positional where() arguments or a filter object.
+    
+    Accepts both this module's FieldFilter and google.cloud.firestore's FieldFilter,
+    which stores its arguments as field_path, op_string and value.
+    """
+    if filter is None:
+        return FieldFilter(field_path, op_string, value)
+    if isinstance(filter, FieldFilter):
+        return filter
+    return FieldFilter(filter.field_path, filter.op_string, filter.value)
+
+
+class Increment:
+    """Simplified implementation of Firestore's Increment transform"""
+    def __init__(self, value: Union[int, float]):
+        self.value = value
+
+
+# Serializes writes so read-modify-write transforms like Increment are atomic across threads
+_write_lock = threading.RLock()
+
+
+def _is_increment(value: Any) -> bool:
+    """Check for this module's Increment or google.cloud.firestore's Increment transform"""
+    return isinstance(value, Increment) or (type(value).__name__ == "Increment" and hasattr(value, "value"))
+
+
+def _resolve_value(existing: Any, value: Any) -> Any:
+    """Resolve field transforms in a value being written over an existing value"""
+    if _is_increment(value):
+        current = existing if isinstance(existing, (int, float)) and not isinstance(existing, bool) else 0
+        return current + value.value
+    if isinstance(value, dict):
+        return {key: _resolve_value(None, nested) for key, nested in value.items()}
+    return value
+
+
+def _merge_into(target: Dict[str, Any], data: Dict[str, Any]) -> None:
+    """Deep-merge data into target the way set(..., merge=True) does"""
+    for key, value in data.items():
+        if isinstance(value, dict) and isinstance(target.get(key), dict):
+            _merge_into(target[key], value)
+        else:
+            target[key] = _resolve_value(target.get(key), value)
+
+
+def _update_path(target: Dict[str, Any], field_path: str, value: Any) -> None:
+    """Write a value at a dotted field path, creating intermediate maps as needed"""
+    keys = field_path.split(".")
+    for key in keys[:-1]:
+        if not isinstance(target.get(key), dict):
+            target[key] = {}
+        target = target[key]
+    target[keys[-1]] = _resolve_value(target.get(keys[-1]), value)
+
+
 class DocumentSnapshot:
     """Mock implementation of Firestore DocumentSnapshot"""
     
@@ -69,38 +140,67 @@ class DocumentReference:
         self.id = id
         self._collection = collection
     
-    def get(self) -> DocumentSnapshot:
+    @property
+    def path(self) -> str:
+        """Slash-separated path of the document"""
+        return f"{self._collection.name}/{self.id}"
+    
+    def collection(self, collection_name: str) -> 'InMemoryCollection':
+        """Get a subcollection of this document"""
+        return self._collection._subcollection(self.id, collection_name)
+    
+    def get(self, transaction: 'InMemoryTransaction' = None) -> DocumentSnapshot:
         """Get the document snapshot"""
         data = self._collection._documents.get(self.id)
         return DocumentSnapshot(self.id, data or {}, exists=data is not None)
     
-    def set(self, data: Dict[str, Any]) -> None:
-        """Set document data"""
-        if self.id not in self._collection._documents:
-            print(f"[INMEM_FIRESTORE] Creating new document with ID: {self.id}")
-        else:
-            print(f"[INMEM_FIRESTORE] Updating document with ID: {self.id}")
+    def set(self, data: Dict[str, Any], merge: bool = False) -> None:
+        """Set document data, deep-merging into the existing document if merge is True"""
+        with _write_lock:
+            existing = self._collection._documents.get(self.id)
+            if existing is None:
+                logger.debug("Creating new document with ID: %s", self.id)
+            else:
+                logger.debug("Updating document with ID: %s", self.id)
             
-        self._collection._documents[self.id] = data.copy()
+            if merge and existing is not None:
+                document = copy.deepcopy(existing)
+                _merge_into(document, data)
+            else:
+                document = _resolve_value(None, data)
+            self._collection._documents[self.id] = document
+    
+    def create(self, data: Dict[str, Any]) -> None:
+        """Create the document, failing if it already exists"""
+        with _write_lock:
+            if self.id in self._collection._documents:
+                raise AlreadyExists(f"Document already exists: {self.path}")
+            logger.debug("Creating new document with ID: %s", self.id)
+            self._collection._documents[self.id] = _resolve_value(None, data)
     
     def update(self, data: Dict[str, Any]) -> None:
-        """Update document data"""
-        if self.id not in self._collection._documents:
-            print(f"[INMEM_FIRESTORE] Document {self.id} doesn't exist, creating it with update data")
-            self._collection._documents[self.id] = data.copy()
-        else:
-            print(f"[INMEM_FIRESTORE] Updating existing document with ID: {self.id}")
-            self._collection._documents[self.id].update(data)
+        """Update document data, treating dotted keys as nested field paths, failing if the document does not exist"""
+        with _write_lock:
+            existing = self._collection._documents.get(self.id)
+            if existing is None:
+                raise NotFound(f"No document to update: {self.path}")
+            logger.debug("Updating existing document with ID: %s", self.id)
+            document = copy.deepcopy(existing)
+            
+            for field_path, value in data.items():
+                _update_path(document, field_path, value)
+            self._collection._documents[self.id] = document
     
     def delete(self) -> None:
         """Delete the document"""
-        if self.id in self._collection._documents:
-            print(f"[INMEM_FIRESTORE] Deleting document with ID: {self.id}")
-            del self._collection._documents[self.id]
-            return True
-        else:
-            print(f"[INMEM_FIRESTORE] Document with ID {self.id} not found for deletion")
-            return False
+        with _write_lock:
+            if self.id in self._collection._documents:
+                logger.debug("Deleting document with ID: %s", self.id)
+                del self._collection._documents[self.id]
+                return True
+            else:
+                logger.debug("Document with ID %s not found for deletion", self.id)
+                return False
 
 
 class QuerySnapshotIterator:
@@ -140,10 +240,10 @@ class InMemoryQuery:
         self._limit = limit_val
         self._offset = offset_val
     
-    def where(self, filter: FieldFilter) -> 'InMemoryQuery':
+    def where(self, field_path: str = None, op_string: str = None, value: Any = None, filter=None) -> 'InMemoryQuery':
         """Add a filter to the query"""
         new_filters = self._filters.copy()
-        new_filters.append(filter)
+        new_filters.append(_to_field_filter(field_path, op_string, value, filter))
         return InMemoryQuery(self._collection, new_filters, self._limit, self._offset)
     
     def limit(self, limit_val: int) -> 'InMemoryQuery':
@@ -189,7 +289,15 @@ class InMemoryCollection:
     def __init__(self, name: str):
         self.name = name
         self._documents: Dict[str, Dict[str, Any]] = {}
-        print(f"[INMEM_FIRESTORE] Created collection: {name}")
+        self._subcollections: Dict[Tuple[str, str], 'InMemoryCollection'] = {}
+        logger.debug("Created collection: %s", name)
+    
+    def _subcollection(self, document_id: str, collection_name: str) -> 'InMemoryCollection':
+        """Get or create a subcollection under one of this collection's documents"""
+        key = (document_id, collection_name)
+        if key not in self._subcollections:
+            self._subcollections[key] = InMemoryCollection(f"{self.name}/{document_id}/{collection_name}")
+        return self._subcollections[key]
     
     def document(self, document_id: str = None) -> DocumentReference:
         """Get a document reference"""
@@ -206,9 +314,9 @@ class InMemoryCollection:
         doc_ref.set(document_data)
         return doc_ref, doc_id
     
-    def where(self, filter: FieldFilter) -> InMemoryQuery:
+    def where(self, field_path: str = None, op_string: str = None, value: Any = None, filter=None) -> InMemoryQuery:
         """Create a query with a filter"""
-        return InMemoryQuery(self, [filter])
+        return InMemoryQuery(self, [_to_field_filter(field_path, op_string, value, filter)])
     
     def limit(self, limit_val: int) -> InMemoryQuery:
         """Create a query with a limit"""
@@ -229,7 +337,7 @@ class InMemoryFirestore:
     
     def __init__(self):
         self._collections: Dict[str, InMemoryCollection] = {}
-        print("[INMEM_FIRESTORE] Initialized in-memory Firestore mock")
+        logger.info("Initialized in-memory Firestore mock")
     
     def collection(self, collection_name: str) -> InMemoryCollection:
         """Get a collection reference"""
@@ -241,6 +349,15 @@ class InMemoryFirestore:
     def batch(self):
         """Create a write batch"""
         return InMemoryBatch(self)
+    
+    def transaction(self):
+        """Create a transaction"""
+        return InMemoryTransaction(self)
+    
+    def get_all(self, references: List[DocumentReference]):
+        """Get several documents by reference, yielding a snapshot for each"""
+        for doc_ref in references:
+            yield doc_ref.get()
 
 
 class InMemoryBatch:
@@ -250,9 +367,9 @@ class InMemoryBatch:
         self._firestore = firestore
         self._operations = []
     
-    def set(self, doc_ref: DocumentReference, data: Dict[str, Any]):
+    def set(self, doc_ref: DocumentReference, data: Dict[str, Any], merge: bool = False):
         """Set a document"""
-        self._operations.append(("set", doc_ref, data))
+        self._operations.append(("set_merge" if merge else "set", doc_ref, data))
         return self
     
     def update(self, doc_ref: DocumentReference, data: Dict[str, Any]):
@@ -266,15 +383,44 @@ class InMemoryBatch:
         return self
     
     def commit(self):
-        """Commit the batch"""
-        for op_type, doc_ref, data in self._operations:
-            if op_type == "set":
-                doc_ref.set(data)
-            elif op_type == "update":
-                doc_ref.update(data)
-            elif op_type == "delete":
-                doc_ref.delete()
+        """Commit the batch, applying none of its writes if an update targets a missing document"""
+        with _write_lock:
+            # Firestore batches are atomic, so check every update before applying any write
+            existing = {}
+            for op_type, doc_ref, _ in self._operations:
+                key = (id(doc_ref._collection), doc_ref.id)
+                if key not in existing:
+                    existing[key] = doc_ref.id in doc_ref._collection._documents
+                if op_type == "update" and not existing[key]:
+                    raise NotFound(f"No document to update: {doc_ref.path}")
+                existing[key] = op_type != "delete"
+            
+            for op_type, doc_ref, data in self._operations:
+                if op_type == "set":
+                    doc_ref.set(data)
+                elif op_type == "set_merge":
+                    doc_ref.set(data, merge=True)
+                elif op_type == "update":
+                    doc_ref.update(data)
+                elif op_type == "delete":
+                    doc_ref.delete()
         
         result = self._operations.copy()
         self._operations = []
         return result
+
+
+class InMemoryTransaction(InMemoryBatch):
+    """
+    Mock implementation of Firestore Transaction
+    
+    A transaction holds the write lock from its first read to its commit, so it
+    is serialized with every other write and never has to be retried.
+    """
+    
+    def run(self, operation: Callable[['InMemoryTransaction'], Any]) -> Any:
+        """Run an operation that reads and writes through this transaction, then commit its writes"""
+        with _write_lock:
+            result = operation(self)
+            self.commit()
+            return result
@@ -2,10 +2,16 @@
 import traceback
 import json
 import time
-from typing import Dict, Any, Optional
+import uuid
+import os
+from datetime import datetime, timezone
+from typing import Dict, Any, List, Optional
 import databutton as db
 
-from fastapi import APIRouter
+from fastapi import APIRouter, HTTPException, Query
+from google.cloud.firestore_v1.base_query import FieldFilter
+from app.apis.batch_queue import BatchQueue
+from app.apis.firebase_client import get_firestore_db
 
 # Create an empty router as required
 router = APIRouter()
@@ -22,38 +28,180 @@ LOG_LEVELS = {
 # Set the minimum log level to log (adjust as needed)
 MIN_LOG_LEVEL = LOG_LEVELS["INFO"]
 
-# Log storage configuration
-LOG_STORAGE_KEY = "app_logs"
-MAX_LOGS_TO_KEEP = 1000  # Maximum number of log entries to keep in storage
+# Log storage configuration. Each process appends its entries of an hour to its own
+# segments and keeps one index of them per hour. The workers that wrote an hour are
+# listed in that hour's Firestore document, so queries find every index without
+# listing storage.
+LOG_SEGMENT_PREFIX = "app-logs"  # segments are stored as <prefix>.<hour>.<worker>.<number>
+LOG_INDEX_PREFIX = "app-logs-index"  # a worker's index of an hour is stored as <prefix>.<hour>.<worker>
+LOG_HOURS_COLLECTION = "log_hours"  # one document per hour listing the workers that logged in it
+LOG_QUERY_MAX_HOURS = 7 * 24  # widest time range a /logs query may read
+LOG_RETENTION_HOURS = int(os.environ.get("LOG_RETENTION_HOURS", str(LOG_QUERY_MAX_HOURS)))  # hours of segments kept
+LOG_RETENTION_SWEEP_SECONDS = 3600  # time between sweeps for expired hours
+LOG_SEGMENT_MAX_ENTRIES = 2000  # entries per segment before the next one is started
+LOG_FLUSH_MAX_ENTRIES = 500  # entries written per flush at most
+LOG_FLUSH_INTERVAL_MS = 5000  # longest an entry waits before it is written
+LOG_QUEUE_SIZE = 10000  # entries waiting to be written before new ones are dropped
 
+# Identifies this process's segments and indexes; only this process writes them
+LOG_WORKER_ID = uuid.uuid4().hex[:12]
 
-def _get_log_storage():
+# Index and entries of the newest segment of each hour this process is writing,
+# only touched by the shipper thread
+_open_hours: Dict[str, Dict[str, Any]] = {}
+
+# When this process last deleted expired hours
+_last_retention_sweep = 0.0
+
+
+def get_log_hour(timestamp: int) -> str:
     """
-    Get the current logs from storage or initialize if not exists
+    Get the UTC hour partition of a timestamp, e.g. 2025061014
     """
-    try:
-        logs = db.storage.json.get(LOG_STORAGE_KEY, default=[])
-        return logs
-    except Exception:
-        # If can't load, return empty list
-        return []
+    return datetime.fromtimestamp(timestamp, tz=timezone.utc).strftime("%Y%m%d%H")
 
 
-def _save_logs(logs):
+def get_log_segment_key(hour: str, worker_id: str, number: int) -> str:
     """
-    Save logs to storage, keeping only the last MAX_LOGS_TO_KEEP entries
+    Get the storage key of a worker's segment of an hour
     """
-    try:
-        # Trim the logs if they're too long
-        if len(logs) > MAX_LOGS_TO_KEEP:
-            logs = logs[-MAX_LOGS_TO_KEEP:]
+    return f"{LOG_SEGMENT_PREFIX}.{hour}.{worker_id}.{number}"
 
-        db.storage.json.put(LOG_STORAGE_KEY, logs)
-        return True
-    except Exception:
-        # Print to console if we can't save to storage
-        print("Failed to save logs to storage")
-        return False
+
+def get_log_index_key(hour: str, worker_id: str) -> str:
+    """
+    Get the storage key of a worker's segment index of an hour
+    """
+    return f"{LOG_INDEX_PREFIX}.{hour}.{worker_id}"
+
+
+def _describe_segment(segment_key: str, entries: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Summarize a segment for its index, so queries can skip segments without reading them
+    """
+    return {
+        "key": segment_key,
+        "start": min(entry["timestamp"] for entry in entries),
+        "end": max(entry["timestamp"] for entry in entries),
+        "count": len(entries),
+        "levels": sorted({entry["level"] for entry in entries}),
+        "sources": sorted({entry["source"] for entry in entries}),
+        "store_hashes": sorted({entry["store_hash"] for entry in entries if entry.get("store_hash")}),
+    }
+
+
+def _open_log_hour(hour: str) -> Dict[str, Any]:
+    """
+    Get this process's index of an hour, registering the process in the hour's document first
+    """
+    open_hour = _open_hours.get(hour)
+    if open_hour is not None:
+        return open_hour
+
+    # A merge only writes this worker's field, so workers registering at once don't overwrite each other
+    get_firestore_db().collection(LOG_HOURS_COLLECTION).document(hour).set(
+        {"hour": hour, "workers": {LOG_WORKER_ID: int(time.time())}}, merge=True
+    )
+    # Entries can arrive for an hour that was already closed; its earlier segments are kept
+    index = db.storage.json.get(get_log_index_key(hour, LOG_WORKER_ID), default=None) or {"segments": []}
+    open_hour = _open_hours[hour] = {"segments": index["segments"], "entries": []}
+
+    # Hours that ended more than an hour ago only get late entries, stop holding their newest segment
+    oldest_open_hour = get_log_hour(int(time.time()) - 3600)
+    for other_hour in [other_hour for other_hour in _open_hours if other_hour < oldest_open_hour and other_hour != hour]:
+        del _open_hours[other_hour]
+    return open_hour
+
+
+def _write_log_segment(entries: List[Dict[str, Any]]) -> None:
+    """
+    Append a batch of log entries to this process's segments of the hours they fall in
+    
+    The newest segment of an hour is rewritten with the new entries until it holds
+    LOG_SEGMENT_MAX_ENTRIES, then the next one is started. The hour's index is
+    rewritten after its segment, so every indexed segment exists. Only this
+    process writes these keys, so no other worker's entries are overwritten.
+    Expired hours are deleted at most once per LOG_RETENTION_SWEEP_SECONDS.
+    """
+    by_hour: Dict[str, List[Dict[str, Any]]] = {}
+    for entry in entries:
+        by_hour.setdefault(get_log_hour(entry["timestamp"]), []).append(entry)
+
+    for hour, hour_entries in sorted(by_hour.items()):
+        open_hour = _open_log_hour(hour)
+        # Context values that are not JSON serializable are stored as strings rather than failing the segment
+        hour_entries = json.loads(json.dumps(hour_entries, default=str))
+        segments = list(open_hour["segments"])
+        segment_entries = open_hour["entries"]
+        if not segment_entries or len(segment_entries) + len(hour_entries) > LOG_SEGMENT_MAX_ENTRIES:
+            segments.append(None)
+            segment_entries = []
+        segment_entries = segment_entries + hour_entries
+
+        segment_key = get_log_segment_key(hour, LOG_WORKER_ID, len(segments) - 1)
+        db.storage.json.put(segment_key, segment_entries)
+        segments[-1] = _describe_segment(segment_key, segment_entries)
+        db.storage.json.put(get_log_index_key(hour, LOG_WORKER_ID), {"segments": segments})
+        # Only advance once both writes succeeded, so a retried batch is not appended twice
+        open_hour["segments"] = segments
+        open_hour["entries"] = segment_entries
+
+    if time.time() - _last_retention_sweep >= LOG_RETENTION_SWEEP_SECONDS:
+        delete_expired_log_hours()
+
+
+def delete_expired_log_hours(now: Optional[int] = None) -> int:
+    """
+    Delete the segments and indexes of hours older than LOG_RETENTION_HOURS
+
+    Expired hours are found by querying their Firestore documents. Each index is
+    deleted before its segments and the hour's document last, so a failed sweep
+    is picked up again by the next one. Every worker may sweep; deleting twice
+    is harmless.
+
+    Returns:
+        Number of storage keys deleted
+    """
+    global _last_retention_sweep
+    now = now if now is not None else int(time.time())
+    _last_retention_sweep = now
+    cutoff_hour = get_log_hour(now - LOG_RETENTION_HOURS * 3600)
+    hours = get_firestore_db().collection(LOG_HOURS_COLLECTION)
+
+    deleted = 0
+    for hour_doc in hours.where(filter=FieldFilter("hour", "<", cutoff_hour)).stream():
+        hour = hour_doc.id
+        try:
+            for worker_id in hour_doc.to_dict().get("workers", {}):
+                index_key = get_log_index_key(hour, worker_id)
+                index = db.storage.json.get(index_key, default=None)
+                if index is None:
+                    continue
+                db.storage.json.delete(index_key)
+                deleted += 1
+                for segment in index["segments"]:
+                    db.storage.json.delete(segment["key"])
+                    deleted += 1
+            hours.document(hour).delete()
+            _open_hours.pop(hour, None)
+        except Exception as e:
+            print(f"[LOGGER] Error deleting expired log hour {hour}: {str(e)}")
+    if deleted:
+        print(f"[LOGGER] Deleted {deleted} expired log keys older than {cutoff_hour}")
+    return deleted
+
+
+# Background shipper: batches entries by size or time, drops and counts them when
+# full instead of blocking the caller, and is flushed at shutdown after the other
+# batch queues, whose flushes may still log (see batch_queue.drain_all_queues)
+log_shipper = BatchQueue(
+    name="app_logs",
+    flush_handler=_write_log_segment,
+    max_batch_size=LOG_FLUSH_MAX_ENTRIES,
+    flush_interval_ms=LOG_FLUSH_INTERVAL_MS,
+    max_queue_size=LOG_QUEUE_SIZE,
+    drain_last=True
+)
 
 
 def log(level: str, message: str, source: str = None, context: Dict[str, Any] = None,
@@ -103,14 +251,8 @@ def log(level: str, message: str, source: str = None, context: Dict[str, Any] =
         if include_traceback:
             print(traceback.format_exc())
     
-    # Try to save to storage for persistence - this may fail in some environments 
-    try:
-        logs = _get_log_storage()
-        logs.append(log_entry)
-        _save_logs(logs)
-    except Exception as e:
-        # If storage fails, at least we printed to console
-        print(f"Failed to save log to storage: {str(e)}")
+    # Hand the entry to the background shipper; logging never waits on storage
+    log_shipper.enqueue(log_entry)
     
     return log_entry
 
@@ -155,3 +297,94 @@ def log_exception(message: str, exception: Exception, **kwargs):
     Log an exception with full traceback
     """
     return error(message, exception=exception, include_traceback=True, **kwargs)
+
+
+def _segment_matches(segment: Dict[str, Any], start: int, end: int, min_level: int,
+                     store_hash: Optional[str], source: Optional[str]) -> bool:
+    """
+    Check from its index entry whether a segment can hold entries matching a query
+    """
+    if segment["end"] < start or segment["start"] > end:
+        return False
+    if not any(LOG_LEVELS.get(level, 0) >= min_level for level in segment["levels"]):
+        return False
+    if store_hash and store_hash not in segment["store_hashes"]:
+        return False
+    if source and source not in segment["sources"]:
+        return False
+    return True
+
+
+@router.get("/logs")
+def query_logs(
+    store_hash: Optional[str] = Query(None, description="Only entries for this store"),
+    level: str = Query("DEBUG", description="Minimum level (DEBUG, INFO, WARNING, ERROR, CRITICAL)"),
+    source: Optional[str] = Query(None, description="Only entries from this source"),
+    start: Optional[int] = Query(None, description="Unix timestamp to search from, default one hour ago"),
+    end: Optional[int] = Query(None, description="Unix timestamp to search to, default now"),
+    limit: int = Query(100, ge=1, le=1000, description="Maximum number of entries to return")
+):
+    """
+    Query persisted log entries, newest first
+    
+    For each hour in the time range, the hour's document names the workers that
+    logged in it. Only those workers' indexes of the hour are read, and only the
+    segments whose index entry can match the filters are loaded. Entries reach
+    storage up to LOG_FLUSH_INTERVAL_MS after they are logged.
+    """
+    level = level.upper()
+    if level not in LOG_LEVELS:
+        raise HTTPException(status_code=400, detail=f"level must be one of {', '.join(LOG_LEVELS)}")
+    min_level = LOG_LEVELS[level]
+    end = end if end is not None else int(time.time())
+    start = start if start is not None else end - 3600
+    if start > end:
+        raise HTTPException(status_code=400, detail="start must not be after end")
+    if end - start > LOG_QUERY_MAX_HOURS * 3600:
+        raise HTTPException(status_code=400, detail=f"Time range can span at most {LOG_QUERY_MAX_HOURS} hours")
+
+    hours = sorted({get_log_hour(timestamp) for timestamp in range(start - start % 3600, end + 1, 3600)} | {get_log_hour(end)})
+    hour_docs = get_firestore_db().collection(LOG_HOURS_COLLECTION)
+    matches = []
+    indexes_read = 0
+    segments_read = 0
+    segments_skipped = 0
+    for hour in reversed(hours):
+        hour_doc = hour_docs.document(hour).get()
+        if not hour_doc.exists:
+            continue
+        for worker_id in hour_doc.to_dict().get("workers", {}):
+            # The worker may have registered before writing its first index
+            index = db.storage.json.get(get_log_index_key(hour, worker_id), default=None)
+            if index is None:
+                continue
+            indexes_read += 1
+            for segment in index["segments"]:
+                if not _segment_matches(segment, start, end, min_level, store_hash, source):
+                    segments_skipped += 1
+                    continue
+                segments_read += 1
+                for entry in db.storage.json.get(segment["key"], default=[]):
+                    if (start <= entry["timestamp"] <= end
+                            and LOG_LEVELS.get(entry["level"], 0) >= min_level
+                            and (not store_hash or entry.get("store_hash") == store_hash)
+                            and (not source or entry.get("source") == source)):
+                        matches.append(entry)
+
+    matches.sort(key=lambda entry: entry["timestamp"], reverse=True)
+    return {
+        "entries": matches[:limit],
+        "total": len(matches),
+        "hours": len(hours),
+        "indexes_read": indexes_read,
+        "segments_read": segments_read,
+        "segments_skipped": segments_skipped
+    }
+
+
+@router.get("/logs/metrics")
+def get_log_shipper_metrics():
+    """
+    Get queue depth, flush latency and dropped entry counts of the log shipper
+    """
+    return log_shipper.metrics()
@@ -1,12 +1,16 @@
 from pydantic import BaseModel, Field
 from typing import Dict, Any, Optional, List, Literal
+import secrets
+import string
 import time
 import uuid
 from fastapi import APIRouter, Depends, HTTPException, status, Path, Query, Body, Request
 from app.apis.store_manager import get_store_data
 from app.apis.firestore_repository import FirestoreRepository
+from app.apis.ttl_cache import TTLCache
+from app.apis.sharded_counter import read_sharded_document
+from app.apis.qr_renderer import HexColor, QRMatrix, encode_matrix
 from app.env import Mode, mode
-from google.cloud.firestore_v1.base_query import FieldFilter
 import json
 
 # Set the base URL for the API based on the environment
@@ -15,9 +19,25 @@ API_BASE_URL = "https://app.getrobo.xyz/api" if mode == Mode.PROD else "https://
 # QR code tracking path depends on environment
 TRACK_PATH = "/api/track" if mode == Mode.PROD else "/track"
 
+# Short codes used in tracking URLs instead of the 36-character UUID, for fewer QR modules
+QR_SHORT_CODE_ALPHABET = string.digits + string.ascii_letters
+QR_SHORT_CODE_LENGTH = 8  # 62^8 ~ 2.2e14 codes
+QR_SHORT_CODE_ATTEMPTS = 5
+
+
+def generate_short_code() -> str:
+    """Generate a random base62 short code"""
+    return "".join(secrets.choice(QR_SHORT_CODE_ALPHABET) for _ in range(QR_SHORT_CODE_LENGTH))
+
+
+def is_short_code(tracking_id: str) -> bool:
+    """Check whether a tracking ID is a short code rather than a QR code ID"""
+    return len(tracking_id) == QR_SHORT_CODE_LENGTH and all(c in QR_SHORT_CODE_ALPHABET for c in tracking_id)
+
+
 # Function to get the absolute URL for QR code scanning based on the environment
 def get_absolute_scan_url(qr_code_id: str) -> str:
-    """Get the absolute URL for QR code scanning"""
+    """Get the absolute URL for QR code scanning, for a QR code ID or short code"""
     if mode == Mode.PROD:
         # In production environment, we use the app.getrobo.xyz domain with /api prefix for tracking
         return f"https://app.getrobo.xyz{TRACK_PATH}/{qr_code_id}"
@@ -47,13 +67,14 @@ class QRCodeStyle(BaseModel):
     """
     Visual styling information for a QR code
     """
-    foreground_color: str = "#000000"
-    background_color: str = "#FFFFFF"
+    foreground_color: HexColor = "#000000"
+    background_color: HexColor = "#FFFFFF"
     logo_url: Optional[str] = None
     dots_style: str = "square"  # "square", "rounded", "dots"
     corner_style: str = "square"  # "square", "rounded", "dots"
-    corner_color: Optional[str] = None  # Optional separate color for corners
+    corner_color: Optional[HexColor] = None  # Optional separate color for corners
     logo_size: float = 0.3  # as percentage of QR code size
+    renderer: str = "auto"  # "auto", "styled", "sprite"
 
 class QRCode(BaseModel):
     """
@@ -72,6 +93,15 @@ class QRCode(BaseModel):
     scan_count: int = 0
     active: bool = True
     status: str = "active"  # "active", "inactive", "deleted"
+    counter_shards: int = 0  # number of counter shards holding part of scan_count, 0 if unsharded
+    matrix: Optional[QRMatrix] = None  # precomputed encoding of the tracking URL, see ensure_qr_matrix
+    short_code: Optional[str] = None  # tracked as /track/{short_code}; codes without one use /track/{id}
+
+    def get_tracking_id(self) -> str:
+        """
+        Get the ID used in this QR code's tracking URL
+        """
+        return self.short_code or self.id
 
     def to_dict(self) -> Dict[str, Any]:
         """
@@ -87,8 +117,244 @@ class QRCode(BaseModel):
         return cls(**data)
 
 
+class QRShortCode(BaseModel):
+    """
+    Reverse index entry from a short code to the QR code it tracks, stored under the short code
+    """
+    short_code: str
+    qr_code_id: str
+    store_hash: str
+    created_at: int = Field(default_factory=lambda: int(time.time()))
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Convert model to a dictionary suitable for Firestore
+        """
+        return self.dict()
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'QRShortCode':
+        """
+        Create a QRShortCode instance from a Firestore document
+        """
+        return cls(**data)
+
+
+class ResolvedQRCode(BaseModel):
+    """
+    The subset of a QR code needed to serve a scan redirect
+    """
+    id: str
+    store_hash: str
+    target_url: Optional[str] = None
+    active: bool = True
+
+    @classmethod
+    def from_qr_code(cls, qr_code: QRCode) -> 'ResolvedQRCode':
+        """
+        Build a resolved entry from a full QR code
+        """
+        return cls(
+            id=qr_code.id,
+            store_hash=qr_code.store_hash,
+            target_url=qr_code.target.url if qr_code.target else None,
+            active=qr_code.active
+        )
+
+
 # Initialize the repository
 qr_code_repo = FirestoreRepository[QRCode](collection_name="qr_codes", model_class=QRCode)
+short_code_repo = FirestoreRepository[QRShortCode](collection_name="qr_short_codes", model_class=QRShortCode)
+
+# Fields maintained with atomic increments, never written back from a model that was read earlier
+COUNTER_FIELDS = {"scan_count", "counter_shards"}
+
+# Error correction of the stored matrix, the default of /qr-image renders
+QR_MATRIX_ERROR_CORRECTION = "M"
+
+
+def assign_short_code(qr_code: QRCode) -> Optional[str]:
+    """
+    Reserve a unique short code for a new QR code
+    
+    Each candidate is claimed by creating its reverse index document, which fails
+    atomically if the code is taken, so a collision just draws another code. If
+    no code can be reserved the QR code keeps its UUID tracking URL.
+    
+    Args:
+        qr_code: The QR code, updated in place with the short code
+    
+    Returns:
+        The short code, or None if none could be reserved
+    """
+    for attempt in range(QR_SHORT_CODE_ATTEMPTS):
+        short_code = generate_short_code()
+        try:
+            created = short_code_repo.create(
+                QRShortCode(short_code=short_code, qr_code_id=qr_code.id, store_hash=qr_code.store_hash),
+                document_id=short_code
+            )
+        except Exception as e:
+            print(f"[QR CODE] Error reserving short code for {qr_code.id}: {str(e)}")
+            return None
+        if created:
+            qr_code.short_code = short_code
+            return short_code
+        print(f"[QR CODE] Short code collision on attempt {attempt + 1} for {qr_code.id}")
+    print(f"[QR CODE] No free short code after {QR_SHORT_CODE_ATTEMPTS} attempts, {qr_code.id} keeps its UUID tracking URL")
+    return None
+
+
+def save_new_qr_code(qr_code: QRCode) -> str:
+    """
+    Reserve a short code for a new QR code and save it
+
+    Short tracking URLs need a smaller QR version, and the URL is encoded once so
+    image renders can skip it. The reserved short code is released again if the
+    QR code cannot be saved, so no reverse index entry points to a missing code.
+
+    Returns:
+        The document ID of the saved QR code
+    """
+    assign_short_code(qr_code)
+    ensure_qr_matrix(qr_code, persist=False)
+    try:
+        return qr_code_repo.add(qr_code, document_id=qr_code.id)
+    except Exception:
+        if qr_code.short_code:
+            short_code_repo.delete(qr_code.short_code)
+        raise
+
+
+def get_qr_code_id_for_short_code(short_code: str) -> Optional[str]:
+    """
+    Look up the QR code ID a short code tracks
+    """
+    entry = short_code_repo.get(short_code)
+    return entry.qr_code_id if entry else None
+
+
+def invalidate_qr_resolution(qr_code: QRCode) -> None:
+    """
+    Drop a QR code's cached redirect under both of its tracking IDs
+    """
+    qr_resolution_cache.invalidate(qr_code.id)
+    if qr_code.short_code:
+        qr_resolution_cache.invalidate(qr_code.short_code)
+    qr_document_id_cache.invalidate(qr_code.id)
+
+
+def ensure_qr_matrix(qr_code: QRCode, document_id: Optional[str] = None, persist: bool = True) -> Optional[QRMatrix]:
+    """
+    Get the precomputed matrix of a QR code's tracking URL, computing it if missing or stale
+    
+    The tracking URL of a saved QR code never changes, so it is encoded once and
+    renders reuse the stored modules instead of encoding and scoring mask patterns
+    again. Codes created before matrices were stored are backfilled on first use.
+    
+    Args:
+        qr_code: The QR code, updated in place with the matrix
+        document_id: The document storing the QR code, defaults to its ID
+        persist: Whether to save a newly computed matrix to the document
+    
+    Returns:
+        The matrix, or None if the data could not be encoded
+    """
+    data = get_absolute_scan_url(qr_code.get_tracking_id())
+    if qr_code.matrix is not None and qr_code.matrix.matches(data, QR_MATRIX_ERROR_CORRECTION):
+        return qr_code.matrix
+
+    try:
+        qr_code.matrix = encode_matrix(data, QR_MATRIX_ERROR_CORRECTION)
+    except Exception as e:
+        print(f"[QR CODE] Error encoding matrix for {qr_code.id}: {str(e)}")
+        return None
+
+    if persist:
+        try:
+            qr_code_repo.collection.document(document_id or qr_code.id).update({"matrix": qr_code.matrix.dict()})
+            print(f"[QR CODE] Backfilled matrix for {qr_code.id}")
+        except Exception as e:
+            print(f"[QR CODE] Error saving matrix for {qr_code.id}: {str(e)}")
+    return qr_code.matrix
+
+
+def get_qr_document_id(qr_code_id: str) -> Optional[str]:
+    """
+    Get the ID of the document storing a QR code, which differs from the QR code ID for legacy codes
+    
+    Returns:
+        The document ID, or None if the QR code does not exist
+    """
+    document_id = qr_document_id_cache.get(qr_code_id)
+    if document_id is None:
+        found = qr_code_repo.get_with_document_id(qr_code_id)
+        if not found:
+            return None
+        document_id = found[0]
+        qr_document_id_cache.set(qr_code_id, document_id)
+    return document_id
+
+
+def get_scan_count(qr_code: QRCode) -> int:
+    """
+    Get a QR code's scan count, summing its counter shards if it is sharded
+    """
+    if not qr_code.counter_shards:
+        return qr_code.scan_count
+    doc_ref = qr_code_repo.collection.document(get_qr_document_id(qr_code.id) or qr_code.id)
+    return read_sharded_document(doc_ref, {"scan_count": qr_code.scan_count, "counter_shards": qr_code.counter_shards}).get("scan_count", 0)
+
+
+# Cache of resolved redirect targets for the /track hot path, keyed by QR code ID
+QR_RESOLUTION_CACHE_SIZE = 10000
+QR_RESOLUTION_CACHE_TTL_SECONDS = 300
+qr_resolution_cache = TTLCache(
+    name="qr_resolution",
+    max_entries=QR_RESOLUTION_CACHE_SIZE,
+    ttl_seconds=QR_RESOLUTION_CACHE_TTL_SECONDS
+)
+
+# Document IDs of QR codes, which never change, for counter writes to legacy documents
+QR_DOCUMENT_ID_CACHE_SIZE = 10000
+QR_DOCUMENT_ID_CACHE_TTL_SECONDS = 3600
+qr_document_id_cache = TTLCache(
+    name="qr_document_ids",
+    max_entries=QR_DOCUMENT_ID_CACHE_SIZE,
+    ttl_seconds=QR_DOCUMENT_ID_CACHE_TTL_SECONDS
+)
+
+# Display names of QR codes for analytics, one entry per store mapping QR code ID to name
+QR_NAME_CACHE_SIZE = 1000
+QR_NAME_CACHE_TTL_SECONDS = 600
+qr_name_cache = TTLCache(
+    name="qr_names",
+    max_entries=QR_NAME_CACHE_SIZE,
+    ttl_seconds=QR_NAME_CACHE_TTL_SECONDS
+)
+
+
+def get_qr_code_names(store_hash: str, qr_code_ids: List[str]) -> Dict[str, str]:
+    """
+    Get the names of a store's QR codes, fetching the ones not cached yet in bulk
+    
+    Args:
+        store_hash: The store the QR codes belong to
+        qr_code_ids: IDs of the QR codes to name
+    
+    Returns:
+        Dictionary of QR code ID to name for the QR codes that were found
+    """
+    names = qr_name_cache.get(store_hash) or {}
+    missing = [qr_id for qr_id in dict.fromkeys(qr_code_ids) if qr_id not in names]
+    if missing:
+        fetched = qr_code_repo.get_many(missing)
+        if fetched:
+            names = dict(names)
+            names.update({qr_id: qr_code.name for qr_id, qr_code in fetched.items()})
+            qr_name_cache.set(store_hash, names)
+    return {qr_id: names[qr_id] for qr_id in qr_code_ids if qr_id in names}
+
 
 # List endpoint for QR codes
 @router.get("/list/{store_hash}") # Maps to /qr-code/list/{store_hash}
@@ -114,9 +380,11 @@ async def list_qr_codes(store_hash: str, limit: int = 100, offset: int = 0):
                     "type": qr.type,
                     "url": qr.target.url,
                     "created_at": qr.created_at,
-                    "scan_count": qr.scan_count,
+                    "scan_count": get_scan_count(qr),
                     "active": qr.active,
-                    "status": qr.status
+                    "status": qr.status,
+                    "short_code": qr.short_code,
+                    "tracking_url": get_absolute_scan_url(qr.get_tracking_id())
                 } for qr in filtered_qr_codes
             ],
             "total": len(filtered_qr_codes),
@@ -237,8 +505,8 @@ async def create_product_qr_code(request: ProductQRCodeRequest):
             campaign_id=request.campaign_id
         )
 
-        # Save the QR code to the database
-        qr_code_id = qr_code_repo.add(qr_code, document_id=qr_code.id)
+        # Save the QR code to the database with its short code
+        qr_code_id = save_new_qr_code(qr_code)
 
         return QRCodeResponse(
             id=qr_code_id,
@@ -281,8 +549,8 @@ async def create_category_qr_code(request: CategoryQRCodeRequest):
             campaign_id=request.campaign_id
         )
 
-        # Save the QR code to the database
-        qr_code_id = qr_code_repo.add(qr_code, document_id=qr_code.id)
+        # Save the QR code to the database with its short code
+        qr_code_id = save_new_qr_code(qr_code)
 
         return QRCodeResponse(
             id=qr_code_id,
@@ -322,8 +590,8 @@ async def create_homepage_qr_code(request: HomepageQRCodeRequest):
             campaign_id=request.campaign_id
         )
 
-        # Save the QR code to the database
-        qr_code_id = qr_code_repo.add(qr_code, document_id=qr_code.id)
+        # Save the QR code to the database with its short code
+        qr_code_id = save_new_qr_code(qr_code)
 
         return QRCodeResponse(
             id=qr_code_id,
@@ -343,15 +611,15 @@ async def update_qr_code(qr_code_id: str = Path(..., description="The ID of the
     Update an existing QR code's properties
     """
     try:
-        # Get the existing QR code
-        qr_codes = qr_code_repo.query_by_field("id", qr_code_id)
-        if not qr_codes:
+        # Get the existing QR code and the document that stores it
+        found = qr_code_repo.get_with_document_id(qr_code_id)
+        if not found:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail=f"QR code with ID {qr_code_id} not found"
             )
 
-        qr_code = qr_codes[0]
+        firestore_doc_id, qr_code = found
 
         # Update fields if provided
         if request.name is not None:
@@ -370,7 +638,9 @@ async def update_qr_code(qr_code_id: str = Path(..., description="The ID of the
         qr_code.updated_at = int(time.time())
 
         # Save the updated QR code
-        qr_code_repo.update(qr_code.id, qr_code)
+        qr_code_repo.update(firestore_doc_id, qr_code, exclude=COUNTER_FIELDS)
+        invalidate_qr_resolution(qr_code)
+        qr_name_cache.invalidate(qr_code.store_hash)
 
         return QRCodeResponse(
             id=qr_code.id,
@@ -395,13 +665,13 @@ async def delete_qr_code(qr_code_id: str = Path(..., description="The ID of the
     try:
         print(f"[DELETE QR] Received request to delete QR code with ID: {qr_code_id}, hard_delete={hard_delete}")
         
-        # First try to find the QR code by its ID field
-        print(f"[DELETE QR] Querying for QR code with field 'id'={qr_code_id}")
-        qr_codes = qr_code_repo.query_by_field("id", qr_code_id)
+        # First try a point read by document ID, falling back to the ID field query
+        print(f"[DELETE QR] Looking up QR code with ID {qr_code_id}")
+        found = qr_code_repo.get_with_document_id(qr_code_id)
         
-        if not qr_codes:
-            # Try a brute-force approach if the query_by_field doesn't work (might be an indexing issue)
-            print(f"[DELETE QR] Could not find QR code via query_by_field, trying collection scan")
+        if not found:
+            # Try a brute-force approach if the lookup doesn't work (might be an indexing issue)
+            print(f"[DELETE QR] Could not find QR code via get_with_document_id, trying collection scan")
             
             # Scan all documents in the collection (not efficient, but guaranteed to find it if it exists)
             docs = list(qr_code_repo.collection.stream())
@@ -419,23 +689,8 @@ async def delete_qr_code(qr_code_id: str = Path(..., description="The ID of the
                     detail=f"QR code with ID {qr_code_id} not found"
                 )
         else:
-            print(f"[DELETE QR] Found QR code with ID: {qr_code_id} using ID field query")
-            qr_code = qr_codes[0]
-            
-            # Get the Firestore document ID
-            doc_query = qr_code_repo.collection.where(filter=FieldFilter("id", "==", qr_code_id))
-            docs = list(doc_query.stream())
-            
-            if docs:
-                firestore_doc_id = docs[0].id
-                print(f"[DELETE QR] Found Firestore document ID: {firestore_doc_id} for QR code ID: {qr_code_id}")
-            else:
-                # If we found the model but not the document, it's a data inconsistency
-                print(f"[DELETE QR] WARNING: Found QR code model but couldn't find Firestore document")
-                raise HTTPException(
-                    status_code=status.HTTP_404_NOT_FOUND,
-                    detail=f"QR code document with ID {qr_code_id} not found"
-                )
+            firestore_doc_id, qr_code = found
+            print(f"[DELETE QR] Found Firestore document ID: {firestore_doc_id} for QR code ID: {qr_code_id}")
         
         # Always mark QR code as inactive
         qr_code.active = False
@@ -454,15 +709,16 @@ async def delete_qr_code(qr_code_id: str = Path(..., description="The ID of the
             qr_code.status = "inactive"
         
         # Update the document in Firestore (NEVER delete!)
-        update_result = qr_code_repo.update(firestore_doc_id, qr_code)
+        update_result = qr_code_repo.update(firestore_doc_id, qr_code, exclude=COUNTER_FIELDS)
+        invalidate_qr_resolution(qr_code)
+        qr_name_cache.invalidate(qr_code.store_hash)
         print(f"[DELETE QR] Update result: {update_result}")
         
-        # Verify the update by trying to fetch the QR code again
-        verify_query = qr_code_repo.collection.where(filter=FieldFilter("id", "==", qr_code_id))
-        verify_docs = list(verify_query.stream())
+        # Verify the update by reading the document again
+        verify_doc = qr_code_repo.collection.document(firestore_doc_id).get()
         
-        if verify_docs:
-            updated_doc = verify_docs[0].to_dict()
+        if verify_doc.exists:
+            updated_doc = verify_doc.to_dict()
             updated_status = updated_doc.get('status', 'active')
             updated_active = updated_doc.get('active', True)
             print(f"[DELETE QR] Verification check - QR code status={updated_status}, active={updated_active}")
@@ -508,8 +764,8 @@ async def create_custom_url_qr_code(request: CustomURLQRCodeRequest):
             campaign_id=request.campaign_id
         )
 
-        # Save the QR code to the database
-        qr_code_id = qr_code_repo.add(qr_code, document_id=qr_code.id)
+        # Save the QR code to the database with its short code
+        qr_code_id = save_new_qr_code(qr_code)
 
         return QRCodeResponse(
             id=qr_code_id,
@@ -555,6 +811,7 @@ async def create_test_qr_code2(request: Request = None):
             ),
             style=QRCodeStyle()
         )
+        ensure_qr_matrix(qr_code, persist=False)
 
         # Save the QR code to the database
         qr_code_repo.add(qr_code, document_id=qr_code.id)
@@ -1,8 +1,13 @@
-from fastapi import APIRouter, HTTPException, File, UploadFile, Path, Query, Response
+from fastapi import APIRouter, HTTPException, File, Form, UploadFile, Path, Query
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from typing import Optional, Literal
+from typing import Callable, Optional, Literal
+from starlette.concurrency import run_in_threadpool
+from firebase_admin import firestore
 import databutton as db
+import hashlib
+import json
+import os
 import time
 import uuid
 import re
@@ -11,6 +16,18 @@ from app.apis.firestore_repository import FirestoreRepository
 
 router = APIRouter(prefix="/qr-file-storage", tags=["qr-file-storage"])
 
+# Files are stored as blobs of at most this many bytes, so no request holds a whole file in memory
+FILE_CHUNK_SIZE = 1024 * 1024
+
+# Bytes read from an upload at a time
+UPLOAD_READ_SIZE = 64 * 1024
+
+# Largest accepted file
+MAX_UPLOAD_BYTES = int(os.environ.get("QR_FILE_MAX_UPLOAD_BYTES", str(50 * 1024 * 1024)))
+
+# Unreferenced blobs are kept this long before garbage collection, so a save of the same bytes racing the collector is unlikely
+BLOB_GC_GRACE_SECONDS = 3600
+
 def sanitize_storage_key(key: str) -> str:
     """Sanitize storage key to only allow alphanumeric and ._- symbols"""
     return re.sub(r'[^a-zA-Z0-9._-]', '', key)
@@ -25,6 +42,19 @@ class QRGeneratedFile(BaseModel):
     file_key: str    # storage key for the file
     created_at: int
     file_size: int   # size in bytes
+    chunk_count: int = 0  # number of chunk blobs, 0 for files stored as one blob under file_key
+    sha256: Optional[str] = None  # hex digest of the file bytes
+    
+class QRFileBlob(BaseModel):
+    """Content-addressed file bytes, shared by every generated file with the same sha256"""
+    sha256: str
+    file_key: str     # storage key prefix of the chunks
+    file_size: int
+    chunk_count: int
+    ref_count: int = 0  # number of generated files referencing the blob
+    created_at: int
+    updated_at: int   # last time ref_count changed
+    status: str = "active"  # "active", or "deleting" once garbage collection has claimed it
     
 class SaveFileRequest(BaseModel):
     """Request model for saving generated QR file"""
@@ -42,92 +72,454 @@ class SaveFileResponse(BaseModel):
 
 # Initialize file metadata repository
 file_repo = FirestoreRepository[QRGeneratedFile](collection_name="qr_generated_files", model_class=QRGeneratedFile)
+blob_repo = FirestoreRepository[QRFileBlob](collection_name="qr_file_blobs", model_class=QRFileBlob)
 
 def generate_style_hash(style_config: dict) -> str:
     """Generate a hash from style configuration for cache invalidation"""
-    import hashlib
-    import json
-    
     # Sort the config to ensure consistent hashing
     sorted_config = json.dumps(style_config, sort_keys=True)
     return hashlib.md5(sorted_config.encode()).hexdigest()[:8]
 
+
+def get_chunk_key(file_key: str, index: int) -> str:
+    """Get the storage key of one chunk of a file"""
+    return f"{file_key}_chunk{index}"
+
+
+class ChunkedFileWriter:
+    """
+    Writes a file to binary storage in FILE_CHUNK_SIZE blobs while hashing it
+    
+    At most one chunk is buffered, so memory stays bounded whatever the file size.
+    """
+    
+    def __init__(self, file_key: str):
+        self.file_key = file_key
+        self.chunk_count = 0
+        self.file_size = 0
+        self._hash = hashlib.sha256()
+        self._buffer = bytearray()
+    
+    @property
+    def sha256(self) -> str:
+        return self._hash.hexdigest()
+    
+    def write(self, data: bytes) -> None:
+        """
+        Append data, storing every chunk that fills up
+        
+        Raises:
+            HTTPException: If the file grows past MAX_UPLOAD_BYTES
+        """
+        self.file_size += len(data)
+        if self.file_size > MAX_UPLOAD_BYTES:
+            raise HTTPException(status_code=413, detail=f"File is larger than {MAX_UPLOAD_BYTES} bytes")
+        self._hash.update(data)
+        self._buffer.extend(data)
+        while len(self._buffer) >= FILE_CHUNK_SIZE:
+            self._put_chunk(bytes(self._buffer[:FILE_CHUNK_SIZE]))
+            del self._buffer[:FILE_CHUNK_SIZE]
+    
+    def close(self) -> None:
+        """
+        Store the last, partial chunk
+        """
+        if self._buffer or self.chunk_count == 0:
+            self._put_chunk(bytes(self._buffer))
+            self._buffer = bytearray()
+    
+    def _put_chunk(self, chunk: bytes) -> None:
+        db.storage.binary.put(get_chunk_key(self.file_key, self.chunk_count), chunk)
+        self.chunk_count += 1
+
+
+def iter_file_chunks(file_metadata: QRGeneratedFile):
+    """
+    Yield the bytes of a stored file one chunk at a time
+    """
+    if file_metadata.chunk_count == 0:
+        # Stored as a single blob before chunked storage
+        yield db.storage.binary.get(file_metadata.file_key)
+        return
+    for index in range(file_metadata.chunk_count):
+        yield db.storage.binary.get(get_chunk_key(file_metadata.file_key, index))
+
+
+def get_blob_key(sha256: str) -> str:
+    """Get the storage key prefix of blobs holding bytes with this sha256"""
+    return f"qr_blob_{sha256}"
+
+
+def new_blob_key(sha256: str) -> str:
+    """
+    Get a storage key for a new blob of bytes with this sha256
+    
+    Each stored copy gets its own key, so deleting the chunks of a collected blob
+    can never remove chunks written by a later save of the same bytes.
+    """
+    return f"{get_blob_key(sha256)}_{uuid.uuid4().hex[:8]}"
+
+
+def is_blob_key(file_key: str, sha256: str) -> bool:
+    """Check whether a file's storage key is a shared blob's rather than the file's own"""
+    blob_key = get_blob_key(sha256)
+    return file_key == blob_key or file_key.startswith(f"{blob_key}_")
+
+
+def hash_file(fileobj) -> tuple:
+    """
+    Hash a file object in UPLOAD_READ_SIZE pieces
+    
+    Returns:
+        Tuple of (sha256 hex digest, size in bytes)
+    
+    Raises:
+        HTTPException: If the file is larger than MAX_UPLOAD_BYTES
+    """
+    digest = hashlib.sha256()
+    file_size = 0
+    while True:
+        data = fileobj.read(UPLOAD_READ_SIZE)
+        if not data:
+            break
+        file_size += len(data)
+        if file_size > MAX_UPLOAD_BYTES:
+            raise HTTPException(status_code=413, detail=f"File is larger than {MAX_UPLOAD_BYTES} bytes")
+        digest.update(data)
+    return digest.hexdigest(), file_size
+
+
+def delete_storage_key(key: str) -> bool:
+    """
+    Delete a key from binary storage, if the storage client supports deletes
+    """
+    delete = getattr(db.storage.binary, "delete", None)
+    if delete is None:
+        return False
+    try:
+        delete(key)
+        return True
+    except Exception as e:
+        print(f"[QR FILE STORAGE] Warning: Could not delete {key} from storage: {str(e)}")
+        return False
+
+
+def delete_file_chunks(file_key: str, chunk_count: int) -> bool:
+    """
+    Delete the stored bytes of a file, returning whether every key was deleted
+    """
+    keys = [file_key] if chunk_count == 0 else [get_chunk_key(file_key, index) for index in range(chunk_count)]
+    return all([delete_storage_key(key) for key in keys])
+
+
+def find_duplicate_file(qr_code_id: str, format: str, size: int, style_hash: str, sha256: str) -> Optional[QRGeneratedFile]:
+    """
+    Find a saved file of a QR code with identical bytes, format, size and style
+    """
+    for generated_file in file_repo.query_by_field("qr_code_id", qr_code_id):
+        if (generated_file.sha256 == sha256 and generated_file.format == format
+                and generated_file.size == size and generated_file.style_hash == style_hash):
+            return generated_file
+    return None
+
+
+def reference_blob(sha256: str) -> Optional[QRFileBlob]:
+    """
+    Add a reference to the stored blob with this sha256, if there is one that is not being deleted
+    
+    The check and the increment are one transaction, so garbage collection cannot
+    claim the blob in between, and a blob deleted in the meantime is just missing.
+    """
+    doc_ref = blob_repo.collection.document(sha256)
+    
+    def add_reference(transaction) -> Optional[QRFileBlob]:
+        snapshot = doc_ref.get(transaction=transaction)
+        if not snapshot.exists:
+            return None
+        blob = QRFileBlob(**snapshot.to_dict())
+        if blob.status == "deleting":
+            return None
+        transaction.update(doc_ref, {"ref_count": firestore.Increment(1), "updated_at": int(time.time())})
+        return blob
+    
+    return blob_repo.run_transaction(add_reference)
+
+
+def release_blob(file_metadata: QRGeneratedFile) -> None:
+    """
+    Drop a deleted file's reference to its blob; unreferenced blobs are removed by garbage collection
+    """
+    if file_metadata.sha256 and is_blob_key(file_metadata.file_key, file_metadata.sha256):
+        blob_repo.collection.document(file_metadata.sha256).update({"ref_count": firestore.Increment(-1), "updated_at": int(time.time())})
+    elif not delete_file_chunks(file_metadata.file_key, file_metadata.chunk_count):
+        # Files saved before deduplication own their bytes
+        print(f"[QR FILE STORAGE] Warning: Could not delete {file_metadata.file_key} from storage")
+
+
+def store_blob(sha256: str, write: Callable[[ChunkedFileWriter], None]) -> QRFileBlob:
+    """
+    Reference the blob with this sha256, storing it first if it is new
+    
+    Bytes are written under a new storage key and recorded in a transaction. If a
+    concurrent save recorded the same bytes first, this save references that blob
+    and deletes its own chunks. A blob being garbage-collected is never reused:
+    its record is replaced by the newly stored copy.
+    
+    Args:
+        sha256: Hash of the file bytes
+        write: Writes the file bytes to the writer it is given
+    """
+    blob = reference_blob(sha256)
+    if blob is not None:
+        print(f"[QR FILE STORAGE] Reusing stored blob {sha256} ({blob.file_size} bytes)")
+        return blob
+
+    writer = ChunkedFileWriter(new_blob_key(sha256))
+    write(writer)
+    writer.close()
+    if writer.sha256 != sha256:
+        delete_file_chunks(writer.file_key, writer.chunk_count)
+        raise ValueError("File changed while it was being stored")
+
+    now = int(time.time())
+    stored = QRFileBlob(
+        sha256=sha256,
+        file_key=writer.file_key,
+        file_size=writer.file_size,
+        chunk_count=writer.chunk_count,
+        ref_count=1,
+        created_at=now,
+        updated_at=now
+    )
+    doc_ref = blob_repo.collection.document(sha256)
+    
+    def record_blob(transaction) -> QRFileBlob:
+        snapshot = doc_ref.get(transaction=transaction)
+        if snapshot.exists:
+            existing = QRFileBlob(**snapshot.to_dict())
+            if existing.status != "deleting":
+                transaction.update(doc_ref, {"ref_count": firestore.Increment(1), "updated_at": int(time.time())})
+                return existing
+        transaction.set(doc_ref, stored.dict())
+        return stored
+    
+    blob = blob_repo.run_transaction(record_blob)
+    if blob.file_key != stored.file_key:
+        print(f"[QR FILE STORAGE] Blob {sha256} was stored concurrently, dropping duplicate chunks")
+        delete_file_chunks(stored.file_key, stored.chunk_count)
+    return blob
+
+
+def claim_blob_for_deletion(sha256: str, cutoff: int) -> Optional[QRFileBlob]:
+    """
+    Mark an unreferenced blob as being deleted, if it still is unreferenced
+    
+    The reference count check and the status change are one transaction, so a
+    save either references the blob before the claim or sees it being deleted
+    and stores its bytes again.
+    
+    Args:
+        sha256: Hash of the blob's bytes
+        cutoff: Only claim blobs unreferenced since this timestamp
+    
+    Returns:
+        The claimed blob, or None if it is referenced, recent or gone
+    """
+    doc_ref = blob_repo.collection.document(sha256)
+    
+    def claim(transaction) -> Optional[QRFileBlob]:
+        snapshot = doc_ref.get(transaction=transaction)
+        if not snapshot.exists:
+            return None
+        blob = QRFileBlob(**snapshot.to_dict())
+        if blob.ref_count > 0:
+            return None
+        if blob.status == "deleting":
+            # Claimed by a collection that did not finish
+            return blob
+        if blob.updated_at > cutoff:
+            return None
+        transaction.update(doc_ref, {"status": "deleting", "updated_at": int(time.time())})
+        blob.status = "deleting"
+        return blob
+    
+    return blob_repo.run_transaction(claim)
+
+
+def remove_blob_record(blob: QRFileBlob) -> None:
+    """
+    Delete the record of a collected blob unless a save has replaced it with a new copy
+    """
+    doc_ref = blob_repo.collection.document(blob.sha256)
+    
+    def remove(transaction) -> None:
+        snapshot = doc_ref.get(transaction=transaction)
+        if snapshot.exists and snapshot.to_dict().get("file_key") == blob.file_key:
+            transaction.delete(doc_ref)
+    
+    blob_repo.run_transaction(remove)
+
+
+def save_file(
+    qr_code_id: str,
+    format: str,
+    size: int,
+    style_config: dict,
+    sha256: str,
+    write: Callable[[ChunkedFileWriter], None]
+) -> SaveFileResponse:
+    """
+    Save a generated file, deduplicating by content
+    
+    A file identical to one already saved for the QR code returns the existing
+    file. Otherwise a new file record references the blob with the same bytes,
+    which is only written if no file stored those bytes yet.
+    
+    Args:
+        qr_code_id: The QR code the file was generated for
+        format: Format of the file
+        size: Pixel size of the QR code in the file
+        style_config: Style configuration, used for the style hash
+        sha256: Hash of the file bytes
+        write: Writes the file bytes to the writer it is given
+    """
+    style_hash = generate_style_hash(style_config)
+    duplicate = find_duplicate_file(qr_code_id, format, size, style_hash, sha256)
+    if duplicate is not None:
+        print(f"[QR FILE STORAGE] Identical file {duplicate.id} already saved for QR {qr_code_id}")
+        return SaveFileResponse(
+            status="success",
+            file_id=duplicate.id,
+            download_url=f"/qr-file-storage/download/{duplicate.id}",
+            message=f"Identical {format.upper()} file already saved"
+        )
+
+    blob = store_blob(sha256, write)
+    file_id = str(uuid.uuid4())
+    generated_file = QRGeneratedFile(
+        id=file_id,
+        qr_code_id=qr_code_id,
+        format=format,
+        size=size,
+        style_hash=style_hash,
+        file_key=blob.file_key,
+        created_at=int(time.time()),
+        file_size=blob.file_size,
+        chunk_count=blob.chunk_count,
+        sha256=sha256
+    )
+    file_repo.add(generated_file, document_id=file_id)
+    print(f"[QR FILE STORAGE] Saved file for QR {qr_code_id}: {blob.file_key} ({blob.file_size} bytes in {blob.chunk_count} chunks)")
+
+    return SaveFileResponse(
+        status="success",
+        file_id=file_id,
+        download_url=f"/qr-file-storage/download/{file_id}",
+        message=f"File saved successfully as {format.upper()}"
+    )
+
 @router.post("/save/{qr_code_id}", response_model=SaveFileResponse)
 async def save_generated_file(
     qr_code_id: str = Path(..., description="The QR code ID"),
     request: SaveFileRequest = None
 ):
     """
-    Save a generated QR code file to storage
+    Save a generated QR code file sent as base64 in a JSON body to storage
+    
+    Kept for existing clients; /upload/{qr_code_id} takes the file as multipart
+    form data without the base64 overhead and without buffering it in memory.
     """
     try:
         # Verify QR code exists
-        qr_codes = qr_code_repo.query_by_field("id", qr_code_id)
-        if not qr_codes:
+        qr_code = await run_in_threadpool(qr_code_repo.get_by_id, qr_code_id)
+        if qr_code is None:
             raise HTTPException(status_code=404, detail="QR code not found")
-            
-        qr_code = qr_codes[0]
-        
-        # Generate style hash for cache invalidation
-        style_hash = generate_style_hash(request.style_config)
         
-        # Create unique file ID
-        file_id = str(uuid.uuid4())
-        
-        # Create storage key
-        file_key = sanitize_storage_key(f"qr_files_{qr_code_id}_{file_id}_{request.format}")
-        
-        # Decode base64 file data
-        import base64
-        try:
-            if request.file_data.startswith('data:'):
-                # Handle data URL format (data:image/png;base64,xxxxx)
-                header, data = request.file_data.split(',', 1)
-                file_bytes = base64.b64decode(data)
-            else:
-                # Handle raw base64
-                file_bytes = base64.b64decode(request.file_data)
-        except Exception as e:
-            raise HTTPException(status_code=400, detail=f"Invalid file data format: {str(e)}")
+        def decode_and_save() -> SaveFileResponse:
+            # Decode base64 file data
+            import base64
+            try:
+                if request.file_data.startswith('data:'):
+                    # Handle data URL format (data:image/png;base64,xxxxx)
+                    header, data = request.file_data.split(',', 1)
+                    file_bytes = base64.b64decode(data)
+                else:
+                    # Handle raw base64
+                    file_bytes = base64.b64decode(request.file_data)
+            except Exception as e:
+                raise HTTPException(status_code=400, detail=f"Invalid file data format: {str(e)}")
+            
+            return save_file(
+                qr_code_id, request.format, request.size, request.style_config,
+                hashlib.sha256(file_bytes).hexdigest(),
+                lambda writer: writer.write(file_bytes)
+            )
         
-        # Save file to binary storage
-        db.storage.binary.put(file_key, file_bytes)
+        # Decoding, hashing and storage writes are blocking, keep them off the event loop
+        return await run_in_threadpool(decode_and_save)
         
-        # Create file metadata
-        generated_file = QRGeneratedFile(
-            id=file_id,
-            qr_code_id=qr_code_id,
-            format=request.format,
-            size=request.size,
-            style_hash=style_hash,
-            file_key=file_key,
-            created_at=int(time.time()),
-            file_size=len(file_bytes)
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        print(f"[QR FILE STORAGE] Error saving file: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error saving file: {str(e)}"
         )
+
+@router.post("/upload/{qr_code_id}", response_model=SaveFileResponse)
+async def upload_generated_file(
+    qr_code_id: str = Path(..., description="The QR code ID"),
+    file: UploadFile = File(..., description="The generated file"),
+    format: Literal["png", "svg", "pdf"] = Form(..., description="Format of the file"),
+    size: int = Form(..., description="Pixel size of the QR code in the file"),
+    style_config: str = Form("{}", description="JSON style configuration, used for the style hash")
+):
+    """
+    Save a generated QR code file uploaded as multipart form data
+    
+    The upload is spooled to a temporary file by the form parser, hashed in small
+    pieces, and only written to storage in FILE_CHUNK_SIZE chunks if no stored
+    file has the same bytes, so peak memory per upload is about one chunk
+    whatever the file size.
+    """
+    try:
+        try:
+            style = json.loads(style_config)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid style_config: {str(e)}")
         
-        # Save metadata to Firestore
-        file_repo.add(generated_file, document_id=file_id)
+        # Verify QR code exists
+        qr_code = await run_in_threadpool(qr_code_repo.get_by_id, qr_code_id)
+        if qr_code is None:
+            raise HTTPException(status_code=404, detail="QR code not found")
         
-        # Construct download URL
-        download_url = f"/qr-file-storage/download/{file_id}"
+        def write_upload(writer: ChunkedFileWriter) -> None:
+            file.file.seek(0)
+            while True:
+                data = file.file.read(UPLOAD_READ_SIZE)
+                if not data:
+                    break
+                writer.write(data)
         
-        print(f"[QR FILE STORAGE] Saved file for QR {qr_code_id}: {file_key} ({len(file_bytes)} bytes)")
+        def hash_and_save() -> SaveFileResponse:
+            file.file.seek(0)
+            sha256, _ = hash_file(file.file)
+            return save_file(qr_code_id, format, size, style, sha256, write_upload)
         
-        return SaveFileResponse(
-            status="success",
-            file_id=file_id,
-            download_url=download_url,
-            message=f"File saved successfully as {request.format.upper()}"
-        )
+        # Reading the spooled file and storage writes are blocking I/O, keep them off the event loop
+        return await run_in_threadpool(hash_and_save)
         
     except HTTPException as he:
         raise he
     except Exception as e:
-        print(f"[QR FILE STORAGE] Error saving file: {str(e)}")
+        print(f"[QR FILE STORAGE] Error uploading file: {str(e)}")
         raise HTTPException(
             status_code=500,
-            detail=f"Error saving file: {str(e)}"
+            detail=f"Error uploading file: {str(e)}"
         )
+    finally:
+        await file.close()
 
 @router.get("/download/{file_id}")
 async def download_generated_file(
@@ -143,12 +535,17 @@ async def download_generated_file(
         if not file_metadata:
             raise HTTPException(status_code=404, detail="File not found")
         
-        # Get file data from storage
+        # Fetch the first chunk up front so a missing file is still reported as 404
+        chunks = iter_file_chunks(file_metadata)
         try:
-            file_bytes = db.storage.binary.get(file_metadata.file_key)
+            first_chunk = await run_in_threadpool(next, chunks)
         except Exception as e:
             raise HTTPException(status_code=404, detail="File data not found in storage")
         
+        def stream_file():
+            yield first_chunk
+            yield from chunks
+        
         # Determine content type
         content_types = {
             "png": "image/png",
@@ -174,9 +571,10 @@ async def download_generated_file(
         
         print(f"[QR FILE STORAGE] Serving file {file_id}: {filename} ({file_metadata.file_size} bytes)")
         
-        # Return file as streaming response
-        return Response(
-            content=file_bytes,
+        # Stream the remaining chunks as they are read from storage
+        return StreamingResponse(
+            stream_file(),
+            media_type=content_type,
             headers=headers
         )
         
@@ -242,20 +640,18 @@ async def delete_generated_file(
         if not file_metadata:
             raise HTTPException(status_code=404, detail="File not found")
         
-        # Delete file from binary storage
-        try:
-            # Note: db.storage.binary doesn't have a delete method in the current implementation
-            # This is a limitation - files will remain in storage but metadata will be removed
-            pass
-        except Exception as e:
-            print(f"[QR FILE STORAGE] Warning: Could not delete file from storage: {str(e)}")
-        
         # Delete metadata from Firestore
         # Note: Using document ID for deletion
         try:
             file_repo.collection.document(file_id).delete()
         except Exception as e:
             print(f"[QR FILE STORAGE] Warning: Could not delete metadata: {str(e)}")
+        else:
+            # Release the stored bytes only once nothing points at them
+            try:
+                release_blob(file_metadata)
+            except Exception as e:
+                print(f"[QR FILE STORAGE] Warning: Could not release file blob: {str(e)}")
         
         return {
             "status": "success",
@@ -270,3 +666,94 @@ async def delete_generated_file(
             status_code=500,
             detail=f"Error deleting file: {str(e)}"
         )
+
+@router.post("/gc")
+def collect_unreferenced_blobs(
+    grace_seconds: int = Query(BLOB_GC_GRACE_SECONDS, ge=0, description="Only collect blobs unreferenced for at least this long"),
+    dry_run: bool = Query(False, description="Report what would be collected without deleting")
+):
+    """
+    Garbage-collect stored blobs that no generated file references anymore
+    
+    Blobs are removed only after being unreferenced for grace_seconds. Each one
+    is first claimed in a transaction that checks it is still unreferenced and
+    marks it as deleting, and its chunks are only deleted once the claim has
+    committed, so a save either keeps the blob or stores its bytes again.
+    """
+    cutoff = int(time.time()) - grace_seconds
+    collected = 0
+    reclaimed_bytes = 0
+    recent = 0
+    storage_errors = 0
+    
+    for blob in blob_repo.query_by_field("ref_count", 0, "<="):
+        if blob.updated_at > cutoff and blob.status != "deleting":
+            recent += 1
+            continue
+        if dry_run:
+            collected += 1
+            reclaimed_bytes += blob.file_size
+            continue
+        
+        claimed = claim_blob_for_deletion(blob.sha256, cutoff)
+        if claimed is None:
+            continue
+        collected += 1
+        reclaimed_bytes += claimed.file_size
+        if not delete_file_chunks(claimed.file_key, claimed.chunk_count):
+            # Keep the record so a later collection retries the chunks
+            storage_errors += 1
+            continue
+        remove_blob_record(claimed)
+    
+    print(f"[QR FILE STORAGE] Garbage collection{' (dry run)' if dry_run else ''}: "
+          f"{collected} blobs, {reclaimed_bytes} bytes, {recent} within grace period, {storage_errors} storage errors")
+    return {
+        "status": "success",
+        "dry_run": dry_run,
+        "collected_blobs": collected,
+        "reclaimed_bytes": reclaimed_bytes,
+        "skipped_recent": recent,
+        "storage_errors": storage_errors
+    }
+
+@router.get("/stats")
+def get_storage_stats():
+    """
+    Get how much storage deduplication saves
+    
+    The dedup ratio is the bytes of all saved files divided by the bytes actually
+    stored; files saved before deduplication count as stored on their own.
+    """
+    files = 0
+    logical_bytes = 0
+    legacy_bytes = 0
+    for doc in file_repo.collection.stream():
+        data = doc.to_dict()
+        files += 1
+        logical_bytes += data.get("file_size", 0)
+        if not data.get("sha256") or not is_blob_key(data.get("file_key", ""), data["sha256"]):
+            legacy_bytes += data.get("file_size", 0)
+    
+    blobs = 0
+    blob_bytes = 0
+    unreferenced_blobs = 0
+    unreferenced_bytes = 0
+    for doc in blob_repo.collection.stream():
+        data = doc.to_dict()
+        blobs += 1
+        blob_bytes += data.get("file_size", 0)
+        if data.get("ref_count", 0) <= 0:
+            unreferenced_blobs += 1
+            unreferenced_bytes += data.get("file_size", 0)
+    
+    stored_bytes = blob_bytes + legacy_bytes
+    return {
+        "files": files,
+        "logical_bytes": logical_bytes,
+        "blobs": blobs,
+        "stored_bytes": stored_bytes,
+        "unreferenced_blobs": unreferenced_blobs,
+        "unreferenced_bytes": unreferenced_bytes,
+        "dedup_ratio": round(logical_bytes / stored_bytes, 3) if stored_bytes else None
+    }
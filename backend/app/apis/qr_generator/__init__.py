@@ -1,23 +1,20 @@
-from fastapi import APIRouter, Path, Query, HTTPException
+from fastapi import APIRouter, Path, Query, HTTPException, Header
 from fastapi.responses import Response, StreamingResponse
-from typing import Optional, Literal
-import qrcode
-from qrcode.image.styledpil import StyledPilImage
-from qrcode.image.styles.moduledrawers import (
-    RoundedModuleDrawer, 
-    CircleModuleDrawer, 
-    SquareModuleDrawer,
-    GappedSquareModuleDrawer,
-    HorizontalBarsDrawer,
-    VerticalBarsDrawer
-)
-from qrcode.image.styles.colormasks import SolidFillColorMask
-import qrcode.image.svg
-import io
-import svgwrite
-import math
-from PIL import Image, ImageDraw
-from app.apis.qr_code import QRCode, qr_code_repo, get_absolute_scan_url
+from pydantic import BaseModel, Field
+from typing import Dict, List, Optional, Literal
+from collections import OrderedDict
+import asyncio
+import os
+import re
+import threading
+import time
+import uuid
+import zipfile
+from app.apis.qr_code import QRCode, qr_code_repo, get_absolute_scan_url, ensure_qr_matrix, QR_MATRIX_ERROR_CORRECTION
+from app.apis.qr_renderer import HEX_COLOR_PATTERN, QRRenderSpec
+from app.apis.qr_render_cache import rendered_image_cache
+from app.apis.qr_render_pool import render_pool, RenderPoolSaturated
+from starlette.concurrency import run_in_threadpool
 from app.env import Mode, mode
 
 # Set the base URL for the API based on the environment
@@ -51,26 +48,353 @@ print(f"[QR GENERATOR] API_BASE_URL: {API_BASE_URL}")
 print(f"[QR GENERATOR] TRACK_PATH: {TRACK_PATH}")
 print(f"[QR GENERATOR] Full tracking path prefix: {API_BASE_URL}{TRACK_PATH}")
 
+# Largest number of QR codes exported by one batch request
+QR_BATCH_MAX_CODES = int(os.environ.get("QR_BATCH_MAX_CODES", "1000"))
+
+# Renders a batch keeps in flight at once; leaves room in the render pool for interactive requests
+QR_BATCH_CONCURRENCY = int(os.environ.get("QR_BATCH_CONCURRENCY", str(max(1, min(render_pool.workers, render_pool.max_pending // 2)))))
+
+# Number of finished batch jobs whose status is kept for the status endpoint
+QR_BATCH_JOB_HISTORY = 100
+
+# Seconds after it started that a batch job is dropped, whatever its status
+QR_BATCH_JOB_MAX_AGE_SECONDS = int(os.environ.get("QR_BATCH_JOB_MAX_AGE_SECONDS", str(6 * 60 * 60)))
+
 router = APIRouter(prefix="/qr-image", tags=["qr-image"])
 
+@router.get("/cache/stats")
+def get_render_cache_stats():
+    """
+    Get hit/miss counters of the rendered image cache
+    """
+    return rendered_image_cache.stats()
+
+
+@router.get("/render-pool/stats")
+def get_render_pool_stats():
+    """
+    Get the load and counters of the render worker pool
+    """
+    return render_pool.stats()
+
+
+class BatchImageRequest(BaseModel):
+    """
+    QR codes to export as one ZIP archive, given as ids or a campaign
+    """
+    qr_code_ids: Optional[List[str]] = None
+    campaign_id: Optional[str] = None
+    store_hash: Optional[str] = None  # Restricts the export to one store's QR codes
+    format: Literal["png", "jpeg", "svg", "pdf"] = "png"
+    size: int = Field(300, ge=1, le=10000)
+    error_correction: Literal["L", "M", "Q", "H"] = "M"
+    border: int = Field(4, ge=0, le=20)
+
+
+class BatchJob(BaseModel):
+    """
+    Progress of a batch image export
+    """
+    job_id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    status: str = "running"  # "running", "completed", "cancelled", "failed"
+    format: str
+    total: int
+    rendered: int = 0
+    cached: int = 0
+    failed: int = 0
+    failed_ids: List[str] = Field(default_factory=list)
+    bytes_sent: int = 0
+    started_at: float = Field(default_factory=time.time)
+    finished_at: Optional[float] = None
+
+
+# Batch jobs by id, oldest first; only recent jobs are kept
+batch_jobs: "OrderedDict[str, BatchJob]" = OrderedDict()
+batch_jobs_lock = threading.Lock()
+
+
+def register_batch_job(job: BatchJob) -> None:
+    """
+    Keep a batch job for the status endpoint, dropping expired and the oldest finished jobs
+
+    A job whose archive is never streamed, e.g. because the client disconnected
+    before the response started, stays "running", so jobs also expire by age.
+    """
+    with batch_jobs_lock:
+        expired_before = time.time() - QR_BATCH_JOB_MAX_AGE_SECONDS
+        while batch_jobs and next(iter(batch_jobs.values())).started_at < expired_before:
+            batch_jobs.popitem(last=False)
+        batch_jobs[job.job_id] = job
+        for job_id in list(batch_jobs):
+            if len(batch_jobs) <= QR_BATCH_JOB_HISTORY:
+                break
+            if batch_jobs[job_id].status != "running":
+                del batch_jobs[job_id]
+
+
+class ZipChunkBuffer:
+    """
+    Write-only, unseekable file object that collects ZIP bytes until they are sent
+
+    zipfile writes streaming-compatible archives (sizes in data descriptors) when
+    the file object cannot seek or tell, so only the current entry is ever held in
+    memory.
+    """
+
+    def __init__(self):
+        self.chunks: List[bytes] = []
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def take(self) -> bytes:
+        """
+        Get the bytes written since the last call
+        """
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def get_archive_name(qr_code: QRCode, format: str) -> str:
+    """
+    Get a file name for a QR code image inside a batch archive
+    """
+    name = re.sub(r"[^A-Za-z0-9._-]+", "-", qr_code.name or "").strip("-.")[:60]
+    return f"{name}-{qr_code.id}.{format}" if name else f"{qr_code.id}.{format}"
+
+
+async def render_batch_image(spec: QRRenderSpec, job: BatchJob) -> bytes:
+    """
+    Get one image of a batch from the cache, rendering it in the pool on a miss
+
+    A saturated pool is waited out rather than failing the image, since a batch
+    has no client waiting on each render.
+    """
+    cache_key = spec.cache_key()
+    image = await rendered_image_cache.get(cache_key)
+    if image is not None:
+        job.cached += 1
+        return image
+
+    while True:
+        try:
+            image = await render_pool.render(spec)
+            break
+        except RenderPoolSaturated as e:
+            await asyncio.sleep(e.retry_after)
+    rendered_image_cache.set(cache_key, image)
+    job.rendered += 1
+    return image
+
+
+async def stream_batch_archive(qr_codes: List[QRCode], request: BatchImageRequest, job: BatchJob):
+    """
+    Render a batch of QR codes and yield a ZIP archive of them as it is built
+
+    Up to QR_BATCH_CONCURRENCY renders run ahead of the entry being written, and
+    entries are written in request order. Codes that fail to render are listed in
+    errors.txt at the end of the archive instead of aborting the download.
+    """
+    buffer = ZipChunkBuffer()
+    archive = zipfile.ZipFile(buffer, mode="w")
+    # PNG, JPEG and PDF are already compressed; SVG is text and shrinks well
+    compression = zipfile.ZIP_DEFLATED if request.format == "svg" else zipfile.ZIP_STORED
+    specs = [
+        build_saved_render_spec(qr_code, request.format, request.size, request.error_correction, request.border)
+        for qr_code in qr_codes
+    ]
+    in_flight: Dict[int, asyncio.Task] = {}
+
+    try:
+        for index, qr_code in enumerate(qr_codes):
+            # Keep the render window full
+            for ahead in range(index, min(index + QR_BATCH_CONCURRENCY, len(qr_codes))):
+                if ahead not in in_flight:
+                    in_flight[ahead] = asyncio.create_task(render_batch_image(specs[ahead], job))
+
+            try:
+                image = await in_flight.pop(index)
+            except Exception as e:
+                print(f"[QR GENERATOR] Batch {job.job_id}: error rendering {qr_code.id}: {str(e)}")
+                job.failed += 1
+                job.failed_ids.append(qr_code.id)
+                continue
+
+            entry = zipfile.ZipInfo(get_archive_name(qr_code, request.format), date_time=time.localtime()[:6])
+            entry.compress_type = compression
+            archive.writestr(entry, image)
+            chunk = buffer.take()
+            job.bytes_sent += len(chunk)
+            yield chunk
+
+        if job.failed_ids:
+            archive.writestr("errors.txt", "Failed to render:\n" + "\n".join(job.failed_ids) + "\n")
+        archive.close()
+        chunk = buffer.take()
+        job.bytes_sent += len(chunk)
+        job.status = "completed"
+        yield chunk
+    except (asyncio.CancelledError, GeneratorExit):
+        # The client went away mid-download
+        job.status = "cancelled"
+        raise
+    except Exception as e:
+        print(f"[QR GENERATOR] Batch {job.job_id} failed: {str(e)}")
+        job.status = "failed"
+        raise
+    finally:
+        for task in in_flight.values():
+            task.cancel()
+        job.finished_at = time.time()
+        print(f"[QR GENERATOR] Batch {job.job_id} {job.status}: {job.rendered} rendered, {job.cached} cached, "
+              f"{job.failed} failed, {job.bytes_sent} bytes in {job.finished_at - job.started_at:.1f}s")
+
+
+def get_batch_qr_codes(request: BatchImageRequest) -> List[QRCode]:
+    """
+    Load the QR codes of a batch request, in request order for explicit ids
+    """
+    if request.qr_code_ids:
+        qr_code_ids = list(dict.fromkeys(request.qr_code_ids))
+        if len(qr_code_ids) > QR_BATCH_MAX_CODES:
+            raise HTTPException(status_code=400, detail=f"At most {QR_BATCH_MAX_CODES} QR codes can be exported at once")
+        found = qr_code_repo.get_many(qr_code_ids)
+        missing = [qr_code_id for qr_code_id in qr_code_ids if qr_code_id not in found]
+        if missing:
+            raise HTTPException(status_code=404, detail=f"QR codes not found: {', '.join(missing[:10])}")
+        qr_codes = [found[qr_code_id] for qr_code_id in qr_code_ids]
+    elif request.campaign_id:
+        qr_codes = qr_code_repo.query_by_field("campaign_id", request.campaign_id)
+        qr_codes = [qr_code for qr_code in qr_codes if qr_code.status != "deleted"]
+        qr_codes.sort(key=lambda qr_code: (qr_code.created_at, qr_code.id))
+    else:
+        raise HTTPException(status_code=400, detail="Either qr_code_ids or campaign_id is required")
+
+    if request.store_hash:
+        if any(qr_code.store_hash != request.store_hash for qr_code in qr_codes):
+            if request.qr_code_ids:
+                raise HTTPException(status_code=403, detail="QR codes belong to a different store")
+            qr_codes = [qr_code for qr_code in qr_codes if qr_code.store_hash == request.store_hash]
+    if not qr_codes:
+        raise HTTPException(status_code=404, detail="No QR codes to export")
+    if len(qr_codes) > QR_BATCH_MAX_CODES:
+        raise HTTPException(status_code=400, detail=f"At most {QR_BATCH_MAX_CODES} QR codes can be exported at once")
+    return qr_codes
+
+
+@router.post("/batch")
+async def export_qr_code_images(request: BatchImageRequest):
+    """
+    Export the images of many QR codes as a streamed ZIP archive
+
+    Images are rendered in parallel in the render pool, reusing cached renders,
+    and each is written to the response as soon as it is ready, so the archive is
+    never held in memory. The job id is returned in the X-Batch-Job-Id header;
+    progress can be followed at /qr-image/batch/{job_id}.
+    """
+    # The QR code lookups are blocking I/O, keep them off the event loop
+    qr_codes = await run_in_threadpool(get_batch_qr_codes, request)
+    job = BatchJob(format=request.format, total=len(qr_codes))
+    register_batch_job(job)
+    print(f"[QR GENERATOR] Batch {job.job_id}: exporting {job.total} {request.format} images at {request.size}px")
+
+    return StreamingResponse(
+        stream_batch_archive(qr_codes, request, job),
+        media_type="application/zip",
+        headers={
+            "Content-Disposition": f'attachment; filename="qr-codes-{job.job_id}.zip"',
+            "X-Batch-Job-Id": job.job_id,
+        }
+    )
+
+
+@router.get("/batch/{job_id}", response_model=BatchJob)
+def get_batch_job(job_id: str):
+    """
+    Get the progress of a batch image export
+    """
+    with batch_jobs_lock:
+        job = batch_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Batch job not found")
+    return job
+
+
 @router.get("/{qr_code_id}.{format}")
 async def get_qr_code_image(
     qr_code_id: str = Path(..., description="The ID of the QR code or 'temp-preview' for preview"),
-    format: Literal["png", "jpeg", "pdf"] = Path(..., description="The format of the QR code image (png, jpeg, pdf supported)"),
+    format: Literal["png", "jpeg", "svg", "pdf"] = Path(..., description="The format of the QR code image (png, jpeg, svg, pdf supported)"),
     url: Optional[str] = Query(None, description="URL to encode (for temp-preview)"),
     dots_style: Optional[str] = Query(None, description="Style of the QR code's data modules (dots)."),
     corner_style: Optional[str] = Query(None, description="Style of the QR code's corner finder patterns."),
-    actual_corner_color: Optional[str] = Query(None, description="Hex color for the custom corners, if different from foreground."),
-    foreground_color_override: Optional[str] = Query(None, description="Hex color for the QR code foreground (dots)."),
-    background_color_override: Optional[str] = Query(None, description="Hex color for the QR code background."),
-    size: int = Query(300, description="Size of the QR code in pixels"),
+    actual_corner_color: Optional[str] = Query(None, pattern=HEX_COLOR_PATTERN, description="Hex color for the custom corners, if different from foreground."),
+    foreground_color_override: Optional[str] = Query(None, pattern=HEX_COLOR_PATTERN, description="Hex color for the QR code foreground (dots)."),
+    background_color_override: Optional[str] = Query(None, pattern=HEX_COLOR_PATTERN, description="Hex color for the QR code background."),
+    size: int = Query(300, ge=1, le=10000, description="Size of the QR code in pixels (points for pdf)"),
     error_correction: Literal["L", "M", "Q", "H"] = Query("M", description="Error correction level"),
-    border: int = Query(4, description="Border size in modules")
+    border: int = Query(4, ge=0, le=20, description="Border size in modules"),
+    renderer: Optional[Literal["auto", "styled", "sprite"]] = Query(None, description="Renderer override: auto, styled (PIL module drawers) or sprite (NumPy)"),
+    if_none_match: Optional[str] = Header(None, description="ETag of a previously served image")
 ):
     """
-    Generate a QR code image in PNG or SVG format for a given QR code ID or temporary preview
+    Generate a QR code image for a given QR code ID or temporary preview
+    
+    Images are cached by a hash of everything that affects their bytes, which is
+    also served as the ETag. A changed QR code style produces a new hash, so stale
+    images are never served.
     """
+    # The QR code lookup is blocking I/O, keep it off the event loop
+    spec = await run_in_threadpool(
+        get_render_spec,
+        qr_code_id, format, url, dots_style, corner_style, actual_corner_color,
+        foreground_color_override, background_color_override, size, error_correction, border, renderer
+    )
+    cache_key = spec.cache_key()
+    etag = f'"{cache_key}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    
+    if if_none_match and etag in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+    
+    image = await rendered_image_cache.get(cache_key)
+    if image is None:
+        # Render in the worker pool so redirects served by this event loop are not blocked
+        try:
+            image = await render_pool.render(spec)
+        except RenderPoolSaturated as e:
+            print(f"[QR GENERATOR] Render pool saturated ({e.pending} pending), rejecting render for {qr_code_id}")
+            raise HTTPException(
+                status_code=503,
+                detail="Too many QR code images are being rendered, please retry shortly",
+                headers={"Retry-After": str(e.retry_after)}
+            )
+        rendered_image_cache.set(cache_key, image)
     
+    return Response(content=image, media_type=spec.media_type, headers=headers)
+
+
+def get_render_spec(
+    qr_code_id: str,
+    format: str,
+    url: Optional[str],
+    dots_style: Optional[str],
+    corner_style: Optional[str],
+    actual_corner_color: Optional[str],
+    foreground_color_override: Optional[str],
+    background_color_override: Optional[str],
+    size: int,
+    error_correction: str,
+    border: int,
+    renderer: Optional[str] = None
+) -> QRRenderSpec:
+    """
+    Resolve the data and style of a QR code image from the saved QR code or preview parameters
+    """
     if qr_code_id == "temp-preview":
         # Handle temporary preview without saving QR code
         if not url:
@@ -85,162 +409,80 @@ async def get_qr_code_image(
         dots_style_value = dots_style or "square"
         corner_style_value = corner_style or "square"
         corner_color_value = actual_corner_color or foreground_color
+        renderer_value = renderer or "auto"
         
         print(f"[QR GENERATOR] Generating temp preview for URL: {target_url}")
-        print(f"[QR GENERATOR] Preview styles: dots={dots_style_value}, corners={corner_style_value}")
-        print(f"[QR GENERATOR] Colors: fg={foreground_color}, bg={background_color}, corner={corner_color_value}")
     else:
         # Handle saved QR code
-        qr_codes = qr_code_repo.query_by_field("id", qr_code_id)
-        if not qr_codes:
+        found = qr_code_repo.get_with_document_id(qr_code_id)
+        if found is None:
             raise HTTPException(status_code=404, detail="QR code not found")
-            
-        qr_code = qr_codes[0]
-        
-        # Use the QR code style settings, allowing overrides from query params
-        foreground_color = foreground_color_override or qr_code.style.foreground_color
-        background_color = background_color_override or qr_code.style.background_color
-        
-        # Get the dots and corner styles, allowing overrides
-        dots_style_value = dots_style or qr_code.style.dots_style
-        corner_style_value = corner_style or qr_code.style.corner_style
-        corner_color_value = actual_corner_color or qr_code.style.corner_color or foreground_color
-        
+        firestore_doc_id, qr_code = found
+        if error_correction == QR_MATRIX_ERROR_CORRECTION:
+            # Backfills the stored matrix of codes created before matrices were precomputed
+            ensure_qr_matrix(qr_code, document_id=firestore_doc_id)
         print(f"[QR GENERATOR] Generating saved QR for ID: {qr_code_id}")
-        print(f"[QR GENERATOR] Saved QR styles: dots={dots_style_value}, corners={corner_style_value}")
-        print(f"[QR GENERATOR] Colors: fg={foreground_color}, bg={background_color}, corner={corner_color_value}")
-        target_url = get_absolute_scan_url(qr_code_id)
-        
-        # Log the tracking URL for debugging
-        print(f"[QR GENERATOR] Generated tracking URL: {target_url} for QR code ID: {qr_code_id}")
-        print(f"[QR GENERATOR] URL components: BASE={API_BASE_URL}, PATH={TRACK_PATH}, ID={qr_code_id}")
-        
-    # Convert error correction level
-    error_levels = {
-        "L": qrcode.constants.ERROR_CORRECT_L,  # 7% of data can be restored
-        "M": qrcode.constants.ERROR_CORRECT_M,  # 15% of data can be restored
-        "Q": qrcode.constants.ERROR_CORRECT_Q,  # 25% of data can be restored
-        "H": qrcode.constants.ERROR_CORRECT_H,  # 30% of data can be restored
-    }
-
-    # Use M as the default error correction level unless otherwise specified
-    correction_level = error_levels.get(error_correction, qrcode.constants.ERROR_CORRECT_M)
-
-    # Generate the QR code
-    if format == "svg":
-        # SVG generation
-        factory = qrcode.image.svg.SvgPathImage
-        qr = qrcode.QRCode(
-            version=5,  # Limit to version 5 (capacity ~108 alphanumeric chars with M correction)
-            error_correction=correction_level,
-            box_size=10,
-            border=border
+        return build_saved_render_spec(
+            qr_code, format, size, error_correction, border,
+            dots_style, corner_style, actual_corner_color,
+            foreground_color_override, background_color_override, renderer
         )
-        qr.add_data(target_url)
-        qr.make(fit=True)
-
-        img = qr.make_image(fill_color=foreground_color, back_color=background_color, image_factory=factory)
-        stream = io.BytesIO()
-        img.save(stream)
-        stream.seek(0)
-
-        return Response(
-            content=stream.read(),
-            media_type="image/svg+xml"
-        )
-
-    else:  # PNG
-        qr = qrcode.QRCode(
-            version=5,  # Limit to version 5 (capacity ~108 alphanumeric chars with M correction)
-            error_correction=correction_level,
-            box_size=10,
-            border=border
-        )
-        qr.add_data(target_url)
-        qr.make(fit=True)
-
-        # Choose module drawer based on dots style
-        module_drawer = None
-        if dots_style_value == "dots":
-            module_drawer = CircleModuleDrawer()
-            print(f"[QR GENERATOR] Using CircleModuleDrawer for dots style")
-        elif dots_style_value == "rounded":
-            module_drawer = RoundedModuleDrawer()
-            print(f"[QR GENERATOR] Using RoundedModuleDrawer for rounded style")
-        elif dots_style_value == "diamond":
-            module_drawer = GappedSquareModuleDrawer()
-            print(f"[QR GENERATOR] Using GappedSquareModuleDrawer for diamond style")
-        elif dots_style_value == "honeycomb":
-            module_drawer = HorizontalBarsDrawer()
-            print(f"[QR GENERATOR] Using HorizontalBarsDrawer for honeycomb style")
-        elif dots_style_value == "classy":
-            module_drawer = VerticalBarsDrawer()
-            print(f"[QR GENERATOR] Using VerticalBarsDrawer for classy style")
-        else:  # square or other
-            module_drawer = SquareModuleDrawer()
-            print(f"[QR GENERATOR] Using SquareModuleDrawer for {dots_style_value} style")
-            
-        # Choose eye drawer based on corner style (separate from dots style)
-        eye_drawer = None
-        if corner_style_value == "dots":
-            eye_drawer = CircleModuleDrawer()
-            print(f"[QR GENERATOR] Using CircleModuleDrawer for dots corner style")
-        elif corner_style_value == "rounded":
-            eye_drawer = RoundedModuleDrawer()
-            print(f"[QR GENERATOR] Using RoundedModuleDrawer for rounded corner style")
-        elif corner_style_value == "diamond":
-            eye_drawer = GappedSquareModuleDrawer()
-            print(f"[QR GENERATOR] Using GappedSquareModuleDrawer for diamond corner style")
-        elif corner_style_value == "honeycomb":
-            eye_drawer = HorizontalBarsDrawer()
-            print(f"[QR GENERATOR] Using HorizontalBarsDrawer for honeycomb corner style")
-        elif corner_style_value == "classy":
-            eye_drawer = VerticalBarsDrawer()
-            print(f"[QR GENERATOR] Using VerticalBarsDrawer for classy corner style")
-        else:  # square or other
-            eye_drawer = SquareModuleDrawer()
-            print(f"[QR GENERATOR] Using SquareModuleDrawer for {corner_style_value} corner style")
-            
-        print(f"[QR GENERATOR] Styles: dots={dots_style_value}, corners={corner_style_value}")
-        print(f"[QR GENERATOR] Colors: fg={foreground_color}, bg={background_color}, corner={corner_color_value}")
-        
-        # Convert hex colors to RGB tuples for ColorMask
-        def hex_to_rgb(hex_color):
-            hex_color = hex_color.lstrip('#')
-            return tuple(int(hex_color[i:i+2], 16) for i in (0, 2, 4))
-            
-        fg_rgb = hex_to_rgb(foreground_color)
-        bg_rgb = hex_to_rgb(background_color)
-        
-        print(f"[QR GENERATOR] RGB Colors: fg={fg_rgb}, bg={bg_rgb}")
-        
-        # Create color mask for proper coloring with Module Drawers
-        color_mask = SolidFillColorMask(back_color=bg_rgb, front_color=fg_rgb)
-        
-        # Generate styled QR code using StyledPilImage, Module Drawers and ColorMask
-        if corner_color_value != foreground_color:
-            print(f"[QR GENERATOR] Note: Corner-specific coloring not fully supported with Module Drawers")
-            print(f"[QR GENERATOR] Using foreground color for all modules")
-            
-        img = qr.make_image(
-            image_factory=StyledPilImage,
-            module_drawer=module_drawer,
-            eye_drawer=eye_drawer,
-            color_mask=color_mask
-        )
-        
-        print(f"[QR GENERATOR] QR code generated using Module Drawers")
-
-        # Resize to requested size
-        if img.size[0] != size:
-            img = img.resize((size, size), Image.LANCZOS)
+    
+    return QRRenderSpec(
+        data=target_url,
+        format=format,
+        size=size,
+        error_correction=error_correction,
+        border=border,
+        dots_style=dots_style_value,
+        corner_style=corner_style_value,
+        foreground_color=foreground_color,
+        background_color=background_color,
+        corner_color=corner_color_value,
+        renderer=renderer_value if renderer_value in ("auto", "styled", "sprite") else "auto"
+    )
 
-        # Serve the image
-        stream = io.BytesIO()
-        img.save(stream, format="PNG")
-        stream.seek(0)
 
-        return Response(
-            content=stream.read(),
-            media_type="image/png"
-        )
+def build_saved_render_spec(
+    qr_code: QRCode,
+    format: str,
+    size: int,
+    error_correction: str,
+    border: int,
+    dots_style: Optional[str] = None,
+    corner_style: Optional[str] = None,
+    actual_corner_color: Optional[str] = None,
+    foreground_color_override: Optional[str] = None,
+    background_color_override: Optional[str] = None,
+    renderer: Optional[str] = None
+) -> QRRenderSpec:
+    """
+    Build the render spec of a saved QR code from its style, allowing overrides
+    
+    The stored matrix is passed along and used by the renderer when it matches the
+    data and error correction, so the tracking URL is not encoded again.
+    """
+    # Use the QR code style settings, allowing overrides from query params
+    foreground_color = foreground_color_override or qr_code.style.foreground_color
+    background_color = background_color_override or qr_code.style.background_color
+    
+    # Get the dots and corner styles, allowing overrides
+    dots_style_value = dots_style or qr_code.style.dots_style
+    corner_style_value = corner_style or qr_code.style.corner_style
+    corner_color_value = actual_corner_color or qr_code.style.corner_color or foreground_color
+    renderer_value = renderer or qr_code.style.renderer
+    
+    return QRRenderSpec(
+        data=get_absolute_scan_url(qr_code.get_tracking_id()),
+        format=format,
+        size=size,
+        error_correction=error_correction,
+        border=border,
+        dots_style=dots_style_value,
+        corner_style=corner_style_value,
+        foreground_color=foreground_color,
+        background_color=background_color,
+        corner_color=corner_color_value,
+        renderer=renderer_value if renderer_value in ("auto", "styled", "sprite") else "auto",
+        matrix=qr_code.matrix
+    )
@@ -0,0 +1,202 @@
+from typing import Any, Dict, List, Optional, Tuple
+import os
+import tempfile
+import threading
+
+from fastapi import APIRouter
+from starlette.concurrency import run_in_threadpool
+from app.apis.batch_queue import BatchQueue
+from app.apis.ttl_cache import TTLCache
+
+# Create an empty router to satisfy Databutton API module requirements
+# This is a utility module, not an API endpoint module
+router = APIRouter()
+
+# Rendered images are keyed by a content hash of their render spec, so entries never go
+# stale; the TTL only bounds how long an unused image occupies memory
+QR_RENDER_MEMORY_CACHE_BYTES = int(os.environ.get("QR_RENDER_MEMORY_CACHE_BYTES", str(64 * 1024 * 1024)))
+QR_RENDER_MEMORY_CACHE_TTL_SECONDS = 24 * 60 * 60
+QR_RENDER_DISK_CACHE_DIR = os.environ.get("QR_RENDER_DISK_CACHE_DIR", os.path.join(tempfile.gettempdir(), "qr-render-cache"))
+QR_RENDER_DISK_CACHE_BYTES = int(os.environ.get("QR_RENDER_DISK_CACHE_BYTES", str(1024 * 1024 * 1024)))
+
+# Images waiting to be written to the disk tier before new ones are skipped
+QR_RENDER_DISK_WRITE_QUEUE_SIZE = int(os.environ.get("QR_RENDER_DISK_WRITE_QUEUE_SIZE", "256"))
+
+
+class RenderedImageCache:
+    """
+    Two-tier cache of rendered QR code images keyed by render spec hash.
+
+    The first tier is an in-memory LRU bounded by total image bytes. The second
+    tier is a directory on local disk that survives restarts and is shared by
+    worker processes; images found there are promoted to memory. When the disk
+    tier grows past its budget the least recently modified files are removed.
+
+    Only the memory tier is used on the event loop. Disk reads run in the
+    threadpool, and disk writes and pruning run on a background writer thread.
+    """
+
+    def __init__(self, memory_bytes: int, disk_dir: Optional[str], disk_bytes: int):
+        """
+        Args:
+            memory_bytes: Byte budget of the in-memory tier
+            disk_dir: Directory of the disk tier, None to disable it
+            disk_bytes: Byte budget of the disk tier
+        """
+        self.memory = TTLCache(
+            name="qr_rendered_images",
+            max_entries=100000,
+            ttl_seconds=QR_RENDER_MEMORY_CACHE_TTL_SECONDS,
+            max_bytes=memory_bytes
+        )
+        self.disk_dir = disk_dir
+        self.disk_bytes = disk_bytes
+        self._disk_usage: Optional[int] = None
+        self._disk_lock = threading.Lock()
+        self._counter_lock = threading.Lock()
+        self.disk_hits = 0
+        self.disk_misses = 0
+        self.disk_errors = 0
+        self.disk_writes: Optional[BatchQueue] = None
+        if disk_dir:
+            self.disk_writes = BatchQueue(
+                name="qr_render_disk_writes",
+                flush_handler=self._write_disk_batch,
+                max_batch_size=32,
+                flush_interval_ms=100,
+                max_queue_size=QR_RENDER_DISK_WRITE_QUEUE_SIZE
+            )
+
+    async def get(self, key: str) -> Optional[bytes]:
+        """
+        Get a rendered image from memory, falling back to disk
+        """
+        image = self.memory.get(key)
+        if image is not None or not self.disk_dir:
+            return image
+        return await run_in_threadpool(self._read_disk, key)
+
+    def set(self, key: str, image: bytes) -> None:
+        """
+        Store a rendered image in memory and queue it to be written to disk
+
+        Never blocks: when the write queue is full the image is only kept in memory.
+        """
+        self.memory.set(key, image)
+        if self.disk_writes is not None:
+            self.disk_writes.enqueue((key, image))
+
+    def _read_disk(self, key: str) -> Optional[bytes]:
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                image = f.read()
+            # Touch the file so pruning removes the least recently used images first
+            os.utime(path, None)
+        except FileNotFoundError:
+            self._count("disk_misses")
+            return None
+        except OSError as e:
+            self._count("disk_errors")
+            print(f"[QR RENDER CACHE] Error reading {key} from disk: {str(e)}")
+            return None
+
+        self._count("disk_hits")
+        self.memory.set(key, image)
+        return image
+
+    def _write_disk_batch(self, items: List[Tuple[str, bytes]]) -> None:
+        for key, image in items:
+            self._write_disk(key, image)
+
+    def _write_disk(self, key: str, image: bytes) -> None:
+        path = self._path(key)
+        tmp_path = None
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write to a temporary file first so readers never see a partial image
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, "wb") as f:
+                f.write(image)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            self._count("disk_errors")
+            print(f"[QR RENDER CACHE] Error writing {key} to disk: {str(e)}")
+            if tmp_path is not None:
+                # Don't leave partial images behind, they are not counted against the size limit
+                try:
+                    os.unlink(tmp_path)
+                except OSError:
+                    pass
+            return
+
+        with self._disk_lock:
+            if self._disk_usage is None:
+                self._disk_usage = self._scan_disk_usage()
+            else:
+                self._disk_usage += len(image)
+            if self._disk_usage > self.disk_bytes:
+                self._prune_disk()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get the counters of both tiers
+        """
+        with self._counter_lock:
+            disk = {
+                "dir": self.disk_dir,
+                "bytes": self._disk_usage,
+                "max_bytes": self.disk_bytes,
+                "hits": self.disk_hits,
+                "misses": self.disk_misses,
+                "errors": self.disk_errors,
+                "write_queue": self.disk_writes.metrics() if self.disk_writes is not None else None,
+            }
+        return {"memory": self.memory.stats(), "disk": disk}
+
+    def _count(self, counter: str) -> None:
+        with self._counter_lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, key[:2], key)
+
+    def _list_disk_files(self):
+        for root, _, files in os.walk(self.disk_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                yield path, stat.st_size, stat.st_mtime
+
+    def _scan_disk_usage(self) -> int:
+        return sum(size for _, size, _ in self._list_disk_files())
+
+    def _prune_disk(self) -> None:
+        """
+        Remove the oldest images until the disk tier is back under 90% of its budget
+        """
+        files = sorted(self._list_disk_files(), key=lambda f: f[2])
+        usage = sum(size for _, size, _ in files)
+        target = self.disk_bytes * 0.9
+        removed = 0
+        for path, size, _ in files:
+            if usage <= target:
+                break
+            try:
+                os.remove(path)
+                usage -= size
+                removed += 1
+            except OSError:
+                continue
+        self._disk_usage = usage
+        print(f"[QR RENDER CACHE] Pruned {removed} images from disk cache, {usage} bytes remaining")
+
+
+rendered_image_cache = RenderedImageCache(
+    memory_bytes=QR_RENDER_MEMORY_CACHE_BYTES,
+    disk_dir=QR_RENDER_DISK_CACHE_DIR or None,
+    disk_bytes=QR_RENDER_DISK_CACHE_BYTES
+)
@@ -0,0 +1,188 @@
+from typing import Any, Dict, Optional
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import asyncio
+import multiprocessing
+import os
+import threading
+
+from fastapi import APIRouter
+from app.apis.qr_renderer import QRRenderSpec, render_qr_image
+
+# Create an empty router to satisfy Databutton API module requirements
+# This is a utility module, not an API endpoint module
+router = APIRouter()
+
+# Number of render worker processes; 0 renders on a thread of this process instead
+QR_RENDER_WORKERS = int(os.environ.get("QR_RENDER_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+# Renders queued or running at once before new ones are rejected
+QR_RENDER_MAX_PENDING = int(os.environ.get("QR_RENDER_MAX_PENDING", str(max(1, QR_RENDER_WORKERS) * 8)))
+
+# Seconds clients are asked to wait before retrying a rejected render
+QR_RENDER_RETRY_AFTER_SECONDS = int(os.environ.get("QR_RENDER_RETRY_AFTER_SECONDS", "1"))
+
+
+class RenderPoolSaturated(Exception):
+    """
+    Raised when a render is rejected because too many renders are already pending
+    """
+
+    def __init__(self, pending: int, retry_after: int):
+        super().__init__(f"{pending} renders pending")
+        self.pending = pending
+        self.retry_after = retry_after
+
+
+def get_worker_context():
+    """
+    Get the multiprocessing context render workers are started with
+    """
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("forkserver")
+    return multiprocessing.get_context("spawn")
+
+
+def _render_in_worker(spec_data: Dict[str, Any]) -> bytes:
+    """
+    Render an image inside a worker process
+    """
+    return render_qr_image(QRRenderSpec(**spec_data))
+
+
+class RenderPool:
+    """
+    Bounded pool of worker processes that renders QR code images off the event loop.
+
+    CPU-bound PIL work in an async endpoint blocks every other request served by
+    the same event loop, including /track redirects. The pool runs renders in
+    separate processes and caps how many may be pending so a burst of large
+    renders is rejected early instead of queueing without bound.
+    """
+
+    def __init__(self, workers: int, max_pending: int, retry_after: int):
+        """
+        Args:
+            workers: Number of worker processes, 0 to render on a thread instead
+            max_pending: Maximum number of renders queued or running at once
+            retry_after: Seconds clients should wait before retrying a rejected render
+        """
+        self.workers = workers
+        self.max_pending = max_pending
+        self.retry_after = retry_after
+        self._executor: Optional[Executor] = None
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.matrix_hits = 0
+        self.matrix_misses = 0
+
+    async def render(self, spec: QRRenderSpec) -> bytes:
+        """
+        Render an image in the pool
+
+        Raises:
+            RenderPoolSaturated: If max_pending renders are already queued or running
+        """
+        with self._lock:
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                raise RenderPoolSaturated(self.pending, self.retry_after)
+            self.pending += 1
+            # Renders with a precomputed matrix skip encoding the data
+            if spec.has_matrix():
+                self.matrix_hits += 1
+            else:
+                self.matrix_misses += 1
+
+        try:
+            if self.workers <= 0:
+                future = self._get_executor().submit(render_qr_image, spec)
+            else:
+                future = self._get_executor().submit(_render_in_worker, spec.dict())
+        except BaseException as e:
+            self._finish(failed=True)
+            if isinstance(e, BrokenProcessPool):
+                self._restart_broken_executor()
+            raise
+        # A render cancelled while running keeps its worker busy, e.g. when a batch
+        # export's client disconnects, so its slot is only freed once it completes
+        future.add_done_callback(self._on_render_done)
+
+        try:
+            return await asyncio.wrap_future(future)
+        except BrokenProcessPool:
+            self._restart_broken_executor()
+            raise
+
+    def _on_render_done(self, future: Future) -> None:
+        self._finish(failed=future.cancelled() or future.exception() is not None)
+
+    def _finish(self, failed: bool) -> None:
+        with self._lock:
+            self.pending -= 1
+            if failed:
+                self.failed += 1
+            else:
+                self.completed += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get the pool's size and counters
+        """
+        with self._lock:
+            matrix_lookups = self.matrix_hits + self.matrix_misses
+            return {
+                "workers": self.workers,
+                "max_pending": self.max_pending,
+                "pending": self.pending,
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "matrix_hits": self.matrix_hits,
+                "matrix_misses": self.matrix_misses,
+                "matrix_hit_rate": round(self.matrix_hits / matrix_lookups, 4) if matrix_lookups else None,
+            }
+
+    def shutdown(self) -> None:
+        """
+        Stop the worker processes, abandoning queued renders
+        """
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _get_executor(self) -> Executor:
+        with self._lock:
+            if self._executor is None and self.workers <= 0:
+                self._executor = ThreadPoolExecutor(thread_name_prefix="qr-render")
+                print("[QR RENDER POOL] Rendering on threads of this process")
+            elif self._executor is None:
+                # Forking a server process would copy its threads' locks and Firestore
+                # client into the workers, so workers start from a clean interpreter
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=get_worker_context())
+                print(f"[QR RENDER POOL] Started {self.workers} render workers")
+            return self._executor
+
+    def _restart_broken_executor(self) -> None:
+        # A worker died (e.g. out of memory); start a fresh pool for later renders
+        print("[QR RENDER POOL] Render worker pool broke, restarting it")
+        self._reset_executor()
+
+    def _reset_executor(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+
+render_pool = RenderPool(
+    workers=QR_RENDER_WORKERS,
+    max_pending=QR_RENDER_MAX_PENDING,
+    retry_after=QR_RENDER_RETRY_AFTER_SECONDS
+)
+
+router.add_event_handler("shutdown", render_pool.shutdown)
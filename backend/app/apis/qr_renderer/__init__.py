@@ -0,0 +1,573 @@
+from fastapi import APIRouter
+from pydantic import BaseModel, Field
+from typing import Annotated, Iterator, List, Literal, Optional, Tuple
+from xml.sax.saxutils import quoteattr
+import base64
+import hashlib
+import io
+import json
+import zlib
+import qrcode
+from qrcode.image.styledpil import StyledPilImage
+from qrcode.image.styles.moduledrawers import (
+    RoundedModuleDrawer,
+    CircleModuleDrawer,
+    SquareModuleDrawer,
+    GappedSquareModuleDrawer,
+    HorizontalBarsDrawer,
+    VerticalBarsDrawer
+)
+from qrcode.image.styles.colormasks import SolidFillColorMask
+from PIL import Image, ImageDraw
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional, renders fall back to StyledPilImage
+    np = None
+
+# Create an empty router to satisfy Databutton API module requirements
+# This is a utility module, not an API endpoint module
+router = APIRouter()
+
+# Bump when rendering output changes so cached images from older code are not served
+RENDERER_VERSION = 5
+
+ERROR_LEVELS = {
+    "L": qrcode.constants.ERROR_CORRECT_L,  # 7% of data can be restored
+    "M": qrcode.constants.ERROR_CORRECT_M,  # 15% of data can be restored
+    "Q": qrcode.constants.ERROR_CORRECT_Q,  # 25% of data can be restored
+    "H": qrcode.constants.ERROR_CORRECT_H,  # 30% of data can be restored
+}
+
+# Styles the NumPy sprite renderer can draw; other styles always use StyledPilImage
+SPRITE_STYLES = {"square", "dots"}
+
+# Supersampling used for round sprites, matching qrcode's module drawers
+SPRITE_ANTIALIASING_FACTOR = 4
+
+MEDIA_TYPES = {
+    "png": "image/png",
+    "jpeg": "image/jpeg",
+    "svg": "image/svg+xml",
+    "pdf": "application/pdf",
+}
+
+JPEG_QUALITY = 95
+
+# Distance of cubic Bezier control points from a corner, as a fraction of the radius, for quarter circles
+BEZIER_CIRCLE_KAPPA = 0.5523
+
+
+class QRMatrix(BaseModel):
+    """
+    The encoded, masked module matrix of a QR code, without border
+
+    Encoding includes scoring all eight mask patterns, so the matrix of data that
+    never changes (e.g. a saved code's tracking URL) is stored and reused.
+    """
+    data: str
+    error_correction: Literal["L", "M", "Q", "H"]
+    version: int
+    size: int
+    bits: str  # Base64 of the modules row by row, 8 per byte, most significant bit first
+
+    def matches(self, data: str, error_correction: str) -> bool:
+        """
+        Check whether this matrix encodes the given data at the given error correction
+        """
+        return self.data == data and self.error_correction == error_correction
+
+    def to_modules(self) -> List[List[bool]]:
+        """
+        Unpack the matrix into rows of booleans, True for dark modules
+        """
+        packed = base64.b64decode(self.bits)
+        return [
+            [bool(packed[i >> 3] & (0x80 >> (i & 7))) for i in range(row * self.size, (row + 1) * self.size)]
+            for row in range(self.size)
+        ]
+
+    @classmethod
+    def from_modules(cls, data: str, error_correction: str, version: int, modules: List[List[bool]]) -> 'QRMatrix':
+        """
+        Pack a module matrix
+        """
+        size = len(modules)
+        packed = bytearray((size * size + 7) // 8)
+        for row in range(size):
+            for col in range(size):
+                if modules[row][col]:
+                    i = row * size + col
+                    packed[i >> 3] |= 0x80 >> (i & 7)
+        return cls(
+            data=data,
+            error_correction=error_correction,
+            version=version,
+            size=size,
+            bits=base64.b64encode(bytes(packed)).decode("ascii")
+        )
+
+
+# Colors are #RRGGBB; anything else would be written verbatim into SVG markup
+HEX_COLOR_PATTERN = r"^#[0-9A-Fa-f]{6}$"
+HexColor = Annotated[str, Field(pattern=HEX_COLOR_PATTERN)]
+
+
+class QRRenderSpec(BaseModel):
+    """
+    Everything that determines the bytes of a rendered QR code image
+    """
+    data: str
+    format: Literal["png", "jpeg", "svg", "pdf"] = "png"
+    size: int = 300
+    error_correction: Literal["L", "M", "Q", "H"] = "M"
+    border: int = 4
+    dots_style: str = "square"
+    corner_style: str = "square"
+    foreground_color: HexColor = "#000000"
+    background_color: HexColor = "#FFFFFF"
+    corner_color: HexColor = "#000000"
+    renderer: Literal["auto", "styled", "sprite"] = "auto"
+    matrix: Optional[QRMatrix] = None  # Precomputed encoding of data, used instead of encoding it again
+
+    @property
+    def media_type(self) -> str:
+        return MEDIA_TYPES[self.format]
+
+    def has_matrix(self) -> bool:
+        """
+        Check whether the spec carries a precomputed matrix that can be rendered as is
+        """
+        return self.matrix is not None and self.matrix.matches(self.data, self.error_correction)
+
+    def cache_key(self) -> str:
+        """
+        Get a content hash of the spec, identical for specs that render identical images
+        """
+        # The matrix is derived from data and error_correction, so it does not change the image
+        payload = json.dumps({"renderer": RENDERER_VERSION, **self.dict(exclude={"matrix"})}, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def get_module_drawer(style: str):
+    """
+    Get the module drawer for a dots or corner style
+    """
+    if style == "dots":
+        return CircleModuleDrawer()
+    elif style == "rounded":
+        return RoundedModuleDrawer()
+    elif style == "diamond":
+        return GappedSquareModuleDrawer()
+    elif style == "honeycomb":
+        return HorizontalBarsDrawer()
+    elif style == "classy":
+        return VerticalBarsDrawer()
+    else:  # square or other
+        return SquareModuleDrawer()
+
+
+def hex_to_rgb(hex_color: str):
+    """
+    Convert a #RRGGBB color to an RGB tuple
+    """
+    hex_color = hex_color.lstrip('#')
+    return tuple(int(hex_color[i:i+2], 16) for i in (0, 2, 4))
+
+
+def choose_box_size(size: int, modules: int) -> int:
+    """
+    Get the largest whole number of pixels per module that fits a QR code in size pixels
+
+    Args:
+        size: Requested image width and height in pixels
+        modules: Width of the QR code in modules, including the border
+
+    Returns:
+        Pixels per module, at least 1
+    """
+    return max(1, size // modules)
+
+
+def use_sprite_renderer(spec: QRRenderSpec) -> bool:
+    """
+    Check whether an image can be drawn with the NumPy sprite renderer
+    """
+    if spec.renderer == "styled" or np is None:
+        return False
+    return spec.dots_style in SPRITE_STYLES and spec.corner_style in SPRITE_STYLES
+
+
+def get_module_sprite(style: str, box_size: int):
+    """
+    Get the coverage of one module as a box_size x box_size array of 0-255 values
+
+    The dots sprite is drawn the same way as CircleModuleDrawer: a circle at four
+    times the size, downsampled with LANCZOS.
+    """
+    if style == "dots":
+        fake_size = box_size * SPRITE_ANTIALIASING_FACTOR
+        circle = Image.new("L", (fake_size, fake_size), 0)
+        ImageDraw.Draw(circle).ellipse((0, 0, fake_size, fake_size), fill=255)
+        return np.asarray(circle.resize((box_size, box_size), Image.LANCZOS), dtype=np.int32)
+    return np.full((box_size, box_size), 255, dtype=np.int32)
+
+
+def color_sprite(coverage, color: str, background):
+    """
+    Blend a color over the background by a sprite's coverage, giving a box_size x box_size x 3 RGB tile
+    """
+    color = np.array(hex_to_rgb(color), dtype=np.int32)
+    return (background + (coverage[:, :, None] * (color - background) + 127) // 255).astype(np.uint8)
+
+
+def draw_with_sprites(qr: qrcode.QRCode, spec: QRRenderSpec) -> Image.Image:
+    """
+    Draw a QR code by stamping precomputed module tiles with NumPy
+
+    Each module is classified once as light, dark data or dark finder pattern
+    ("eye"), then a colored tile per class is broadcast over the whole matrix in a
+    single indexing operation. Data and corner modules get their own colors.
+    """
+    modules = np.array(qr.modules, dtype=bool)
+    width = modules.shape[0]
+    eyes = np.zeros_like(modules)
+    eyes[:7, :7] = eyes[:7, width - 7:] = eyes[width - 7:, :7] = True
+
+    # 0 = light, 1 = dark data module, 2 = dark eye module; the border is light
+    kinds = np.pad(np.where(modules, np.where(eyes, 2, 1), 0).astype(np.uint8), qr.border)
+
+    box_size = qr.box_size
+    background = np.array(hex_to_rgb(spec.background_color), dtype=np.int32)
+    tiles = np.stack([
+        np.broadcast_to(background.astype(np.uint8), (box_size, box_size, 3)),
+        color_sprite(get_module_sprite(spec.dots_style, box_size), spec.foreground_color, background),
+        color_sprite(get_module_sprite(spec.corner_style, box_size), spec.corner_color, background),
+    ])
+
+    # (rows, cols, box, box, rgb) -> (rows * box, cols * box, rgb)
+    full_size = kinds.shape[0] * box_size
+    pixels = tiles[kinds].transpose(0, 2, 1, 3, 4).reshape(full_size, full_size, 3)
+    return Image.fromarray(pixels, "RGB")
+
+
+def draw_with_module_drawers(qr: qrcode.QRCode, spec: QRRenderSpec) -> Image.Image:
+    """
+    Draw a QR code with StyledPilImage and the module drawers of its styles
+    """
+    # Create color mask for proper coloring with Module Drawers
+    color_mask = SolidFillColorMask(back_color=hex_to_rgb(spec.background_color), front_color=hex_to_rgb(spec.foreground_color))
+
+    if spec.corner_color != spec.foreground_color:
+        print("[QR RENDERER] Note: Corner-specific coloring not supported with Module Drawers, using foreground color")
+
+    return qr.make_image(
+        image_factory=StyledPilImage,
+        module_drawer=get_module_drawer(spec.dots_style),
+        eye_drawer=get_module_drawer(spec.corner_style),
+        color_mask=color_mask
+    ).get_image()
+
+
+# A filled rectangle in module units with rounded corners: (x, y, width, height, corner radius)
+VectorShape = Tuple[float, float, float, float, float]
+
+
+def get_eye_mask(width: int) -> List[List[bool]]:
+    """
+    Get which modules of a QR code belong to its three finder patterns ("eyes")
+    """
+    return [
+        [(row < 7 and (col < 7 or col >= width - 7)) or (row >= width - 7 and col < 7) for col in range(width)]
+        for row in range(width)
+    ]
+
+
+def get_runs(cells: List[List[bool]], vertical: bool = False) -> Iterator[Tuple[int, int, int]]:
+    """
+    Find maximal runs of set cells along rows (or columns)
+
+    Yields:
+        (x, y, length) of each run in module units
+    """
+    width = len(cells)
+    for line in range(width):
+        start = None
+        for pos in range(width + 1):
+            is_set = pos < width and (cells[pos][line] if vertical else cells[line][pos])
+            if is_set and start is None:
+                start = pos
+            elif not is_set and start is not None:
+                yield (line, start, pos - start) if vertical else (start, line, pos - start)
+                start = None
+
+
+def get_vector_shapes(cells: List[List[bool]], style: str) -> List[VectorShape]:
+    """
+    Get the shapes that draw a set of dark modules in a dots or corner style
+
+    Adjacent modules are merged into a single shape where the style allows it, so
+    a square style needs one rectangle per run rather than one per module. The
+    shapes approximate the raster module drawers of the same styles.
+    """
+    shapes = []
+    if style == "dots":
+        for x, y, length in get_runs(cells):
+            shapes.extend((x + i, y, 1, 1, 0.5) for i in range(length))
+    elif style == "diamond":
+        for x, y, length in get_runs(cells):
+            shapes.extend((x + i + 0.1, y + 0.1, 0.8, 0.8, 0) for i in range(length))
+    elif style == "rounded":
+        shapes.extend((x, y, length, 1, 0.5) for x, y, length in get_runs(cells))
+    elif style == "honeycomb":
+        shapes.extend((x, y + 0.1, length, 0.8, 0.4) for x, y, length in get_runs(cells))
+    elif style == "classy":
+        shapes.extend((x + 0.1, y, 0.8, length, 0.4) for x, y, length in get_runs(cells, vertical=True))
+    else:  # square or other
+        shapes.extend((x, y, length, 1, 0) for x, y, length in get_runs(cells))
+    return shapes
+
+
+def get_vector_layers(qr: qrcode.QRCode, spec: QRRenderSpec) -> List[Tuple[str, List[VectorShape]]]:
+    """
+    Split a QR code into colored layers of shapes, offset by the border
+
+    Returns:
+        (hex color, shapes) for the data modules and for the finder patterns
+    """
+    width = qr.modules_count
+    eyes = get_eye_mask(width)
+    data_cells = [[bool(qr.modules[r][c]) and not eyes[r][c] for c in range(width)] for r in range(width)]
+    eye_cells = [[bool(qr.modules[r][c]) and eyes[r][c] for c in range(width)] for r in range(width)]
+
+    layers = []
+    for color, cells, style in (
+        (spec.foreground_color, data_cells, spec.dots_style),
+        (spec.corner_color, eye_cells, spec.corner_style),
+    ):
+        shapes = [(x + spec.border, y + spec.border, w, h, r) for x, y, w, h, r in get_vector_shapes(cells, style)]
+        layers.append((color, shapes))
+    return layers
+
+
+def format_number(value: float) -> str:
+    """
+    Format a coordinate compactly, without trailing zeros
+    """
+    return f"{value:.4f}".rstrip("0").rstrip(".") or "0"
+
+
+def svg_shape_path(shape: VectorShape) -> str:
+    """
+    Get SVG path data for one shape using relative commands
+    """
+    x, y, w, h, r = shape
+    n = format_number
+    if r == 0:
+        return f"M{n(x)} {n(y)}h{n(w)}v{n(h)}h{n(-w)}z"
+    if w == h and r * 2 == w:
+        # Circle as two half arcs
+        return f"M{n(x)} {n(y + r)}a{n(r)} {n(r)} 0 1 0 {n(w)} 0a{n(r)} {n(r)} 0 1 0 {n(-w)} 0z"
+    # Straight edges are omitted where the corners meet, e.g. the sides of a pill
+    arc = f"a{n(r)} {n(r)} 0 0 1 "
+    top = f"h{n(w - 2 * r)}" if w > 2 * r else ""
+    side = f"v{n(h - 2 * r)}" if h > 2 * r else ""
+    bottom = f"h{n(2 * r - w)}" if w > 2 * r else ""
+    back = f"v{n(2 * r - h)}" if h > 2 * r else ""
+    return (
+        f"M{n(x + r)} {n(y)}{top}{arc}{n(r)} {n(r)}{side}{arc}{n(-r)} {n(r)}"
+        f"{bottom}{arc}{n(-r)} {n(-r)}{back}{arc}{n(r)} {n(-r)}z"
+    )
+
+
+def render_svg(qr: qrcode.QRCode, spec: QRRenderSpec) -> bytes:
+    """
+    Render a QR code as an SVG document with one path per color
+
+    Coordinates are in modules; the viewBox scales them to the requested size.
+    """
+    modules = qr.modules_count + 2 * spec.border
+    # Square modules look sharper without antialiasing where runs meet
+    crisp = ' shape-rendering="crispEdges"' if spec.dots_style == "square" and spec.corner_style == "square" else ""
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{spec.size}" height="{spec.size}" viewBox="0 0 {modules} {modules}"{crisp}>',
+        f'<rect width="{modules}" height="{modules}" fill={quoteattr(spec.background_color)}/>',
+    ]
+    for color, shapes in get_vector_layers(qr, spec):
+        if shapes:
+            parts.append(f'<path fill={quoteattr(color)} d="{"".join(svg_shape_path(shape) for shape in shapes)}"/>')
+    parts.append("</svg>")
+    return "".join(parts).encode("utf-8")
+
+
+def pdf_shape_path(shape: VectorShape) -> str:
+    """
+    Get PDF path operators for one shape, with rounded corners as cubic Beziers
+    """
+    x, y, w, h, r = shape
+    n = format_number
+    if r == 0:
+        return f"{n(x)} {n(y)} {n(w)} {n(h)} re"
+    k = r * (1 - BEZIER_CIRCLE_KAPPA)
+    right, bottom = x + w, y + h
+    # Straight edges are omitted where the corners meet, e.g. the sides of a pill
+    top = f"{n(right - r)} {n(y)} l " if w > 2 * r else ""
+    side = f"{n(right)} {n(bottom - r)} l " if h > 2 * r else ""
+    bottom_edge = f"{n(x + r)} {n(bottom)} l " if w > 2 * r else ""
+    back = f"{n(x)} {n(y + r)} l " if h > 2 * r else ""
+    return (
+        f"{n(x + r)} {n(y)} m {top}"
+        f"{n(right - k)} {n(y)} {n(right)} {n(y + k)} {n(right)} {n(y + r)} c {side}"
+        f"{n(right)} {n(bottom - k)} {n(right - k)} {n(bottom)} {n(right - r)} {n(bottom)} c {bottom_edge}"
+        f"{n(x + k)} {n(bottom)} {n(x)} {n(bottom - k)} {n(x)} {n(bottom - r)} c {back}"
+        f"{n(x)} {n(y + k)} {n(x + k)} {n(y)} {n(x + r)} {n(y)} c h"
+    )
+
+
+def pdf_color(hex_color: str) -> str:
+    """
+    Get the PDF operator that sets an RGB fill color
+    """
+    return " ".join(format_number(channel / 255) for channel in hex_to_rgb(hex_color)) + " rg"
+
+
+def render_pdf(qr: qrcode.QRCode, spec: QRRenderSpec) -> bytes:
+    """
+    Render a QR code as a single-page PDF with vector modules
+
+    The page is size points square. Module coordinates are mapped onto it with a
+    single transform that also flips the y axis, so shapes use the same top-down
+    coordinates as SVG.
+    """
+    modules = qr.modules_count + 2 * spec.border
+    scale = f"{spec.size / modules:.6f}".rstrip("0").rstrip(".")
+    operators = [
+        f"{scale} 0 0 -{scale} 0 {spec.size} cm",
+        pdf_color(spec.background_color),
+        f"0 0 {modules} {modules} re f",
+    ]
+    for color, shapes in get_vector_layers(qr, spec):
+        if shapes:
+            operators.append(pdf_color(color))
+            operators.extend(pdf_shape_path(shape) for shape in shapes)
+            operators.append("f")
+    content = zlib.compress("\n".join(operators).encode("ascii"))
+
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {spec.size} {spec.size}] /Contents 4 0 R /Resources << >> >>".encode("ascii"),
+        f"<< /Length {len(content)} /Filter /FlateDecode >>\nstream\n".encode("ascii") + content + b"\nendstream",
+    ]
+    document = io.BytesIO()
+    document.write(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(document.tell())
+        document.write(f"{number} 0 obj\n".encode("ascii") + body + b"\nendobj\n")
+    xref_offset = document.tell()
+    document.write(f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("ascii"))
+    for offset in offsets:
+        document.write(f"{offset:010d} 00000 n \n".encode("ascii"))
+    document.write(f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n".encode("ascii"))
+    return document.getvalue()
+
+
+def encode_qr(data: str, error_correction: str, border: int = 4) -> qrcode.QRCode:
+    """
+    Encode data into a QR code, choosing the version and mask pattern
+    """
+    qr = qrcode.QRCode(
+        version=None,  # Smallest version that fits, e.g. 3 for a short tracking URL, 5 for a UUID one
+        error_correction=ERROR_LEVELS[error_correction],
+        border=border
+    )
+    qr.add_data(data)
+    qr.make(fit=True)
+    return qr
+
+
+def encode_matrix(data: str, error_correction: str) -> QRMatrix:
+    """
+    Encode data into a storable QR code matrix
+    """
+    qr = encode_qr(data, error_correction)
+    return QRMatrix.from_modules(data, error_correction, qr.version, qr.modules)
+
+
+def make_qr(spec: QRRenderSpec) -> qrcode.QRCode:
+    """
+    Get the QR code of a spec, from its precomputed matrix when it has one
+    """
+    if not spec.has_matrix():
+        return encode_qr(spec.data, spec.error_correction, spec.border)
+
+    qr = qrcode.QRCode(
+        version=spec.matrix.version,
+        error_correction=ERROR_LEVELS[spec.error_correction],
+        border=spec.border
+    )
+    qr.modules = spec.matrix.to_modules()
+    qr.modules_count = spec.matrix.size
+    # make_image() only encodes when data_cache is None; the stored modules are already encoded and masked
+    qr.data_cache = []
+    return qr
+
+
+def render_raster(qr: qrcode.QRCode, spec: QRRenderSpec) -> bytes:
+    """
+    Render a QR code as a PNG or JPEG image
+
+    The module size is chosen from the requested size so the code is drawn at its
+    final resolution. Any remainder of less than one module is added to the quiet
+    zone instead of resampling, so module edges stay sharp. Only sizes smaller than
+    one pixel per module are resampled.
+    """
+    qr.box_size = choose_box_size(spec.size, qr.modules_count + 2 * spec.border)
+
+    sprites = use_sprite_renderer(spec)
+    print(f"[QR RENDERER] Rendering {spec.format} {spec.size}px ({qr.box_size}px modules, {'sprite' if sprites else 'styled'} renderer): "
+          f"dots={spec.dots_style}, corners={spec.corner_style}, fg={spec.foreground_color}, bg={spec.background_color}, corner={spec.corner_color}")
+
+    img = draw_with_sprites(qr, spec) if sprites else draw_with_module_drawers(qr, spec)
+
+    rendered_size = img.size[0]
+    if rendered_size < spec.size:
+        # Center the code on a canvas of the requested size
+        canvas = Image.new(img.mode, (spec.size, spec.size), hex_to_rgb(spec.background_color))
+        offset = (spec.size - rendered_size) // 2
+        canvas.paste(img, (offset, offset))
+        img = canvas
+    elif rendered_size > spec.size:
+        # Fewer pixels than modules, the only case that needs resampling
+        img = img.resize((spec.size, spec.size), Image.LANCZOS)
+
+    stream = io.BytesIO()
+    if spec.format == "jpeg":
+        img.convert("RGB").save(stream, format="JPEG", quality=JPEG_QUALITY)
+    else:
+        img.save(stream, format="PNG")
+    return stream.getvalue()
+
+
+def render_qr_image(spec: QRRenderSpec) -> bytes:
+    """
+    Render a QR code image
+
+    SVG and PDF are drawn as vector shapes, which are small and cheap to produce
+    at any print size. PNG and JPEG are rasterized at the requested size.
+
+    Args:
+        spec: The data, style and output format of the image
+
+    Returns:
+        The encoded image bytes
+    """
+    qr = make_qr(spec)
+    if spec.format == "svg":
+        print(f"[QR RENDERER] Rendering svg: dots={spec.dots_style}, corners={spec.corner_style}")
+        return render_svg(qr, spec)
+    if spec.format == "pdf":
+        print(f"[QR RENDERER] Rendering pdf {spec.size}pt: dots={spec.dots_style}, corners={spec.corner_style}")
+        return render_pdf(qr, spec)
+    return render_raster(qr, spec)
@@ -0,0 +1,93 @@
+from typing import Any, Dict, Iterable, Optional
+import time
+from collections import defaultdict
+
+from fastapi import APIRouter
+
+# Create an empty router to satisfy Databutton API module requirements
+# This is a utility module, not an API endpoint module
+router = APIRouter()
+
+SECONDS_PER_DAY = 24 * 60 * 60
+
+
+def get_local_tz_offset_seconds() -> int:
+    """
+    Get the server's current offset from UTC, used when a caller gives no timezone
+    """
+    return time.localtime().tm_gmtoff
+
+
+class ScanAggregator:
+    """
+    Single-pass aggregator over raw scan event documents.
+
+    Events are read as the dicts Firestore returns, without building ScanEvent
+    models, and every breakdown is updated in the same pass. Only the counters
+    are kept, so memory grows with the number of distinct days, devices,
+    countries and QR codes, not with the number of events.
+    """
+
+    def __init__(self, tz_offset_seconds: Optional[int] = None):
+        """
+        Args:
+            tz_offset_seconds: Offset from UTC used to bucket scans into days, the server's offset if None
+        """
+        self.tz_offset_seconds = get_local_tz_offset_seconds() if tz_offset_seconds is None else tz_offset_seconds
+        self.total_scans = 0
+        self.device_counts: Dict[str, int] = defaultdict(int)
+        self.location_counts: Dict[str, int] = defaultdict(int)
+        self.browser_counts: Dict[str, int] = defaultdict(int)
+        self.qr_code_counts: Dict[str, int] = defaultdict(int)
+        self._day_counts: Dict[int, int] = defaultdict(int)
+        self._date_strings: Dict[int, str] = {}
+
+    def add(self, event: Dict[str, Any]) -> None:
+        """
+        Count one raw scan event document
+        """
+        self.total_scans += 1
+        self._day_counts[(event["timestamp"] + self.tz_offset_seconds) // SECONDS_PER_DAY] += 1
+        self.device_counts[event.get("device_type") or "unknown"] += 1
+        self.qr_code_counts[event["qr_code_id"]] += 1
+
+        browser = event.get("browser")
+        if browser:
+            self.browser_counts[browser] += 1
+
+        location = event.get("location")
+        if location:
+            country = location.get("country")
+            if country:
+                self.location_counts[country] += 1
+
+    def add_all(self, events: Iterable[Dict[str, Any]]) -> "ScanAggregator":
+        """
+        Count a stream of raw scan event documents
+        """
+        for event in events:
+            self.add(event)
+        return self
+
+    def date_string(self, day: int) -> str:
+        """
+        Format a day bucket as YYYY-MM-DD, caching the result
+        """
+        date = self._date_strings.get(day)
+        if date is None:
+            date = self._date_strings[day] = time.strftime("%Y-%m-%d", time.gmtime(day * SECONDS_PER_DAY))
+        return date
+
+    @property
+    def daily_counts(self) -> Dict[str, int]:
+        """
+        Scan counts per YYYY-MM-DD date, in date order
+        """
+        return {self.date_string(day): count for day, count in sorted(self._day_counts.items())}
+
+    @staticmethod
+    def top(counts: Dict[str, int], default: str = "No data") -> str:
+        """
+        Get the key with the highest count
+        """
+        return max(counts.items(), key=lambda x: x[1])[0] if counts else default
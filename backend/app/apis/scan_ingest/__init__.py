@@ -0,0 +1,52 @@
+from typing import Any, Callable, List
+
+from fastapi import APIRouter
+from app.apis.batch_queue import BatchQueue, get_queues
+
+router = APIRouter(prefix="/scan-ingest", tags=["scan-ingest"])
+
+# Firestore rejects batches with more than 500 writes
+MAX_FIRESTORE_BATCH_SIZE = 500
+
+
+class ScanIngestionQueue(BatchQueue):
+    """
+    Batch queue for scan data written to Firestore.
+
+    Batches are capped at Firestore's batch write limit. The queue is drained at
+    shutdown with every other batch queue (see batch_queue.drain_all_queues).
+    """
+
+    def __init__(
+        self,
+        name: str,
+        flush_handler: Callable[[List[Any]], None],
+        max_batch_size: int = MAX_FIRESTORE_BATCH_SIZE,
+        flush_interval_ms: int = 250,
+        max_queue_size: int = 20000
+    ):
+        """
+        Initialize the queue and register it under the given name
+
+        Args:
+            name: Name used to report the queue's metrics
+            flush_handler: Callable that persists a batch of items
+            max_batch_size: Maximum number of items passed to flush_handler at once
+            flush_interval_ms: Maximum time an item waits in a partial batch
+            max_queue_size: Maximum number of buffered items before new items are dropped
+        """
+        super().__init__(
+            name=name,
+            flush_handler=flush_handler,
+            max_batch_size=min(max_batch_size, MAX_FIRESTORE_BATCH_SIZE),
+            flush_interval_ms=flush_interval_ms,
+            max_queue_size=max_queue_size
+        )
+
+
+@router.get("/metrics")
+def get_ingestion_metrics():
+    """
+    Get queue depth, flush latency and dropped item counts for all scan ingestion queues
+    """
+    return {"queues": [ingestion_queue.metrics() for ingestion_queue in get_queues(ScanIngestionQueue)]}
@@ -1,20 +1,27 @@
 from fastapi import APIRouter, Request, Response, Path, HTTPException, Depends
 from fastapi.responses import RedirectResponse
-from typing import Optional, Dict, Any
-import time
+from typing import Optional, Dict, Any, List
 import uuid
 from pydantic import BaseModel
 from app.apis.scan_event import ScanEvent, ScanLocation
-from app.apis.scan_stats import ScanStats
-from app.apis.qr_code import QRCode
+from app.apis.scan_stats import ScanStats, get_stats_document_id
+from app.apis.qr_code import QRCode, ResolvedQRCode, qr_resolution_cache, is_short_code, get_qr_code_id_for_short_code, get_qr_document_id
 from app.apis.firestore_repository import FirestoreRepository
+from app.apis.scan_ingest import ScanIngestionQueue
+from app.apis.sharded_counter import scan_counter_policy, write_sharded_increment
+from app.apis.scan_rollups import add_rollup_writes
+from collections import defaultdict
+import logging
+from firebase_admin import firestore
 import re
 import user_agents
-from starlette.background import BackgroundTasks
 from app.env import mode, Mode
+from app.apis.trace_log import start_sampled_request
+
+logger = logging.getLogger(__name__)
 
 # Log environment information for debugging
-print(f"[TRACK QR] Environment mode: {mode}")
+logger.info("Environment mode: %s", mode)
 
 # Initialize repositories
 qr_code_repo = FirestoreRepository[QRCode](collection_name="qr_codes", model_class=QRCode)
@@ -56,7 +63,7 @@ def parse_user_agent(user_agent_string: str) -> Dict[str, Any]:
             "os": ua.os.family
         }
     except Exception as e:
-        print(f"Error parsing user agent: {str(e)}")
+        logger.warning("Error parsing user agent: %s", e)
         return {"device_type": "unknown"}
 
 
@@ -66,131 +73,205 @@ def get_qr_code(qr_code_id: str) -> Optional[QRCode]:
     """
     try:
         # Get the QR code from the database
-        qr_codes = qr_code_repo.query_by_field("id", qr_code_id)
+        qr_code = qr_code_repo.get_by_id(qr_code_id)
         
-        if not qr_codes:
-            print(f"QR code {qr_code_id} not found in database")
+        if qr_code is None:
+            logger.debug("QR code %s not found in database", qr_code_id)
             return None
         
-        qr_code = qr_codes[0]
-        print(f"Successfully retrieved QR code {qr_code_id}")
+        logger.debug("Successfully retrieved QR code %s", qr_code_id)
         return qr_code
         
     except Exception as e:
-        print(f"Error retrieving QR code {qr_code_id}: {str(e)}")
+        logger.error("Error retrieving QR code %s: %s", qr_code_id, e)
         return None
 
 
+def resolve_qr_code(tracking_id: str) -> Optional[ResolvedQRCode]:
+    """
+    Resolve the redirect target for a tracking ID, serving hot codes from the in-process cache
+    
+    The tracking ID is either a short code or, for QR codes created before short
+    codes, the QR code ID. Both are cached under the ID that was scanned.
+    """
+    resolved = qr_resolution_cache.get(tracking_id)
+    if resolved is not None:
+        return resolved
+
+    qr_code = None
+    if is_short_code(tracking_id):
+        qr_code_id = get_qr_code_id_for_short_code(tracking_id)
+        if qr_code_id is not None:
+            qr_code = get_qr_code(qr_code_id)
+    if qr_code is None:
+        qr_code = get_qr_code(tracking_id)
+    if qr_code is None:
+        return None
+
+    resolved = ResolvedQRCode.from_qr_code(qr_code)
+    qr_resolution_cache.set(tracking_id, resolved)
+    return resolved
+
+
+def build_stats_increments(events: List[ScanEvent]) -> Dict[str, Dict[str, Any]]:
+    """
+    Aggregate a batch of scan events with ScanStats.update_with_scan into one increment update per QR code
+    """
+    deltas: Dict[str, ScanStats] = {}
+    for event in events:
+        delta = deltas.get(event.qr_code_id)
+        if delta is None:
+            delta = deltas[event.qr_code_id] = ScanStats(qr_code_id=event.qr_code_id, store_hash=event.store_hash)
+        delta.update_with_scan(event)
+    
+    return {qr_code_id: delta.to_increment_dict() for qr_code_id, delta in deltas.items()}
+
+
+def increment_qr_scan_count(qr_code_id: str, count: int):
+    """
+    Atomically increment a QR code's scan_count, resolving legacy document IDs if needed
+    """
+    try:
+        qr_code_repo.collection.document(qr_code_id).update({"scan_count": firestore.Increment(count)})
+    except Exception:
+        found = qr_code_repo.get_with_document_id(qr_code_id)
+        if not found:
+            logger.warning("QR code not found for ID: %s", qr_code_id)
+            return
+        qr_code_repo.collection.document(found[0]).update({"scan_count": firestore.Increment(count)})
+
+
+def add_scan_counter_writes(batch, qr_code_id: str, count: int, stats_update: Dict[str, Any]):
+    """
+    Add the counter writes for one QR code to a batch, spreading them over shards if its write rate calls for it
+    """
+    qr_ref = qr_code_repo.collection.document(qr_code_id)
+    stats_ref = scan_stats_repo.collection.document(get_stats_document_id(qr_code_id))
+    shard_count, shard_count_changed = scan_counter_policy.record_write(qr_code_id)
+    
+    if not shard_count:
+        batch.update(qr_ref, {"scan_count": firestore.Increment(count)})
+        batch.set(stats_ref, stats_update, merge=True)
+        return
+    
+    stats_counters = dict(stats_update)
+    stats_identity = {"qr_code_id": stats_counters.pop("qr_code_id"), "store_hash": stats_counters.pop("store_hash")}
+    # Shards and the shard count marker belong under the document that actually stores the QR code
+    document_id = get_qr_document_id(qr_code_id)
+    if document_id is None:
+        logger.warning("QR code not found for ID: %s", qr_code_id)
+    else:
+        write_sharded_increment(batch, qr_code_repo.collection.document(document_id), {"scan_count": firestore.Increment(count)},
+                                shard_count, shard_count_changed=shard_count_changed, parent_must_exist=True)
+    write_sharded_increment(batch, stats_ref, stats_counters, shard_count,
+                            parent_fields=stats_identity, shard_count_changed=shard_count_changed)
+
+
+def apply_scan_counters(events: List[ScanEvent]):
+    """
+    Update QR code scan counts, scan statistics and daily rollups with server-side atomic increments
+    
+    Counts are summed per QR code (and per day for rollups) first, so each counter
+    document gets a single write per batch no matter how many scans the batch contains.
+    """
+    scan_counts = defaultdict(int)
+    for event in events:
+        scan_counts[event.qr_code_id] += 1
+    stats_updates = build_stats_increments(events)
+    
+    batch = qr_code_repo.db.batch()
+    for qr_code_id, count in scan_counts.items():
+        add_scan_counter_writes(batch, qr_code_id, count, stats_updates[qr_code_id])
+    add_rollup_writes(batch, events)
+    
+    try:
+        batch.commit()
+        return
+    except Exception as e:
+        # The batch is atomic, so nothing was applied; retry each document on its own
+        logger.warning("Batched scan counter update failed, retrying per document: %s", e)
+    
+    for qr_code_id, count in scan_counts.items():
+        try:
+            increment_qr_scan_count(qr_code_id, count)
+            scan_stats_repo.collection.document(get_stats_document_id(qr_code_id)).set(stats_updates[qr_code_id], merge=True)
+        except Exception as e:
+            logger.error("Error updating scan counters for QR code %s: %s", qr_code_id, e)
+    
+    try:
+        rollup_batch = qr_code_repo.db.batch()
+        add_rollup_writes(rollup_batch, events)
+        rollup_batch.commit()
+    except Exception as e:
+        logger.error("Error updating daily scan rollups: %s", e)
+
+
 def update_scan_stats(scan_event: ScanEvent):
     """
     Update or create scan statistics for the QR code
     """
     try:
-        # First, update scan count on the QR code itself to ensure it increments even if stats fail
-        qr_codes = qr_code_repo.query_by_field("id", scan_event.qr_code_id)
-        if qr_codes:
-            qr_code = qr_codes[0]
-            qr_code.scan_count += 1
-            
-            # Update QR code directly to increment scan count
-            qr_code_repo.collection.document(qr_code.id).update({"scan_count": qr_code.scan_count})
-            print(f"Updated QR code scan count to {qr_code.scan_count} for QR code {scan_event.qr_code_id}")
-        else:
-            print(f"QR code not found for ID: {scan_event.qr_code_id}")
-            return
-        
-        # Track scan statistics in the background
-        scan_stats_list = scan_stats_repo.query_by_field("qr_code_id", scan_event.qr_code_id)
-        
-        if scan_stats_list:
-            # Update existing stats
-            scan_stats = scan_stats_list[0]
-            scan_stats.last_scan_timestamp = scan_event.timestamp
-            scan_stats.scan_count += 1
-            
-            # Update country counts
-            if scan_event.location and scan_event.location.country:
-                country = scan_event.location.country
-                if country in scan_stats.country_counts:
-                    scan_stats.country_counts[country] += 1
-                else:
-                    scan_stats.country_counts[country] = 1
-            
-            # Update device counts
-            if scan_event.device_type:
-                device = scan_event.device_type
-                if device in scan_stats.device_counts:
-                    scan_stats.device_counts[device] += 1
-                else:
-                    scan_stats.device_counts[device] = 1
-            
-            # Update browser counts
-            if scan_event.browser:
-                browser = scan_event.browser
-                if browser in scan_stats.browser_counts:
-                    scan_stats.browser_counts[browser] += 1
-                else:
-                    scan_stats.browser_counts[browser] = 1
-            
-            # Save the updated stats
-            scan_stats_repo.update(scan_stats.id, scan_stats)
-        else:
-            # Create new stats record
-            scan_stats = ScanStats(
-                id=f"stats-{scan_event.qr_code_id}",
-                qr_code_id=scan_event.qr_code_id,
-                store_hash=scan_event.store_hash,
-                first_scan_timestamp=scan_event.timestamp,
-                last_scan_timestamp=scan_event.timestamp,
-                scan_count=1,
-                country_counts={scan_event.location.country: 1} if scan_event.location and scan_event.location.country else {},
-                device_counts={scan_event.device_type: 1} if scan_event.device_type else {},
-                browser_counts={scan_event.browser: 1} if scan_event.browser else {}
-            )
-            
-            # Add the new stats
-            scan_stats_repo.add(scan_stats, document_id=scan_stats.id)
-        
-        print(f"Successfully updated scan statistics for QR code {scan_event.qr_code_id}")
+        apply_scan_counters([scan_event])
+        logger.debug("Successfully updated scan statistics for QR code %s", scan_event.qr_code_id)
     except Exception as e:
-        print(f"Error updating scan stats: {str(e)}")
+        logger.error("Error updating scan stats: %s", e)
+
+
+def write_scan_events(events: List[ScanEvent]):
+    """
+    Persist a batch of scan events with a single Firestore batch write, then update statistics
+    """
+    batch = scan_event_repo.db.batch()
+    for event in events:
+        batch.set(scan_event_repo.collection.document(event.id), event.dict())
+    batch.commit()
+    logger.debug("Recorded batch of %d scan events", len(events))
+    
+    apply_scan_counters(events)
+
+
+# Scan events are buffered in-process and written in batches off the request path
+scan_event_queue = ScanIngestionQueue(
+    name="scan_events",
+    flush_handler=write_scan_events,
+    flush_interval_ms=250,
+    max_queue_size=20000
+)
 
 
 @router.get("/{qr_code_id}")
-async def track_scan(request: Request, background_tasks: BackgroundTasks, qr_code_id: str = Path(...)):
+async def track_scan(request: Request, qr_code_id: str = Path(...)):
     """
     Track a QR code scan and redirect to the target URL
     """
-    print(f"[TRACK QR] Received tracking request for QR code ID: {qr_code_id}")
-    print(f"[TRACK QR] Request headers: {dict(request.headers)}")
-    print(f"[TRACK QR] Request URL: {request.url}")
-    print(f"[TRACK QR] Request path: {request.url.path}")
-    print(f"[TRACK QR] Request query params: {request.query_params}")
-    print(f"[TRACK QR] Current environment: {'PRODUCTION' if mode == Mode.PROD else 'DEVELOPMENT'}")
+    # Debug lines are sampled per request and only formatted when emitted
+    start_sampled_request()
+    logger.debug("Received tracking request for QR code ID: %s", qr_code_id)
+    logger.debug("Request headers: %s", request.headers)
+    logger.debug("Request URL: %s", request.url)
+    logger.debug("Request query params: %s", request.query_params)
     
     # Lookup the target URL for redirecting
-    qr_code = get_qr_code(qr_code_id)
+    qr_code = resolve_qr_code(qr_code_id)
     
-    print(f"[TRACK QR] Fetched QR code for ID {qr_code_id}: {qr_code}")
-    print(f"[TRACK QR] Target URL: {qr_code.target.url if qr_code and qr_code.target else 'None'}")
+    logger.debug("Resolved QR code for ID %s: %s", qr_code_id, qr_code)
     
-    if qr_code is None or not qr_code.target or not qr_code.target.url:
-        print(f"[TRACK QR] QR code {qr_code_id} has no valid target URL")
+    if qr_code is None or not qr_code.target_url:
+        logger.warning("QR code %s has no valid target URL", qr_code_id)
         # Instead of returning JSON, redirect to a default error page in both environments
         error_url = "https://app.getrobo.xyz/error/invalid-qr" if mode == Mode.PROD else "https://databutton.com/error/invalid-qr"
-        print(f"[TRACK QR] Redirecting to error page: {error_url}")
+        logger.debug("Redirecting to error page: %s", error_url)
         return RedirectResponse(url=error_url, status_code=307)
         
     # Get target URL
-    target_url = qr_code.target.url
-    print(f"[TRACK QR] Will redirect to target URL: {target_url}")
+    target_url = qr_code.target_url
     
     # Check if the QR code is active before redirecting
-    if hasattr(qr_code, 'active') and not qr_code.active:
-        print(f"[TRACK QR] QR code {qr_code_id} is marked as inactive")
+    if not qr_code.active:
+        logger.info("QR code %s is marked as inactive", qr_code_id)
         # Redirect to a proper error page in both environments
         inactive_url = "https://app.getrobo.xyz/error/inactive-qr" if mode == Mode.PROD else "https://databutton.com/error/inactive-qr"
-        print(f"[TRACK QR] Redirecting to inactive page: {inactive_url}")
+        logger.debug("Redirecting to inactive page: %s", inactive_url)
         return RedirectResponse(url=inactive_url, status_code=307)
     
     # Collect scan data
@@ -203,7 +284,7 @@ async def track_scan(request: Request, background_tasks: BackgroundTasks, qr_cod
     
     # Create scan event
     scan_event = ScanEvent(
-        qr_code_id=qr_code_id,
+        qr_code_id=qr_code.id,  # The scanned ID may be a short code
         store_hash=qr_code.store_hash,
         ip_address=ip_address,
         user_agent=user_agent_string,
@@ -214,40 +295,15 @@ async def track_scan(request: Request, background_tasks: BackgroundTasks, qr_cod
         session_id=str(uuid.uuid4())  # Generate a unique session ID
     )
     
-    print(f"[TRACK QR] User agent parsed: device={scan_event.device_type}, browser={scan_event.browser}, os={scan_event.os}")
+    logger.debug("User agent parsed: device=%s, browser=%s, os=%s", scan_event.device_type, scan_event.browser, scan_event.os)
     
-    # Save scan event in the background to not slow down the redirect
-    def save_scan_event_and_update_stats(event):
-        try:
-            # Set timestamp on the event before serialization
-            event.timestamp = int(time.time())
-            
-            # First add the scan event without using the repository to avoid serialization issues
-            scan_event_dict = event.dict()
-            
-            # Add directly to Firestore collection
-            scan_event_id = str(uuid.uuid4())
-            scan_event_ref = scan_event_repo.collection.document(scan_event_id)
-            scan_event_ref.set(scan_event_dict)
-            
-            # Log successful event recording
-            print(f"[TRACK QR] Successfully recorded scan event {scan_event_id} for QR code {event.qr_code_id}")
-            
-            # Update scan statistics
-            update_scan_stats(event)
-            print(f"[TRACK QR] Successfully updated scan statistics for QR code {event.qr_code_id}")
-        except Exception as e:
-            print(f"[TRACK QR] Error saving scan event: {str(e)}")
-    
-    # Add task to background
-    background_tasks.add_task(save_scan_event_and_update_stats, scan_event)
+    # Queue the scan event for batched ingestion to not slow down the redirect
+    if not scan_event_queue.enqueue(scan_event):
+        logger.warning("Scan event queue is full, dropped scan event for QR code %s", qr_code_id)
     
     # Log the scan
-    print(
-        f"[TRACK QR] QR code scan complete: qr_code_id={qr_code_id}, store_hash={qr_code.store_hash}, redirecting to: {target_url}"
-    )
+    logger.debug("QR code scan complete: qr_code_id=%s, store_hash=%s, redirecting to: %s", qr_code_id, qr_code.store_hash, target_url)
     
     # Redirect to target URL with explicit 307 Temporary Redirect status code
     # Using 307 ensures the redirect maintains the same HTTP method
-    print(f"[TRACK QR] Executing final redirect to: {target_url}")
     return RedirectResponse(url=target_url, status_code=307)
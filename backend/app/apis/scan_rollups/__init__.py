@@ -0,0 +1,488 @@
+from fastapi import APIRouter, HTTPException, Query
+from pydantic import BaseModel, Field
+from typing import Dict, Any, Optional, List, Tuple
+import threading
+import time
+import uuid
+from datetime import datetime
+from collections import defaultdict
+from firebase_admin import firestore
+from google.cloud.firestore_v1.base_query import FieldFilter
+from app.apis.firestore_repository import FirestoreRepository
+from app.apis.scan_event import ScanEvent
+from app.apis.ttl_cache import TTLCache
+
+router = APIRouter(prefix="/scan-rollups", tags=["scan_rollups"])
+
+# Rollups are versioned per store. A backfill builds the next generation from
+# scan_events while live ingestion keeps incrementing the active one, and the
+# store switches to the new generation in a single write once it is complete.
+# Reading a generation for a date range needs the composite indexes in
+# firestore.indexes.json: (store_hash, generation, date) and (qr_code_id, generation, date).
+
+# Seconds a store's rollup state is cached by writers and readers
+ROLLUP_STATE_CACHE_TTL_SECONDS = 5
+
+# Seconds between announcing a backfill and its cutoff, and between the cutoff and
+# reading scan_events. Must exceed the state cache TTL plus the scan ingestion delay.
+ROLLUP_BACKFILL_SETTLE_SECONDS = 15
+
+# Seconds after which a backfill that never finished, e.g. because its worker
+# restarted, no longer blocks a new backfill of the store
+ROLLUP_BACKFILL_STALE_SECONDS = 60 * 60
+
+
+class ScanRollup(BaseModel):
+    """
+    Scan counts for one QR code on one day, maintained at ingest time
+    """
+    store_hash: str
+    qr_code_id: str
+    date: str  # "YYYY-MM-DD"
+    generation: int = 1  # see RollupState
+    total_scans: int = 0
+    device_breakdown: Dict[str, int] = Field(default_factory=dict)  # device_type: count
+    location_breakdown: Dict[str, int] = Field(default_factory=dict)  # country_code: count
+    browser_breakdown: Dict[str, int] = Field(default_factory=dict)  # browser: count
+    last_updated: int = Field(default_factory=lambda: int(time.time()))
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Convert model to a dictionary suitable for Firestore
+        """
+        return self.dict()
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'ScanRollup':
+        """
+        Create a ScanRollup instance from a Firestore document
+        """
+        return cls(**data)
+
+    @property
+    def document_id(self) -> str:
+        return get_rollup_document_id(self.store_hash, self.generation, self.date, self.qr_code_id)
+
+    def add_scan(self, scan_event: ScanEvent) -> None:
+        """
+        Count a scan event in this rollup
+        """
+        self.total_scans += 1
+        self.device_breakdown[scan_event.device_type] = self.device_breakdown.get(scan_event.device_type, 0) + 1
+        if scan_event.location and scan_event.location.country:
+            country = scan_event.location.country
+            self.location_breakdown[country] = self.location_breakdown.get(country, 0) + 1
+        if scan_event.browser:
+            self.browser_breakdown[scan_event.browser] = self.browser_breakdown.get(scan_event.browser, 0) + 1
+
+    def to_increment_dict(self) -> Dict[str, Any]:
+        """
+        Convert the counts into a Firestore merge update that adds them to the stored rollup
+        """
+        update = {
+            "store_hash": self.store_hash,
+            "qr_code_id": self.qr_code_id,
+            "date": self.date,
+            "generation": self.generation,
+            "total_scans": firestore.Increment(self.total_scans),
+            "last_updated": self.last_updated,
+        }
+        for field in ("device_breakdown", "location_breakdown", "browser_breakdown"):
+            counts = getattr(self, field)
+            if counts:
+                update[field] = {key: firestore.Increment(count) for key, count in counts.items()}
+        return update
+
+
+class RollupState(BaseModel):
+    """
+    Which rollup generations of a store are read and written
+
+    Readers use the active generation, 0 until the first backfill completes.
+    While a backfill builds the next generation, live ingestion also adds scans
+    after the backfill's cutoff to it; the backfill counts the scans up to it.
+    The state also tracks the store's latest backfill job.
+    """
+    store_hash: str
+    generation: int = 0
+    building_generation: Optional[int] = None
+    cutoff: Optional[int] = None
+    status: str = "idle"  # "running", "completed" or "failed" once a backfill was started
+    job_id: Optional[str] = None
+    started_at: Optional[int] = None
+    completed_at: Optional[int] = None
+    error: Optional[str] = None
+    events_processed: int = 0
+    rollups_written: int = 0
+
+
+class BackfillJobResponse(BaseModel):
+    job_id: str
+    backfills: List[RollupState]
+
+
+class BackfillInProgress(Exception):
+    """
+    Raised when a backfill is started for a store that is already being backfilled
+    """
+
+    def __init__(self, state: RollupState):
+        super().__init__(f"Rollups of store {state.store_hash} are already being rebuilt by job {state.job_id}")
+        self.state = state
+
+
+# Initialize the repositories
+scan_rollup_repo = FirestoreRepository[ScanRollup](collection_name="scan_rollups_daily", model_class=ScanRollup)
+rollup_state_repo = FirestoreRepository[RollupState](collection_name="scan_rollup_backfills", model_class=RollupState)
+scan_event_repo = FirestoreRepository[ScanEvent](collection_name="scan_events", model_class=ScanEvent)
+
+rollup_state_cache = TTLCache(name="rollup_states", max_entries=10000, ttl_seconds=ROLLUP_STATE_CACHE_TTL_SECONDS)
+
+# Firestore rejects batches with more than 500 writes
+MAX_BATCH_WRITES = 500
+
+
+def get_scan_date(timestamp: int) -> str:
+    """
+    Get the day a scan is counted under, matching ScanStats.daily_scans
+    """
+    return datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d")
+
+
+def get_rollup_document_id(store_hash: str, generation: int, date: str, qr_code_id: str) -> str:
+    """
+    Get the ID of the rollup document for a store, generation, day and QR code
+    """
+    return f"{store_hash}_g{generation}_{date}_{qr_code_id}"
+
+
+def build_rollups(events, generation: int = 1) -> Dict[Tuple[str, str], ScanRollup]:
+    """
+    Count scan events into one rollup per QR code and day of a generation
+    """
+    rollups: Dict[Tuple[str, str], ScanRollup] = {}
+    for event in events:
+        date = get_scan_date(event.timestamp)
+        rollup = rollups.get((event.qr_code_id, date))
+        if rollup is None:
+            rollup = rollups[(event.qr_code_id, date)] = ScanRollup(
+                store_hash=event.store_hash,
+                qr_code_id=event.qr_code_id,
+                date=date,
+                generation=generation
+            )
+        rollup.add_scan(event)
+    return rollups
+
+
+def load_rollup_state(store_hash: str) -> RollupState:
+    """
+    Read a store's rollup state, bypassing the cache
+    """
+    state = rollup_state_repo.get(store_hash)
+    if state is None or state.store_hash != store_hash:
+        # Records from before rollups were versioned have no generation and are not read
+        state = RollupState(store_hash=store_hash)
+    return state
+
+
+def get_rollup_state(store_hash: str) -> RollupState:
+    """
+    Get a store's rollup state, cached for ROLLUP_STATE_CACHE_TTL_SECONDS
+    """
+    return rollup_state_cache.get_or_load(store_hash, lambda: load_rollup_state(store_hash))
+
+
+def get_rollup_generation(store_hash: str) -> int:
+    """
+    Get the rollup generation to read for a store, 0 if its rollups have not been backfilled
+    """
+    return get_rollup_state(store_hash).generation
+
+
+def add_rollup_writes(batch, events: List[ScanEvent]) -> None:
+    """
+    Add increment updates for the daily rollups touched by a batch of scan events
+
+    Scans are added to the store's active generation, and to a generation being
+    backfilled if they are newer than its cutoff. Stores that were never
+    backfilled get no rollup writes, since nothing reads them until a backfill
+    has counted their full history.
+    """
+    events_by_store = defaultdict(list)
+    for event in events:
+        events_by_store[event.store_hash].append(event)
+
+    for store_hash, store_events in events_by_store.items():
+        state = get_rollup_state(store_hash)
+        targets = []
+        if state.generation:
+            targets.append((state.generation, store_events))
+        if state.building_generation:
+            targets.append((state.building_generation, [event for event in store_events if event.timestamp > state.cutoff]))
+        for generation, generation_events in targets:
+            for rollup in build_rollups(generation_events, generation).values():
+                batch.set(scan_rollup_repo.collection.document(rollup.document_id), rollup.to_increment_dict(), merge=True)
+
+
+def is_rollup_backfilled(store_hash: str) -> bool:
+    """
+    Check whether the rollups of a store have been rebuilt from its full scan history
+    """
+    return get_rollup_generation(store_hash) > 0
+
+
+def query_rollups(field: str, value: str, generation: int, start_date: str, end_date: str) -> List[Dict[str, Any]]:
+    """
+    Get the raw rollup documents of a generation matching a field between two dates (inclusive)
+    """
+    query = scan_rollup_repo.collection.where(
+        filter=FieldFilter(field, "==", value)
+    ).where(
+        filter=FieldFilter("generation", "==", generation)
+    ).where(
+        filter=FieldFilter("date", ">=", start_date)
+    ).where(
+        filter=FieldFilter("date", "<=", end_date)
+    )
+    return [doc.to_dict() for doc in query.stream()]
+
+
+def start_store_backfill(store_hash: str, job_id: str) -> RollupState:
+    """
+    Announce a backfill of the next rollup generation, with a cutoff ROLLUP_BACKFILL_SETTLE_SECONDS away
+
+    Writers see the announcement within the state cache TTL, before the cutoff,
+    so every scan after the cutoff is added to the new generation live. The
+    check and the announcement are one transaction, so concurrent backfills of
+    a store cannot both claim it.
+
+    Raises:
+        BackfillInProgress: If another backfill of the store is running
+    """
+    doc_ref = rollup_state_repo.collection.document(store_hash)
+
+    def announce(transaction) -> RollupState:
+        snapshot = doc_ref.get(transaction=transaction)
+        state = RollupState(**snapshot.to_dict()) if snapshot.exists else None
+        if state is None or state.store_hash != store_hash:
+            state = RollupState(store_hash=store_hash)
+        now = int(time.time())
+        if state.building_generation and now - (state.started_at or 0) < ROLLUP_BACKFILL_STALE_SECONDS:
+            raise BackfillInProgress(state)
+        state.building_generation = max(state.generation, state.building_generation or 0) + 1
+        state.cutoff = now + ROLLUP_BACKFILL_SETTLE_SECONDS
+        state.status = "running"
+        state.job_id = job_id
+        state.started_at = now
+        state.error = None
+        transaction.set(doc_ref, state.dict())
+        return state
+
+    state = rollup_state_repo.run_transaction(announce)
+    rollup_state_cache.invalidate(store_hash)
+    return state
+
+
+def update_store_backfill(state: RollupState, **changes) -> RollupState:
+    """
+    Apply changes to a store's rollup state if the backfill still owns it
+
+    Raises:
+        BackfillInProgress: If another backfill took the store over
+    """
+    doc_ref = rollup_state_repo.collection.document(state.store_hash)
+
+    def update(transaction) -> RollupState:
+        snapshot = doc_ref.get(transaction=transaction)
+        current = RollupState(**snapshot.to_dict()) if snapshot.exists else None
+        if current is None or current.job_id != state.job_id or current.building_generation != state.building_generation:
+            raise BackfillInProgress(current or state)
+        updated = current.copy(update=changes)
+        transaction.set(doc_ref, updated.dict())
+        return updated
+
+    updated = rollup_state_repo.run_transaction(update)
+    rollup_state_cache.invalidate(state.store_hash)
+    return updated
+
+
+def delete_rollup_generation(store_hash: str, generation: int) -> None:
+    """
+    Delete the rollup documents of a generation that is no longer read
+    """
+    query = scan_rollup_repo.collection.where(
+        filter=FieldFilter("store_hash", "==", store_hash)
+    ).where(
+        filter=FieldFilter("generation", "==", generation)
+    )
+    doc_ids = [doc.id for doc in query.stream()]
+    for i in range(0, len(doc_ids), MAX_BATCH_WRITES):
+        batch = scan_rollup_repo.db.batch()
+        for doc_id in doc_ids[i:i + MAX_BATCH_WRITES]:
+            batch.delete(scan_rollup_repo.collection.document(doc_id))
+        batch.commit()
+
+
+def finish_store_backfill(state: RollupState, delete_previous: bool = True) -> RollupState:
+    """
+    Count a store's scans up to the backfill cutoff into the new generation and switch readers to it
+
+    Must run once the cutoff is more than ROLLUP_BACKFILL_SETTLE_SECONDS in the
+    past, so every scan up to it has been written to scan_events. Counts are
+    added with increments because live ingestion may already have created the
+    same rollup documents for later scans, and a rerun builds a fresh
+    generation, so the job can be rerun safely while scans keep arriving.
+
+    Args:
+        state: State returned by start_store_backfill
+        delete_previous: Wait out the state cache TTL and delete the replaced
+            generation; callers finishing several stores can do this once instead
+    """
+    store_hash = state.store_hash
+    generation = state.building_generation
+    print(f"[SCAN ROLLUPS] Building rollup generation {generation} for store {store_hash}")
+    events = (
+        ScanEvent(**doc.to_dict())
+        for doc in scan_event_repo.collection.where(filter=FieldFilter("store_hash", "==", store_hash)).stream()
+    )
+
+    events_processed = 0
+
+    def counted(events):
+        nonlocal events_processed
+        for event in events:
+            if event.timestamp <= state.cutoff:
+                events_processed += 1
+                yield event
+
+    rollups = list(build_rollups(counted(events), generation).values())
+
+    for i in range(0, len(rollups), MAX_BATCH_WRITES):
+        batch = scan_rollup_repo.db.batch()
+        for rollup in rollups[i:i + MAX_BATCH_WRITES]:
+            batch.set(scan_rollup_repo.collection.document(rollup.document_id), rollup.to_increment_dict(), merge=True)
+        batch.commit()
+
+    finished = update_store_backfill(
+        state,
+        generation=generation,
+        building_generation=None,
+        status="completed",
+        completed_at=int(time.time()),
+        events_processed=events_processed,
+        rollups_written=len(rollups)
+    )
+    print(f"[SCAN ROLLUPS] Switched store {store_hash} to rollup generation {generation} ({len(rollups)} rollups from {events_processed} scan events)")
+
+    if delete_previous and state.generation:
+        # Writers may still add to the old generation until their cached state expires
+        time.sleep(ROLLUP_STATE_CACHE_TTL_SECONDS)
+        delete_rollup_generation(store_hash, state.generation)
+    return finished
+
+
+def fail_store_backfill(state: RollupState, error: Exception) -> None:
+    """
+    Record a failed backfill and drop the generation it was building
+    """
+    print(f"[SCAN ROLLUPS] Error rebuilding rollups of store {state.store_hash}: {str(error)}")
+    try:
+        update_store_backfill(state, building_generation=None, cutoff=None, status="failed", error=str(error))
+    except BackfillInProgress:
+        # Another backfill owns the store now and builds its own generation
+        return
+    time.sleep(ROLLUP_STATE_CACHE_TTL_SECONDS)
+    delete_rollup_generation(state.store_hash, state.building_generation)
+
+
+def list_rollup_store_hashes() -> List[str]:
+    """
+    Get the stores that have QR codes
+    """
+    return sorted({doc.to_dict().get("store_hash") for doc in scan_rollup_repo.db.collection("qr_codes").stream()} - {None})
+
+
+def run_backfill_job(job_id: str, states: List[RollupState], all_stores: bool = False) -> None:
+    """
+    Rebuild the daily rollups of stores from their scan_events without losing live scans
+
+    Runs on a background thread. Progress is recorded in each store's RollupState.
+
+    Args:
+        job_id: ID of the job, recorded in the stores' states
+        states: Backfills already started by the caller
+        all_stores: Also start backfills of every store with QR codes
+    """
+    states = list(states)
+    if all_stores:
+        started = {state.store_hash for state in states}
+        for store_hash in list_rollup_store_hashes():
+            if store_hash in started:
+                continue
+            try:
+                states.append(start_store_backfill(store_hash, job_id))
+            except BackfillInProgress as e:
+                print(f"[SCAN ROLLUPS] Skipping store {store_hash}: {str(e)}")
+    if not states:
+        return
+
+    time.sleep(max(0.0, max(state.cutoff for state in states) + ROLLUP_BACKFILL_SETTLE_SECONDS - time.time()))
+    replaced = []
+    for state in states:
+        try:
+            finish_store_backfill(state, delete_previous=False)
+            if state.generation:
+                replaced.append((state.store_hash, state.generation))
+        except Exception as e:
+            fail_store_backfill(state, e)
+
+    if replaced:
+        # Writers may still add to the old generations until their cached states expire
+        time.sleep(ROLLUP_STATE_CACHE_TTL_SECONDS)
+        for store_hash, generation in replaced:
+            delete_rollup_generation(store_hash, generation)
+    print(f"[SCAN ROLLUPS] Backfill job {job_id} finished for {len(states)} stores")
+
+
+@router.post("/backfill", response_model=BackfillJobResponse, status_code=202)
+def backfill_rollups(
+    store_hash: Optional[str] = Query(None, description="Store to rebuild rollups for, all stores with QR codes if omitted")
+):
+    """
+    Start rebuilding the daily rollups from existing scan_events
+
+    The rebuild runs in the background and takes at least twice
+    ROLLUP_BACKFILL_SETTLE_SECONDS; poll GET /scan-rollups/backfill/{job_id}
+    for its progress.
+    """
+    job_id = uuid.uuid4().hex
+    states = []
+    if store_hash:
+        try:
+            states.append(start_store_backfill(store_hash, job_id))
+        except BackfillInProgress as e:
+            raise HTTPException(status_code=409, detail=str(e))
+        except Exception as e:
+            print(f"[SCAN ROLLUPS] Error starting rollup backfill: {str(e)}")
+            raise HTTPException(status_code=500, detail=f"Error starting rollup backfill: {str(e)}")
+
+    threading.Thread(
+        target=run_backfill_job,
+        args=(job_id, states, store_hash is None),
+        name=f"rollup-backfill-{job_id[:8]}",
+        daemon=True
+    ).start()
+    return BackfillJobResponse(job_id=job_id, backfills=states)
+
+
+@router.get("/backfill/{job_id}", response_model=BackfillJobResponse)
+def get_backfill_job(job_id: str):
+    """
+    Get the rollup states of the stores a backfill job has started
+    """
+    try:
+        return BackfillJobResponse(job_id=job_id, backfills=rollup_state_repo.query_by_field("job_id", job_id))
+    except Exception as e:
+        print(f"[SCAN ROLLUPS] Error getting backfill job {job_id}: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error getting backfill job: {str(e)}")
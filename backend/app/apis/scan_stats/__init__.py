@@ -2,7 +2,10 @@ from pydantic import BaseModel, Field
 from typing import Dict, Any, Optional, List
 import time
 from fastapi import APIRouter, HTTPException, Path, Query, Depends
+from firebase_admin import firestore
 from app.apis.firestore_repository import FirestoreRepository
+from app.apis.sharded_counter import read_sharded_document
+from app.apis.qr_code import get_qr_code_names
 
 router = APIRouter(prefix="/scan-stats", tags=["scan_stats"])
 
@@ -17,8 +20,11 @@ class ScanStats(BaseModel):
     daily_scans: Dict[str, int] = Field(default_factory=dict)  # "YYYY-MM-DD": count
     device_breakdown: Dict[str, int] = Field(default_factory=dict)  # device_type: count
     location_breakdown: Dict[str, int] = Field(default_factory=dict)  # country_code: count
+    browser_breakdown: Dict[str, int] = Field(default_factory=dict)  # browser: count
     conversions: int = 0
+    last_scan_timestamp: Optional[int] = None
     last_updated: int = Field(default_factory=lambda: int(time.time()))
+    counter_shards: int = 0  # number of counter shards holding part of the counts, 0 if unsharded
     
     def to_dict(self) -> Dict[str, Any]:
         """
@@ -43,8 +49,9 @@ class ScanStats(BaseModel):
         # Increment total scan count
         self.total_scans += 1
         
-        # Update timestamp
+        # Update timestamps
         self.last_updated = int(time.time())
+        self.last_scan_timestamp = max(self.last_scan_timestamp or 0, scan_event.timestamp)
         
         # Get date string for daily counts
         from datetime import datetime
@@ -71,13 +78,83 @@ class ScanStats(BaseModel):
             else:
                 self.location_breakdown[country] = 1
         
+        # Update browser breakdown
+        browser = scan_event.browser
+        if browser:
+            if browser in self.browser_breakdown:
+                self.browser_breakdown[browser] += 1
+            else:
+                self.browser_breakdown[browser] = 1
+        
         # Update conversions if applicable
         if scan_event.conversion:
             self.conversions += 1
+    
+    def to_increment_dict(self) -> Dict[str, Any]:
+        """
+        Convert statistics accumulated from new scans into a Firestore merge update
+        
+        Every count becomes a firestore.Increment, so applying the result with
+        set(..., merge=True) adds these scans to the stored totals in a single write.
+        """
+        def increments(counts: Dict[str, int]) -> Dict[str, Any]:
+            return {key: firestore.Increment(count) for key, count in counts.items()}
+        
+        update = {
+            "qr_code_id": self.qr_code_id,
+            "store_hash": self.store_hash,
+            "total_scans": firestore.Increment(self.total_scans),
+            "last_updated": self.last_updated,
+        }
+        if self.last_scan_timestamp is not None:
+            update["last_scan_timestamp"] = self.last_scan_timestamp
+        if self.conversions:
+            update["conversions"] = firestore.Increment(self.conversions)
+        for field in ("daily_scans", "device_breakdown", "location_breakdown", "browser_breakdown"):
+            counts = getattr(self, field)
+            if counts:
+                update[field] = increments(counts)
+        return update
 
 # Initialize the repository
 scan_stats_repo = FirestoreRepository[ScanStats](collection_name="scan_stats", model_class=ScanStats)
 
+# Stats fields that hold a point in time rather than a count, merged across shards by taking the latest
+STATS_TIMESTAMP_FIELDS = ("last_updated", "last_scan_timestamp")
+
+
+def get_stats_document_id(qr_code_id: str) -> str:
+    """
+    Get the ID of the scan stats document for a QR code
+    """
+    return f"stats-{qr_code_id}"
+
+
+def sum_stats_shards(stats: ScanStats) -> ScanStats:
+    """
+    Fold the counter shards of a sharded stats document into its totals
+    """
+    if not stats.counter_shards:
+        return stats
+    doc_ref = scan_stats_repo.collection.document(get_stats_document_id(stats.qr_code_id))
+    data = read_sharded_document(doc_ref, stats.to_dict(), max_fields=STATS_TIMESTAMP_FIELDS)
+    return ScanStats.from_dict(data)
+
+
+def load_scan_stats(qr_code_id: str) -> Optional[ScanStats]:
+    """
+    Get the statistics for a QR code with any counter shards summed in
+    """
+    doc_ref = scan_stats_repo.collection.document(get_stats_document_id(qr_code_id))
+    doc = doc_ref.get()
+    if doc.exists:
+        data = read_sharded_document(doc_ref, doc.to_dict(), max_fields=STATS_TIMESTAMP_FIELDS)
+        return ScanStats.from_dict(data)
+
+    # Fall back to a field query for stats documents stored under other IDs
+    stats_list = scan_stats_repo.query_by_field("qr_code_id", qr_code_id)
+    return stats_list[0] if stats_list else None
+
 class GetScanStatsResponse(BaseModel):
     stats: ScanStats
 
@@ -85,6 +162,7 @@ class GetScanStatsResponse(BaseModel):
 class ListScanStatsResponse(BaseModel):
     stats: List[ScanStats]
     count: int
+    names: Dict[str, str] = Field(default_factory=dict)  # qr_code_id: QR code name
 
 
 @router.get("/{qr_code_id}", response_model=GetScanStatsResponse)
@@ -93,9 +171,9 @@ def get_scan_stats(qr_code_id: str = Path(..., description="The ID of the QR cod
     Get scan statistics for a specific QR code
     """
     # Fetch stats from the database
-    stats_list = scan_stats_repo.query_by_field("qr_code_id", qr_code_id)
+    stats = load_scan_stats(qr_code_id)
     
-    if not stats_list:
+    if stats is None:
         # Return empty stats if not found
         stats = ScanStats(
             qr_code_id=qr_code_id,
@@ -106,8 +184,6 @@ def get_scan_stats(qr_code_id: str = Path(..., description="The ID of the QR cod
             location_breakdown={},
             conversions=0
         )
-    else:
-        stats = stats_list[0]
     
     return GetScanStatsResponse(stats=stats)
 
@@ -123,7 +199,7 @@ def list_scan_stats(
     List scan statistics for QR codes in a store
     """
     # Fetch all stats for the store
-    all_stats = scan_stats_repo.query_by_field("store_hash", store_hash)
+    all_stats = [sum_stats_shards(stats) for stats in scan_stats_repo.query_by_field("store_hash", store_hash)]
     
     # Filter by time period if specified
     if time_period and all_stats:
@@ -157,4 +233,7 @@ def list_scan_stats(
     # Apply pagination
     paginated_stats = sorted_stats[offset:offset + limit]
     
-    return ListScanStatsResponse(stats=paginated_stats, count=len(sorted_stats))
+    # Name the QR codes on this page with one bulk lookup
+    names = get_qr_code_names(store_hash, [stats.qr_code_id for stats in paginated_stats])
+    
+    return ListScanStatsResponse(stats=paginated_stats, count=len(sorted_stats), names=names)
@@ -0,0 +1,156 @@
+from typing import Any, Dict, Iterable, Optional, Tuple
+import math
+import os
+import random
+import threading
+import time
+
+from fastapi import APIRouter
+
+# Create an empty router to satisfy Databutton API module requirements
+# This is a utility module, not an API endpoint module
+router = APIRouter()
+
+# Subcollection holding the shard documents of a sharded counter
+SHARD_COLLECTION = "counter_shards"
+
+# Field on the parent document recording how many shards its counters are spread over.
+# Documents without it (or with 0) keep their counters in the document itself.
+SHARD_COUNT_FIELD = "counter_shards"
+
+# Sharding is opt-in: "off" keeps every counter in its parent document,
+# "auto" spreads a document's counters over shards once its write rate calls for it
+SCAN_COUNTER_SHARDING = os.environ.get("SCAN_COUNTER_SHARDING", "off").lower()
+MAX_COUNTER_SHARDS = int(os.environ.get("MAX_COUNTER_SHARDS", "32"))
+
+# Firestore sustains roughly one write per second to a single document
+WRITES_PER_SHARD_PER_SECOND = 1.0
+
+
+class ShardingPolicy:
+    """
+    Chooses a shard count per counter document from its observed write rate.
+
+    Rates are measured over a sliding window in this process. The shard count
+    only grows: readers sum every shard that exists, so a larger count is always
+    safe, and shrinking would only matter once the old shards are compacted.
+    """
+
+    def __init__(
+        self,
+        enabled: bool,
+        max_shards: int = MAX_COUNTER_SHARDS,
+        writes_per_shard_per_second: float = WRITES_PER_SHARD_PER_SECOND,
+        window_seconds: float = 30.0,
+        min_observation_seconds: float = 10.0
+    ):
+        self.enabled = enabled
+        self.max_shards = max_shards
+        self.writes_per_shard_per_second = writes_per_shard_per_second
+        self.window_seconds = window_seconds
+        self.min_observation_seconds = min_observation_seconds
+        self._windows: Dict[str, Tuple[float, int]] = {}
+        self._shards: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def record_write(self, key: str) -> Tuple[int, bool]:
+        """
+        Record one write to a counter document and get the shard count to use for it
+
+        Args:
+            key: Identifier of the counter document, e.g. its path
+
+        Returns:
+            Tuple of (shard count, whether the shard count changed). A shard count of 0
+            means the counter should be written to its parent document directly.
+        """
+        if not self.enabled:
+            return 0, False
+
+        now = time.monotonic()
+        with self._lock:
+            window_start, writes = self._windows.get(key, (now, 0))
+            if now - window_start > self.window_seconds:
+                window_start, writes = now, 0
+            writes += 1
+            self._windows[key] = (window_start, writes)
+
+            # Short bursts are averaged over min_observation_seconds so only sustained load shards
+            elapsed = max(now - window_start, self.min_observation_seconds)
+            rate = writes / elapsed
+            current = self._shards.get(key, 0)
+            if rate <= self.writes_per_shard_per_second and current == 0:
+                return 0, False
+
+            wanted = min(self.max_shards, max(2, math.ceil(rate / self.writes_per_shard_per_second)))
+            if wanted <= current:
+                return current, False
+
+            self._shards[key] = wanted
+            return wanted, True
+
+
+scan_counter_policy = ShardingPolicy(enabled=SCAN_COUNTER_SHARDING == "auto")
+
+
+def write_sharded_increment(batch, doc_ref, update: Dict[str, Any], shard_count: int, parent_fields: Optional[Dict[str, Any]] = None, shard_count_changed: bool = False, parent_must_exist: bool = False) -> None:
+    """
+    Add a counter update to a batch, routed to one random shard of the document
+
+    Args:
+        batch: Firestore write batch to add the writes to
+        doc_ref: Reference to the parent counter document
+        update: Fields to merge into the shard, typically firestore.Increment values
+        shard_count: Number of shards the counter is spread over
+        parent_fields: Non-counter fields to keep on the parent document
+        shard_count_changed: Whether the parent's shard count marker needs to be written
+        parent_must_exist: Write the marker with update() so a missing parent fails the batch instead of being created
+    """
+    shard_ref = doc_ref.collection(SHARD_COLLECTION).document(str(random.randrange(shard_count)))
+    batch.set(shard_ref, update, merge=True)
+
+    if shard_count_changed:
+        parent_update = dict(parent_fields or {})
+        parent_update[SHARD_COUNT_FIELD] = shard_count
+        if parent_must_exist:
+            batch.update(doc_ref, parent_update)
+        else:
+            batch.set(doc_ref, parent_update, merge=True)
+
+
+def merge_counter_values(total: Dict[str, Any], shard: Dict[str, Any], max_fields: Iterable[str] = ()) -> Dict[str, Any]:
+    """
+    Merge one shard's values into a running total
+
+    Numbers are summed, nested maps are merged recursively, fields listed in
+    max_fields (such as timestamps) keep the largest value, and any other value
+    is only taken from the shard if the total does not have it yet.
+    """
+    max_fields = set(max_fields)
+    for key, value in shard.items():
+        if key in max_fields:
+            total[key] = max(total.get(key) or 0, value or 0)
+        elif isinstance(value, dict):
+            existing = total.get(key)
+            total[key] = merge_counter_values(dict(existing) if isinstance(existing, dict) else {}, value, max_fields)
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            existing = total.get(key)
+            total[key] = (existing if isinstance(existing, (int, float)) and not isinstance(existing, bool) else 0) + value
+        elif key not in total:
+            total[key] = value
+    return total
+
+
+def read_sharded_document(doc_ref, data: Dict[str, Any], max_fields: Iterable[str] = ()) -> Dict[str, Any]:
+    """
+    Get a counter document's data with the values of all of its shards summed in
+
+    Documents that were never sharded are returned unchanged without reading the subcollection.
+    """
+    if not data.get(SHARD_COUNT_FIELD):
+        return data
+
+    total = dict(data)
+    for shard in doc_ref.collection(SHARD_COLLECTION).stream():
+        merge_counter_values(total, shard.to_dict(), max_fields)
+    return total
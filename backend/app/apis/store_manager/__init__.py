@@ -5,12 +5,24 @@ import databutton as db
 import re
 from datetime import datetime, timezone
 import time
+import os
+import threading
 from app.apis.firebase_client import get_firestore_db
+from app.apis.ttl_cache import TTLCache
+from app.apis.batch_queue import run_before_drain
 # Import logger for centralized logging
 from app.apis.logger import error, info, log_exception, warning
 
 router = APIRouter(prefix="/stores")
 
+# Seconds a store document is served from the in-process cache. Writes made through
+# this module invalidate it immediately; writes from other processes show up after the TTL.
+STORE_DATA_CACHE_TTL_SECONDS = float(os.environ.get("STORE_DATA_CACHE_TTL_SECONDS", "60"))
+store_data_cache = TTLCache(name="store_data", max_entries=1024, ttl_seconds=STORE_DATA_CACHE_TTL_SECONDS)
+
+# Seconds between batched writes of stores' last_accessed timestamps
+STORE_ACCESS_FLUSH_SECONDS = float(os.environ.get("STORE_ACCESS_FLUSH_SECONDS", "30"))
+
 # Models
 class StoreBase(BaseModel):
     """Base model for store data"""
@@ -77,11 +89,22 @@ def get_store_key(store_hash: str) -> str:
     return sanitize_key(f"store_{store_hash}")
 
 def get_store_data(store_hash: str) -> StoreData:
-    """Get store data by store hash"""
+    """
+    Get store data by store hash
+    
+    Served from a process-local TTL cache; concurrent misses for the same store
+    share a single Firestore read. Each caller gets its own copy, so changes to
+    the returned model never leak into the cache.
+    """
     if not store_hash:
         error("Attempted to get store data with empty store hash", source="store_manager")
         raise ValueError("Store hash cannot be empty")
-        
+    
+    store_data = store_data_cache.get_or_load(store_hash, lambda: _load_store_data(store_hash))
+    return store_data.copy(deep=True)
+
+def _load_store_data(store_hash: str) -> StoreData:
+    """Read store data from Firebase"""
     try:
         db = get_firestore_db()
         doc_ref = db.collection('stores').document(store_hash)
@@ -109,6 +132,7 @@ def save_store_data(store_data: StoreData) -> bool:
         db = get_firestore_db()
         doc_ref = db.collection('stores').document(store_data.store_hash)
         doc_ref.set(store_data.dict())
+        store_data_cache.invalidate(store_data.store_hash)
         info("Store data saved", 
              store_hash=store_data.store_hash, 
              context={"store_name": store_data.store_name},
@@ -170,32 +194,133 @@ def create_store_from_token_info(token_info: Dict[str, Any], installation_type:
     
     return store_data
 
+class StoreAccessTracker:
+    """
+    Debounced writer for stores' status.last_accessed timestamps.
+
+    record() only keeps the latest access time per store in memory. A background
+    thread writes the dirty timestamps every flush_interval seconds with one
+    batched update, without reading the documents first. An update of a store
+    that no longer exists fails the batch, so the writes are then retried one
+    document at a time and missing stores are skipped.
+    """
+
+    def __init__(self, flush_interval: float, max_batch_size: int = 500):
+        """
+        Args:
+            flush_interval: Seconds between flushes of dirty timestamps
+            max_batch_size: Maximum number of updates per Firestore batch
+        """
+        self.flush_interval = flush_interval
+        self.max_batch_size = max_batch_size
+        self._pending: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.recorded = 0
+        self.written = 0
+        self.skipped = 0
+
+    def record(self, store_hash: str, accessed_at: Optional[int] = None) -> None:
+        """
+        Record an access, to be written with the next flush
+        """
+        with self._lock:
+            accessed_at = accessed_at or int(time.time())
+            self._pending[store_hash] = max(accessed_at, self._pending.get(store_hash, 0))
+            self.recorded += 1
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="store-access-tracker", daemon=True)
+                self._thread.start()
+
+    def discard(self, store_hash: str) -> None:
+        """
+        Drop a store's unwritten access time, e.g. because the store was deleted
+        """
+        with self._lock:
+            self._pending.pop(store_hash, None)
+
+    def flush(self) -> None:
+        """
+        Write all dirty timestamps now
+        """
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return
+
+            items = list(pending.items())
+            db = get_firestore_db()
+            collection = db.collection('stores')
+            for start in range(0, len(items), self.max_batch_size):
+                chunk = items[start:start + self.max_batch_size]
+                try:
+                    batch = db.batch()
+                    for store_hash, accessed_at in chunk:
+                        batch.update(collection.document(store_hash), {'status.last_accessed': accessed_at})
+                    batch.commit()
+                    self.written += len(chunk)
+                except Exception as e:
+                    warning("Batched store access update failed, retrying per store",
+                          context={"stores": len(chunk), "error": str(e)},
+                          source="store_manager")
+                    self._write_individually(collection, chunk)
+
+    def shutdown(self) -> None:
+        """
+        Stop the background thread and write any remaining timestamps
+        """
+        self._stop.set()
+        self.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "pending": len(self._pending),
+                "recorded": self.recorded,
+                "written": self.written,
+                "skipped": self.skipped,
+                "flush_interval": self.flush_interval
+            }
+
+    def _write_individually(self, collection, items) -> None:
+        for store_hash, accessed_at in items:
+            try:
+                collection.document(store_hash).update({'status.last_accessed': accessed_at})
+                self.written += 1
+            except Exception as e:
+                self.skipped += 1
+                warning("Could not update access time for store",
+                      context={"store_hash": store_hash, "error": str(e)},
+                      source="store_manager")
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                log_exception("Error flushing store access times", e, source="store_manager")
+
+
+store_access_tracker = StoreAccessTracker(flush_interval=STORE_ACCESS_FLUSH_SECONDS)
+
+# Write buffered access times at shutdown before the log shipper is drained, so
+# warnings logged by the final flush are still persisted
+run_before_drain(store_access_tracker.shutdown)
+
 def update_store_access(store_hash: str) -> bool:
-    """Update the last accessed timestamp for a store"""
-    try:
-        db = get_firestore_db()
-        doc_ref = db.collection('stores').document(store_hash)
-        doc = doc_ref.get()
-        
-        if not doc.exists:
-            warning("Attempted to update access time for non-existent store", 
-                  context={"store_hash": store_hash},
-                  source="store_manager")
-            return False
-            
-        # Update the last_accessed field
-        doc_ref.update({
-            'status.last_accessed': int(time.time())
-        })
-        info("Updated store access timestamp", 
-             store_hash=store_hash, 
-             source="store_manager")
-        return True
-    except Exception as e:
-        log_exception("Error updating store access time", e,
-                    context={"store_hash": store_hash},
-                    source="store_manager")
+    """
+    Record that a store was accessed
+    
+    The timestamp is written by store_access_tracker with its next batched flush,
+    so this never waits on Firestore.
+    """
+    if not store_hash:
         return False
+    store_access_tracker.record(store_hash)
+    return True
 
 def deactivate_store(store_hash: str) -> bool:
     """Mark a store as inactive (uninstalled) in Firebase"""
@@ -215,6 +340,7 @@ def deactivate_store(store_hash: str) -> bool:
             'status.is_active': False,
             'status.uninstalled_at': int(time.time())
         })
+        store_data_cache.invalidate(store_hash)
         info("Store deactivated", 
              store_hash=store_hash, 
              source="store_manager")
@@ -310,6 +436,7 @@ async def update_store(store_hash: str, update_data: StoreUpdateData):
         # Apply updates if there are any
         if update_dict:
             doc_ref.update(update_dict)
+            store_data_cache.invalidate(store_hash)
             return {"status": "success", "message": "Store updated successfully"}
         else:
             return {"status": "info", "message": "No updates provided"}
@@ -339,6 +466,8 @@ async def delete_store(store_hash: str):
         
         # Delete the store record
         doc_ref.delete()
+        store_data_cache.invalidate(store_hash)
+        store_access_tracker.discard(store_hash)
         
         return {"status": "success", "message": "Store deleted successfully"}
     except KeyError:
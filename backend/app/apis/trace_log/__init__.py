@@ -0,0 +1,126 @@
+import contextvars
+import logging
+import os
+import random
+import sys
+from typing import Dict, Optional
+
+from fastapi import APIRouter
+
+# Create an empty router to satisfy Databutton API module requirements
+# This is a utility module, not an API endpoint module
+router = APIRouter()
+
+# Modules log with logging.getLogger(__name__); all of them are children of this logger
+APP_LOGGER_NAME = "app"
+
+# Level name that disables a logger entirely
+LOG_LEVEL_OFF = logging.CRITICAL + 10
+logging.addLevelName(LOG_LEVEL_OFF, "OFF")
+
+# Level used for modules without their own entry in TRACE_LOG_LEVELS
+TRACE_LOG_LEVEL = os.environ.get("TRACE_LOG_LEVEL", "INFO").upper()
+
+# Per-module levels, e.g. "scan_proxy=DEBUG,firestore_repository=WARNING"
+TRACE_LOG_LEVELS = os.environ.get("TRACE_LOG_LEVELS", "")
+
+# Fraction of requests whose debug lines are emitted when DEBUG is enabled
+TRACE_LOG_SAMPLE_RATE = float(os.environ.get("TRACE_LOG_SAMPLE_RATE", "1.0"))
+
+# Per-module sample rates, e.g. "scan_proxy=0.01"
+TRACE_LOG_SAMPLE_RATES = os.environ.get("TRACE_LOG_SAMPLE_RATES", "")
+
+# Random draw of the current request, compared with the sample rates; None outside sampled requests
+_request_draw: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("trace_log_request_draw", default=None)
+
+
+def parse_module_settings(value: str) -> Dict[str, str]:
+    """
+    Parse a "module=value,module=value" setting into a dict
+    """
+    settings = {}
+    for item in value.split(","):
+        if "=" not in item:
+            continue
+        module, setting = item.split("=", 1)
+        settings[module.strip()] = setting.strip()
+    return settings
+
+
+def get_module_logger_name(module: str) -> str:
+    """
+    Get the logger name of a module named in the TRACE_LOG_* settings, e.g. app.apis.scan_proxy
+    """
+    return module if module.startswith(f"{APP_LOGGER_NAME}.") else f"{APP_LOGGER_NAME}.apis.{module}"
+
+
+class DebugSampleFilter(logging.Filter):
+    """
+    Drops the DEBUG records of requests that were not sampled.
+
+    start_sampled_request() draws one random number per request, and a DEBUG
+    record is kept when the draw is below its module's sample rate. A request's
+    debug lines are therefore kept or dropped together. Records logged outside
+    a sampled request, and records above DEBUG, always pass.
+    """
+
+    def __init__(self, sample_rate: float, module_sample_rates: Dict[str, float]):
+        """
+        Args:
+            sample_rate: Fraction of requests whose debug lines are kept
+            module_sample_rates: Sample rates by logger name, overriding sample_rate
+        """
+        super().__init__()
+        self.sample_rate = sample_rate
+        self.module_sample_rates = module_sample_rates
+
+    def get_sample_rate(self, logger_name: str) -> float:
+        return self.module_sample_rates.get(logger_name, self.sample_rate)
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG:
+            return True
+        draw = _request_draw.get()
+        return draw is None or draw < self.get_sample_rate(record.name)
+
+
+def start_sampled_request() -> None:
+    """
+    Decide whether the debug lines of the current request are emitted
+
+    Call at the start of a request handler; the decision applies to every
+    module that logs within the request's context.
+    """
+    _request_draw.set(random.random())
+
+
+debug_sampler = DebugSampleFilter(
+    sample_rate=TRACE_LOG_SAMPLE_RATE,
+    module_sample_rates={
+        get_module_logger_name(module): float(rate)
+        for module, rate in parse_module_settings(TRACE_LOG_SAMPLE_RATES).items()
+    }
+)
+
+
+def configure_trace_logging() -> None:
+    """
+    Set up the app's loggers from the TRACE_LOG_* settings
+
+    Records are written to stdout by one handler on the app logger. Messages use
+    lazy %-formatting, so a record is only formatted when it is emitted.
+    """
+    app_logger = logging.getLogger(APP_LOGGER_NAME)
+    app_logger.setLevel(TRACE_LOG_LEVEL)
+    app_logger.propagate = False
+    if not app_logger.handlers:
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(logging.Formatter("[%(name)s] %(asctime)s %(levelname)s %(message)s", "%Y-%m-%dT%H:%M:%S"))
+        handler.addFilter(debug_sampler)
+        app_logger.addHandler(handler)
+
+    for module, level in parse_module_settings(TRACE_LOG_LEVELS).items():
+        logging.getLogger(get_module_logger_name(module)).setLevel(level.upper())
+
+
+configure_trace_logging()
@@ -0,0 +1,203 @@
+from typing import Any, Callable, Dict, Hashable, Optional
+from collections import OrderedDict
+import threading
+import time
+
+from fastapi import APIRouter
+
+router = APIRouter(prefix="/cache-stats", tags=["cache-stats"])
+
+# Registry of named caches so their counters can be inspected from one endpoint
+_caches: Dict[str, "TTLCache"] = {}
+
+
+class _PendingLoad:
+    """
+    A load in flight for one key, shared by every caller that missed on it
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value: Any = None
+        self.error: Optional[BaseException] = None
+        self.invalidated = False
+
+
+class TTLCache:
+    """
+    Bounded, thread-safe LRU cache whose entries expire after a fixed TTL.
+
+    Entries are evicted in least-recently-used order once max_entries is
+    reached, or once the total weight of the entries exceeds max_bytes when a
+    weigher is given. Expired entries are dropped lazily when they are looked up.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_entries: int = 1024,
+        ttl_seconds: float = 60.0,
+        max_bytes: Optional[int] = None,
+        weigher: Optional[Callable[[Any], int]] = None
+    ):
+        """
+        Initialize the cache and register it under the given name
+
+        Args:
+            name: Name used to report the cache's counters
+            max_entries: Maximum number of entries kept before evicting the least recently used
+            ttl_seconds: Number of seconds an entry stays valid after being stored
+            max_bytes: Optional budget for the total weight of all entries
+            weigher: Callable returning the size of a value in bytes, len() if max_bytes is set without one
+        """
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.weigher = weigher or (len if max_bytes is not None else None)
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._bytes = 0
+        # Reentrant so a finished load can be stored while its pending entry is removed
+        self._lock = threading.RLock()
+        self._loading: Dict[Hashable, _PendingLoad] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.coalesced = 0
+        _caches[name] = self
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """
+        Get a value from the cache
+
+        Returns:
+            The cached value, or None if the key is missing or expired
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            expires_at, value, weight = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                self._bytes -= weight
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """
+        Store a value in the cache, evicting the least recently used entries if full
+
+        Values heavier than the whole byte budget are not stored.
+        """
+        weight = self.weigher(value) if self.weigher else 0
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous[2]
+            if self.max_bytes is not None and weight > self.max_bytes:
+                return
+
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value, weight)
+            self._bytes += weight
+            while len(self._entries) > self.max_entries or (self.max_bytes is not None and self._bytes > self.max_bytes):
+                _, (_, _, evicted_weight) = self._entries.popitem(last=False)
+                self._bytes -= evicted_weight
+                self.evictions += 1
+
+    def get_or_load(self, key: Hashable, loader: Callable[[], Any]) -> Any:
+        """
+        Get a value from the cache, loading and storing it on a miss
+
+        Concurrent misses on the same key are coalesced: the first caller runs
+        the loader and the others wait for its result, or its exception. A load
+        that overlaps an invalidate() of its key is returned but not stored.
+
+        Args:
+            key: Cache key
+            loader: Callable returning the value for the key
+        """
+        value = self.get(key)
+        if value is not None:
+            return value
+
+        with self._lock:
+            pending = self._loading.get(key)
+            is_loader = pending is None
+            if is_loader:
+                pending = self._loading[key] = _PendingLoad()
+            else:
+                self.coalesced += 1
+
+        if not is_loader:
+            pending.done.wait()
+            if pending.error is not None:
+                raise pending.error
+            return pending.value
+
+        try:
+            pending.value = loader()
+        except BaseException as e:
+            pending.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._loading[key]
+                if pending.error is None and not pending.invalidated:
+                    self.set(key, pending.value)
+            pending.done.set()
+        return pending.value
+
+    def invalidate(self, key: Hashable) -> None:
+        """
+        Remove a single key from the cache
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._bytes -= entry[2]
+            pending = self._loading.get(key)
+            if pending is not None:
+                pending.invalidated = True
+
+    def clear(self) -> None:
+        """
+        Remove all entries from the cache
+        """
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get the cache counters
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "name": self.name,
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "coalesced": self.coalesced,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+@router.get("")
+def get_cache_stats():
+    """
+    Get hit/miss counters for all in-process caches
+    """
+    return {"caches": [cache.stats() for cache in _caches.values()]}
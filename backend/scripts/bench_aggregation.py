@@ -0,0 +1,84 @@
+"""
+Measure ScanAggregator throughput on synthetic scan events
+
+Event generation is measured on its own so it can be subtracted from the
+aggregation results. The model-based aggregation it replaced keeps every
+event in memory, so it runs on a smaller sample by default.
+"""
+import argparse
+import random
+import time
+from collections import defaultdict
+from datetime import datetime
+
+from bench_common import measure_throughput, print_throughputs
+from app.apis.scan_aggregation import ScanAggregator
+from app.apis.scan_event import ScanEvent
+
+
+def synthetic_scan_events(count: int, qr_codes: int = 300, days: int = 30):
+    """
+    Generate raw scan event documents like the ones stored in scan_events
+
+    Events are yielded one at a time so the benchmark itself holds no event list.
+    """
+    rng = random.Random(42)
+    devices = ["mobile", "mobile", "mobile", "desktop", "tablet", "unknown"]
+    countries = ["US", "GB", "DE", "FR", "CA", "AU", None]
+    browsers = ["Mobile Safari", "Chrome Mobile", "Chrome", "Firefox", "Samsung Internet"]
+    start = int(time.time()) - days * 24 * 60 * 60
+    span = days * 24 * 60 * 60
+    for i in range(count):
+        country = countries[rng.randrange(len(countries))]
+        yield {
+            "id": str(i),
+            "qr_code_id": f"qr-{rng.randrange(qr_codes)}",
+            "store_hash": "benchmark-store",
+            "timestamp": start + rng.randrange(span),
+            "location": {"country": country} if country else None,
+            "device_type": devices[rng.randrange(len(devices))],
+            "browser": browsers[rng.randrange(len(browsers))],
+            "os": "unknown",
+            "conversion": False,
+        }
+
+
+def aggregate_with_models(events) -> None:
+    """
+    The previous aggregation: build a ScanEvent per document, then one pass per breakdown
+    """
+    events = [ScanEvent(**event) for event in events]
+    device_counts = defaultdict(int)
+    for event in events:
+        device_counts[event.device_type] += 1
+    location_counts = defaultdict(int)
+    for event in events:
+        if event.location and event.location.country:
+            location_counts[event.location.country] += 1
+    daily_counts = defaultdict(int)
+    for event in events:
+        daily_counts[datetime.fromtimestamp(event.timestamp).strftime("%Y-%m-%d")] += 1
+    qr_code_counts = defaultdict(int)
+    for event in events:
+        qr_code_counts[event.qr_code_id] += 1
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--events", type=int, default=1_000_000, help="Number of synthetic scan events to aggregate")
+    parser.add_argument("--legacy-events", type=int, default=100_000, help="Number of events for the model-based aggregation, 0 to skip it")
+    args = parser.parse_args()
+
+    results = [
+        measure_throughput("generate_events", lambda: sum(1 for _ in synthetic_scan_events(args.events)), args.events),
+        measure_throughput("scan_aggregator", lambda: ScanAggregator(0).add_all(synthetic_scan_events(args.events)), args.events),
+    ]
+    if args.legacy_events:
+        results.append(measure_throughput("generate_events_legacy_sample", lambda: sum(1 for _ in synthetic_scan_events(args.legacy_events)), args.legacy_events))
+        results.append(measure_throughput("scan_event_models", lambda: aggregate_with_models(synthetic_scan_events(args.legacy_events)), args.legacy_events))
+
+    print_throughputs(results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Shared helpers for the benchmark scripts in this directory
+
+Importing this module makes the app package importable and points every
+repository at an in-memory Firestore, so no benchmark writes to the
+production project. Run the scripts from the backend directory, e.g.
+`python scripts/bench_render.py --help`.
+"""
+import statistics
+import sys
+import time
+from pathlib import Path
+from typing import Callable, List
+
+from pydantic import BaseModel
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app.apis import firebase_client  # noqa: E402
+from app.apis.in_memory_firestore import InMemoryFirestore  # noqa: E402
+
+# Repositories are created when their modules are imported, so the in-memory
+# store has to be in place before any benchmark imports app modules
+firebase_client._db = InMemoryFirestore()
+
+
+class LatencyStats(BaseModel):
+    """Latency summary for one benchmarked operation"""
+    name: str
+    iterations: int
+    mean_us: float
+    p50_us: float
+    p95_us: float
+    p99_us: float
+    max_us: float
+
+
+class ThroughputStats(BaseModel):
+    """Throughput summary for one benchmarked bulk operation"""
+    name: str
+    items: int
+    seconds: float
+    items_per_second: float
+
+
+def measure(name: str, operation: Callable[[int], object], iterations: int) -> LatencyStats:
+    """
+    Run an operation repeatedly and summarize its latency in microseconds
+
+    Args:
+        name: Name of the operation for the report
+        operation: Callable invoked with the iteration number
+        iterations: Number of times to run the operation
+    """
+    durations = []
+    for i in range(iterations):
+        start = time.perf_counter()
+        operation(i)
+        durations.append((time.perf_counter() - start) * 1_000_000)
+
+    return summarize_latencies(name, durations)
+
+
+def summarize_latencies(name: str, durations: List[float]) -> LatencyStats:
+    """
+    Summarize a list of latencies in microseconds
+    """
+    durations = sorted(durations)
+
+    def percentile(fraction: float) -> float:
+        return round(durations[min(len(durations) - 1, int(len(durations) * fraction))], 1)
+
+    return LatencyStats(
+        name=name,
+        iterations=len(durations),
+        mean_us=round(statistics.fmean(durations), 1),
+        p50_us=percentile(0.5),
+        p95_us=percentile(0.95),
+        p99_us=percentile(0.99),
+        max_us=round(durations[-1], 1)
+    )
+
+
+def measure_throughput(name: str, operation: Callable[[], object], items: int) -> ThroughputStats:
+    """
+    Run a bulk operation once and summarize how many items per second it processed
+    """
+    start = time.perf_counter()
+    operation()
+    seconds = time.perf_counter() - start
+    return ThroughputStats(
+        name=name,
+        items=items,
+        seconds=round(seconds, 3),
+        items_per_second=round(items / seconds, 1) if seconds > 0 else 0.0
+    )
+
+
+def print_latencies(results: List[LatencyStats]) -> None:
+    """
+    Print latency results as a table
+    """
+    print(f"{'operation':<36} {'n':>7} {'mean_us':>11} {'p50_us':>11} {'p95_us':>11} {'p99_us':>11} {'max_us':>11}")
+    for result in results:
+        print(
+            f"{result.name:<36} {result.iterations:>7} {result.mean_us:>11.1f} {result.p50_us:>11.1f} "
+            f"{result.p95_us:>11.1f} {result.p99_us:>11.1f} {result.max_us:>11.1f}"
+        )
+
+
+def print_throughputs(results: List[ThroughputStats]) -> None:
+    """
+    Print throughput results as a table
+    """
+    print(f"{'operation':<36} {'items':>10} {'seconds':>10} {'items_per_s':>14}")
+    for result in results:
+        print(f"{result.name:<36} {result.items:>10} {result.seconds:>10.3f} {result.items_per_second:>14.1f}")
@@ -0,0 +1,78 @@
+"""
+Compare per-lookup latency of get_by_id point reads against query_by_field("id", ...)
+
+Half of the seeded QR codes are stored under their own ID and half under a
+generated document ID, so the legacy fallback path is measured as well. The
+emulator backend requires FIRESTORE_EMULATOR_HOST to be set so that no
+benchmark data is ever written to the production project.
+"""
+import argparse
+import os
+import uuid
+
+from bench_common import measure, print_latencies
+from app.apis.firestore_repository import FirestoreRepository
+from app.apis.in_memory_firestore import InMemoryFirestore
+from app.apis.qr_code import QRCode, QRCodeTarget
+
+
+def get_benchmark_db(parser: argparse.ArgumentParser, backend: str):
+    """
+    Get a Firestore client for the requested benchmark backend
+    """
+    if backend == "in_memory":
+        return InMemoryFirestore()
+
+    if not os.environ.get("FIRESTORE_EMULATOR_HOST"):
+        parser.error("FIRESTORE_EMULATOR_HOST must be set to benchmark against the emulator")
+
+    from google.cloud import firestore as gcloud_firestore
+    return gcloud_firestore.Client(project=os.environ.get("GCLOUD_PROJECT", "demo-qr-ninja"))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--backend", choices=["in_memory", "emulator"], default="in_memory", help="Firestore backend to benchmark")
+    parser.add_argument("--documents", type=int, default=200, help="Number of QR code documents to seed")
+    parser.add_argument("--iterations", type=int, default=500, help="Number of lookups per operation")
+    args = parser.parse_args()
+
+    repo = FirestoreRepository[QRCode](
+        collection_name=f"benchmark_qr_codes_{uuid.uuid4().hex[:8]}",
+        model_class=QRCode,
+        db=get_benchmark_db(parser, args.backend)
+    )
+
+    keyed_ids = []
+    legacy_ids = []
+    for i in range(args.documents):
+        qr_code = QRCode(
+            store_hash="benchmark-store",
+            name=f"Benchmark QR {i}",
+            type="custom",
+            target=QRCodeTarget(url=f"https://example.com/{i}")
+        )
+        if i % 2 == 0:
+            repo.add(qr_code, document_id=qr_code.id)
+            keyed_ids.append(qr_code.id)
+        else:
+            repo.add(qr_code)
+            legacy_ids.append(qr_code.id)
+    legacy_ids = legacy_ids or keyed_ids
+
+    try:
+        results = [
+            measure("query_by_field", lambda i: repo.query_by_field("id", keyed_ids[i % len(keyed_ids)]), args.iterations),
+            measure("get_by_id", lambda i: repo.get_by_id(keyed_ids[i % len(keyed_ids)]), args.iterations),
+            measure("get_by_id_legacy_fallback", lambda i: repo.get_by_id(legacy_ids[i % len(legacy_ids)]), args.iterations),
+        ]
+    finally:
+        for doc in repo.collection.stream():
+            repo.collection.document(doc.id).delete()
+
+    print(f"backend={args.backend} documents={args.documents}")
+    print_latencies(results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Compare /track redirect latency with tracing off, at INFO, at sampled DEBUG and at full DEBUG
+
+Redirects go through an in-process ASGI app to a QR code seeded only in the
+resolution cache and marked inactive, so no scan events are recorded.
+"""
+import argparse
+import asyncio
+import time
+import uuid
+
+import httpx
+from fastapi import FastAPI
+
+from bench_common import print_latencies, summarize_latencies
+from app.apis.qr_code import ResolvedQRCode, qr_resolution_cache
+from app.apis.scan_proxy import logger as scan_logger, router as scan_proxy_router
+from app.apis.trace_log import debug_sampler
+
+
+async def run(requests: int, sample_rate: float) -> None:
+    app = FastAPI()
+    app.include_router(scan_proxy_router)
+
+    qr_code_id = f"benchmark-{uuid.uuid4()}"
+    qr_resolution_cache.set(qr_code_id, ResolvedQRCode(
+        id=qr_code_id, store_hash="benchmark-store", target_url="https://example.com", active=False
+    ))
+    phases = [
+        ("redirect_logging_off", "OFF", 1.0),
+        ("redirect_logging_info", "INFO", 1.0),
+        ("redirect_logging_debug_sampled", "DEBUG", sample_rate),
+        ("redirect_logging_debug", "DEBUG", 1.0),
+    ]
+
+    results = []
+    # Each phase sets the scan_proxy logger's level and debug sample rate; both are restored afterwards
+    original_level = scan_logger.level
+    original_sample_rates = dict(debug_sampler.module_sample_rates)
+    transport = httpx.ASGITransport(app=app)
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+            # Warm up the app and connection before the measured phases
+            await client.get(f"/track/{qr_code_id}")
+            for name, level, phase_sample_rate in phases:
+                scan_logger.setLevel(level)
+                debug_sampler.module_sample_rates[scan_logger.name] = phase_sample_rate
+                durations = []
+                for _ in range(requests):
+                    start = time.perf_counter()
+                    await client.get(f"/track/{qr_code_id}")
+                    durations.append((time.perf_counter() - start) * 1_000_000)
+                results.append(summarize_latencies(name, durations))
+    finally:
+        scan_logger.setLevel(original_level)
+        debug_sampler.module_sample_rates = original_sample_rates
+
+    print(f"requests={requests} sample_rate={sample_rate}")
+    print_latencies(results)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=500, help="Number of redirect requests per logging setting")
+    parser.add_argument("--sample-rate", type=float, default=0.01, help="Debug sample rate for the sampled phase")
+    args = parser.parse_args()
+
+    asyncio.run(run(args.requests, args.sample_rate))
+
+
+if __name__ == "__main__":
+    main()
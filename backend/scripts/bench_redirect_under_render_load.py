@@ -0,0 +1,79 @@
+"""
+Load test /track redirect latency while large QR images are being rendered
+
+The redirects and renders are sent through an in-process ASGI app containing
+the tracking and image routers, so they share one event loop exactly like a
+server worker. Redirects go to a QR code seeded only in the resolution cache
+and marked inactive, so no scan events are recorded. Each render uses a unique
+preview URL so none are served from the image cache.
+"""
+import argparse
+import asyncio
+import time
+import uuid
+from collections import Counter
+from typing import List
+
+import httpx
+from fastapi import FastAPI
+
+from bench_common import print_latencies, summarize_latencies
+from app.apis.qr_code import ResolvedQRCode, qr_resolution_cache
+from app.apis.qr_generator import router as qr_generator_router
+from app.apis.scan_proxy import router as scan_proxy_router
+
+
+async def run(requests: int, renders: int, render_size: int) -> None:
+    app = FastAPI()
+    app.include_router(scan_proxy_router)
+    app.include_router(qr_generator_router)
+
+    qr_code_id = f"benchmark-{uuid.uuid4()}"
+    qr_resolution_cache.set(qr_code_id, ResolvedQRCode(
+        id=qr_code_id, store_hash="benchmark-store", target_url="https://example.com", active=False
+    ))
+
+    async def redirect_latencies(client) -> List[float]:
+        durations = []
+        for _ in range(requests):
+            start = time.perf_counter()
+            await client.get(f"/track/{qr_code_id}")
+            durations.append((time.perf_counter() - start) * 1_000_000)
+        return durations
+
+    async def render(client, i: int) -> int:
+        response = await client.get(
+            "/qr-image/temp-preview.png",
+            params={"url": f"https://example.com/{uuid.uuid4()}/{i}", "size": render_size}
+        )
+        return response.status_code
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+        baseline = await redirect_latencies(client)
+
+        render_start = time.perf_counter()
+        render_tasks = [asyncio.create_task(render(client, i)) for i in range(renders)]
+        under_load = await redirect_latencies(client)
+        statuses = await asyncio.gather(*render_tasks)
+        render_seconds = time.perf_counter() - render_start
+
+    print(f"renders={renders} render_size={render_size} render_seconds={render_seconds:.3f} render_statuses={dict(Counter(statuses))}")
+    print_latencies([
+        summarize_latencies("redirect_baseline", baseline),
+        summarize_latencies("redirect_during_renders", under_load),
+    ])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=200, help="Number of redirect requests per phase")
+    parser.add_argument("--renders", type=int, default=16, help="Number of concurrent uncached renders during the load phase")
+    parser.add_argument("--render-size", type=int, default=3000, help="Size in pixels of each render")
+    args = parser.parse_args()
+
+    asyncio.run(run(args.requests, args.renders, args.render_size))
+
+
+if __name__ == "__main__":
+    main()
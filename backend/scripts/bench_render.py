@@ -0,0 +1,87 @@
+"""
+Measure uncached QR code render throughput at several output sizes and renderers
+"""
+import argparse
+import io
+import uuid
+
+from bench_common import measure, print_latencies
+from app.apis.qr_renderer import QRRenderSpec, render_qr_image
+
+
+def render_resampled(spec: QRRenderSpec) -> bytes:
+    """
+    The previous rendering: draw with 10px modules, then LANCZOS-resize to the requested size
+    """
+    import qrcode
+    from PIL import Image
+    from qrcode.image.styledpil import StyledPilImage
+    from qrcode.image.styles.colormasks import SolidFillColorMask
+    from app.apis.qr_renderer import ERROR_LEVELS, get_module_drawer, hex_to_rgb
+
+    qr = qrcode.QRCode(version=5, error_correction=ERROR_LEVELS[spec.error_correction], box_size=10, border=spec.border)
+    qr.add_data(spec.data)
+    qr.make(fit=True)
+    img = qr.make_image(
+        image_factory=StyledPilImage,
+        module_drawer=get_module_drawer(spec.dots_style),
+        eye_drawer=get_module_drawer(spec.corner_style),
+        color_mask=SolidFillColorMask(back_color=hex_to_rgb(spec.background_color), front_color=hex_to_rgb(spec.foreground_color))
+    ).get_image()
+    if img.size[0] != spec.size:
+        img = img.resize((spec.size, spec.size), Image.LANCZOS)
+    stream = io.BytesIO()
+    img.save(stream, format="PNG")
+    return stream.getvalue()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", default="150,300,1000,3000", help="Comma-separated image sizes in pixels")
+    parser.add_argument("--iterations", type=int, default=20, help="Number of renders per size and method")
+    parser.add_argument("--dots-style", default="square", help="Dots style to render")
+    parser.add_argument("--corner-style", default="square", help="Corner style to render")
+    parser.add_argument("--foreground-color", default="#000000", help="Foreground color to render")
+    parser.add_argument("--format", choices=["png", "jpeg", "svg", "pdf"], default="png", help="Output format to render")
+    parser.add_argument("--renderers", default="styled,sprite", help="Comma-separated renderers to compare (auto, styled, sprite)")
+    parser.add_argument("--no-resampled", action="store_true", help="Skip the previous render-then-resize method")
+    args = parser.parse_args()
+
+    try:
+        sizes = [int(size) for size in args.sizes.split(",") if size.strip()]
+    except ValueError:
+        parser.error("--sizes must be a comma-separated list of integers")
+    renderers = [renderer.strip() for renderer in args.renderers.split(",") if renderer.strip()]
+    if any(renderer not in ("auto", "styled", "sprite") for renderer in renderers):
+        parser.error("--renderers must be a comma-separated list of auto, styled or sprite")
+
+    results = []
+    for size in sizes:
+        data = f"https://app.getrobo.xyz/api/track/{uuid.uuid4()}"
+        for renderer in renderers:
+            spec = QRRenderSpec(
+                data=data,
+                format=args.format,
+                size=size,
+                dots_style=args.dots_style,
+                corner_style=args.corner_style,
+                foreground_color=args.foreground_color,
+                corner_color=args.foreground_color,
+                renderer=renderer
+            )
+            results.append(measure(f"render_{renderer}_{size}px", lambda i: render_qr_image(spec), args.iterations))
+        if not args.no_resampled and args.format == "png":
+            spec = QRRenderSpec(
+                data=data, size=size, dots_style=args.dots_style, corner_style=args.corner_style, foreground_color=args.foreground_color
+            )
+            results.append(measure(f"render_resampled_{size}px", lambda i: render_resampled(spec), args.iterations))
+
+    print_latencies(results)
+    print()
+    for result in results:
+        if result.mean_us:
+            print(f"{result.name:<36} {1_000_000 / result.mean_us:>10.1f} renders/s")
+
+
+if __name__ == "__main__":
+    main()
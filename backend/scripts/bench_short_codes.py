@@ -0,0 +1,42 @@
+"""
+Compare QR version and render time of UUID tracking URLs against short code ones
+"""
+import argparse
+import statistics
+import uuid
+
+from bench_common import measure, print_latencies
+from app.apis.qr_code import get_absolute_scan_url, generate_short_code
+from app.apis.qr_renderer import QRRenderSpec, render_qr_image, encode_qr
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--codes", type=int, default=50, help="Number of tracking URLs of each kind")
+    parser.add_argument("--size", type=int, default=300, help="Size in pixels of each render")
+    parser.add_argument("--format", choices=["png", "jpeg", "svg", "pdf"], default="png", help="Output format to render")
+    parser.add_argument("--error-correction", choices=["L", "M", "Q", "H"], default="M", help="Error correction level")
+    args = parser.parse_args()
+
+    kinds = {
+        "uuid": [get_absolute_scan_url(str(uuid.uuid4())) for _ in range(args.codes)],
+        "short_code": [get_absolute_scan_url(generate_short_code()) for _ in range(args.codes)],
+    }
+
+    results = []
+    print(f"{'url':<12} {'length':>7} {'mean_version':>13} {'mean_modules':>13}")
+    for name, data in kinds.items():
+        encoded = [encode_qr(url, args.error_correction) for url in data]
+        print(
+            f"{name:<12} {len(data[0]):>7} {statistics.mean(qr.version for qr in encoded):>13.2f} "
+            f"{statistics.mean(qr.modules_count for qr in encoded):>13.2f}"
+        )
+        specs = [QRRenderSpec(data=url, format=args.format, size=args.size, error_correction=args.error_correction) for url in data]
+        results.append(measure(f"render_{name}", lambda i: render_qr_image(specs[i % len(specs)]), args.codes))
+
+    print()
+    print_latencies(results)
+
+
+if __name__ == "__main__":
+    main()
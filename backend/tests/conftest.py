@@ -0,0 +1,40 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+# Make the app package importable when pytest is run from the backend directory
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app.apis import firebase_client
+from app.apis.in_memory_firestore import InMemoryFirestore
+
+# Repositories are created when their modules are imported, so the in-memory
+# store has to be in place before any test imports app modules
+firebase_client._db = InMemoryFirestore()
+
+from app.apis.qr_code import QRCode, QRCodeTarget
+
+
+@pytest.fixture
+def firestore_db():
+    """
+    The in-memory Firestore used by every repository, emptied after each test
+    """
+    yield firebase_client._db
+    for collection in firebase_client._db._collections.values():
+        collection._documents.clear()
+        collection._subcollections.clear()
+
+
+@pytest.fixture
+def qr_code() -> QRCode:
+    """
+    An unsaved custom QR code of the test store
+    """
+    return QRCode(
+        store_hash="test-store",
+        name="Test QR",
+        type="custom",
+        target=QRCodeTarget(url="https://example.com")
+    )
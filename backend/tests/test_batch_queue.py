@@ -0,0 +1,32 @@
+from app.apis import batch_queue
+from app.apis.batch_queue import BatchQueue, drain_all_queues, get_queues, run_before_drain
+from app.apis.scan_ingest import ScanIngestionQueue
+
+
+def test_drain_all_queues_runs_callbacks_before_draining_the_last_queue(monkeypatch):
+    monkeypatch.setattr(batch_queue, "_queues", {})
+    monkeypatch.setattr(batch_queue, "_before_drain", [])
+    flushed = []
+    log_queue = BatchQueue(name="logs", flush_handler=flushed.extend, flush_interval_ms=10, drain_last=True)
+    # Another queue whose flush logs, registered after the log queue
+    BatchQueue(name="events", flush_handler=lambda batch: log_queue.enqueue("events flushed"), flush_interval_ms=10)
+    batch_queue._queues["events"].enqueue("event")
+    run_before_drain(lambda: log_queue.enqueue("tracker flushed"))
+
+    drain_all_queues()
+
+    assert sorted(flushed) == ["events flushed", "tracker flushed"]
+    assert log_queue.metrics()["dropped"] == 0
+    # Callbacks only run once when both the shutdown event and atexit drain
+    drain_all_queues()
+    assert len(flushed) == 2
+
+
+def test_get_queues_filters_by_type(monkeypatch):
+    monkeypatch.setattr(batch_queue, "_queues", {})
+    BatchQueue(name="logs", flush_handler=lambda batch: None)
+    scans = ScanIngestionQueue(name="scans", flush_handler=lambda batch: None, max_batch_size=1000)
+
+    assert get_queues(ScanIngestionQueue) == [scans]
+    assert len(get_queues()) == 2
+    assert scans.max_batch_size == 500
@@ -0,0 +1,97 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from app.apis import logger
+from app.apis.logger import _write_log_segment, delete_expired_log_hours, query_logs
+
+
+class DictJsonStorage:
+    def __init__(self):
+        self.files = {}
+        self.reads = 0
+
+    def put(self, key, value):
+        self.files[key] = value
+
+    def get(self, key, default=None):
+        self.reads += 1
+        return self.files.get(key, default)
+
+    def delete(self, key):
+        self.files.pop(key, None)
+
+    def list(self):
+        raise AssertionError("log storage must not be listed")
+
+
+@pytest.fixture
+def storage(firestore_db, monkeypatch):
+    json_storage = DictJsonStorage()
+    monkeypatch.setattr(logger, "db", SimpleNamespace(storage=SimpleNamespace(json=json_storage)))
+    monkeypatch.setattr(logger, "_open_hours", {})
+    monkeypatch.setattr(logger, "_last_retention_sweep", time.time())
+    return json_storage
+
+
+def entry(timestamp, level="INFO", source="app", store_hash=None):
+    log_entry = {"timestamp": timestamp, "level": level, "message": f"{level} at {timestamp}", "source": source}
+    if store_hash:
+        log_entry["store_hash"] = store_hash
+    return log_entry
+
+
+def write_as_worker(monkeypatch, worker_hours, worker_id, entries):
+    # Each worker process has its own id and open hours
+    monkeypatch.setattr(logger, "LOG_WORKER_ID", worker_id)
+    monkeypatch.setattr(logger, "_open_hours", worker_hours.setdefault(worker_id, {}))
+    _write_log_segment(entries)
+
+
+def test_entries_of_workers_logging_in_one_hour_are_all_queryable(storage, monkeypatch):
+    worker_hours = {}
+    now = int(time.time())
+    # Two workers flushing into the same hour each append to their own segments and index
+    write_as_worker(monkeypatch, worker_hours, "worker1", [entry(now - 30, store_hash="abc")])
+    write_as_worker(monkeypatch, worker_hours, "worker2", [entry(now - 20, level="ERROR", source="store_manager")])
+    write_as_worker(monkeypatch, worker_hours, "worker1", [entry(now - 10)])
+
+    storage.reads = 0
+    result = query_logs(store_hash=None, level="DEBUG", source=None, start=now - 60, end=now, limit=100)
+    assert [log_entry["timestamp"] for log_entry in result["entries"]] == [now - 10, now - 20, now - 30]
+    assert result["indexes_read"] == 2
+    # One index and one segment per worker, however many flushes there were
+    assert storage.reads <= 2 * result["hours"] + 2
+
+    result = query_logs(store_hash=None, level="ERROR", source=None, start=now - 60, end=now, limit=100)
+    assert result["total"] == 1
+    assert result["segments_read"] == 1
+    assert result["segments_skipped"] == 1
+
+
+def test_full_segments_are_continued_in_the_next_one(storage, monkeypatch):
+    monkeypatch.setattr(logger, "LOG_SEGMENT_MAX_ENTRIES", 2)
+    now = int(time.time())
+    for offset in range(3):
+        _write_log_segment([entry(now - offset)])
+
+    index = storage.files[logger.get_log_index_key(logger.get_log_hour(now), logger.LOG_WORKER_ID)]
+    assert [segment["count"] for segment in index["segments"]] == [2, 1]
+    result = query_logs(store_hash=None, level="DEBUG", source=None, start=now - 60, end=now, limit=100)
+    assert result["total"] == 3
+
+
+def test_delete_expired_log_hours_keeps_hours_within_retention(storage, firestore_db):
+    now = int(time.time())
+    expired_hour = logger.get_log_hour(now - (logger.LOG_RETENTION_HOURS + 2) * 3600)
+    _write_log_segment([entry(now - (logger.LOG_RETENTION_HOURS + 2) * 3600)])
+    _write_log_segment([entry(now)])
+    storage.put("unrelated", {})
+
+    assert delete_expired_log_hours(now) == 2
+
+    assert len([key for key in storage.files if key.startswith(f"{logger.LOG_SEGMENT_PREFIX}.")]) == 1
+    assert len([key for key in storage.files if key.startswith(f"{logger.LOG_INDEX_PREFIX}.")]) == 1
+    assert "unrelated" in storage.files
+    assert not firestore_db.collection(logger.LOG_HOURS_COLLECTION).document(expired_hour).get().exists
@@ -0,0 +1,28 @@
+import asyncio
+
+import pytest
+
+from app.apis import qr_code as qr_code_module
+from app.apis.qr_code import get_absolute_scan_url, list_qr_codes, save_new_qr_code
+
+
+def test_failed_save_releases_the_short_code(firestore_db, monkeypatch, qr_code):
+    def fail_add(item, document_id=None):
+        raise RuntimeError("write failed")
+
+    monkeypatch.setattr(qr_code_module.qr_code_repo, "add", fail_add)
+
+    with pytest.raises(RuntimeError):
+        save_new_qr_code(qr_code)
+
+    assert qr_code.short_code
+    assert not firestore_db.collection("qr_short_codes").document(qr_code.short_code).get().exists
+
+
+def test_list_includes_short_code_tracking_url(firestore_db, qr_code):
+    save_new_qr_code(qr_code)
+
+    listed = asyncio.run(list_qr_codes("test-store"))["qr_codes"]
+
+    assert listed[0]["short_code"] == qr_code.short_code
+    assert listed[0]["tracking_url"] == get_absolute_scan_url(qr_code.short_code)
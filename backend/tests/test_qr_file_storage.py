@@ -0,0 +1,74 @@
+import hashlib
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from app.apis import qr_file_storage
+from app.apis.qr_file_storage import (
+    claim_blob_for_deletion, collect_unreferenced_blobs, reference_blob, remove_blob_record, store_blob
+)
+
+
+class DictBinaryStorage:
+    def __init__(self):
+        self.blobs = {}
+
+    def put(self, key, value):
+        self.blobs[key] = value
+
+    def get(self, key):
+        return self.blobs[key]
+
+    def delete(self, key):
+        self.blobs.pop(key, None)
+
+
+@pytest.fixture
+def storage(firestore_db, monkeypatch):
+    binary = DictBinaryStorage()
+    monkeypatch.setattr(qr_file_storage, "db", SimpleNamespace(storage=SimpleNamespace(binary=binary)))
+    return binary
+
+
+def store(data: bytes):
+    return store_blob(hashlib.sha256(data).hexdigest(), lambda writer: writer.write(data))
+
+
+def unreference(sha256: str) -> None:
+    # Released long enough ago for garbage collection
+    qr_file_storage.blob_repo.collection.document(sha256).update({"ref_count": 0, "updated_at": int(time.time()) - 7200})
+
+
+def test_reference_of_missing_blob_is_none(storage):
+    assert reference_blob("missing") is None
+
+
+def test_collection_deletes_unreferenced_blob(storage):
+    blob = store(b"qr image")
+    unreference(blob.sha256)
+
+    result = collect_unreferenced_blobs(grace_seconds=3600, dry_run=False)
+
+    assert result["collected_blobs"] == 1
+    assert qr_file_storage.blob_repo.get(blob.sha256) is None
+    assert storage.blobs == {}
+
+
+def test_save_during_collection_stores_a_fresh_copy(storage):
+    blob = store(b"qr image")
+    unreference(blob.sha256)
+    claimed = claim_blob_for_deletion(blob.sha256, int(time.time()) - 3600)
+
+    # A save of the same bytes after the claim must not reuse the blob being deleted
+    assert reference_blob(blob.sha256) is None
+    fresh = store(b"qr image")
+    assert fresh.file_key != claimed.file_key
+
+    qr_file_storage.delete_file_chunks(claimed.file_key, claimed.chunk_count)
+    remove_blob_record(claimed)
+
+    record = qr_file_storage.blob_repo.get(blob.sha256)
+    assert record.file_key == fresh.file_key
+    assert record.ref_count == 1
+    assert b"".join(storage.blobs.values()) == b"qr image"
@@ -0,0 +1,46 @@
+import asyncio
+import os
+
+from app.apis import qr_render_cache
+from app.apis.qr_render_cache import RenderedImageCache
+
+
+def make_cache(tmp_path, disk_bytes=1024 * 1024):
+    return RenderedImageCache(memory_bytes=1024 * 1024, disk_dir=str(tmp_path), disk_bytes=disk_bytes)
+
+
+def test_failed_disk_write_leaves_no_temporary_file(tmp_path, monkeypatch):
+    cache = make_cache(tmp_path)
+
+    def fail_replace(src, dst):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(qr_render_cache.os, "replace", fail_replace)
+    cache.set("abcdef", b"image")
+    cache.disk_writes.drain()
+
+    assert cache.disk_errors == 1
+    assert [files for _, _, files in os.walk(tmp_path) if files] == []
+    assert asyncio.run(cache.get("abcdef")) == b"image"  # still served from memory
+
+
+def test_images_are_written_to_disk_in_the_background_and_read_back(tmp_path):
+    cache = make_cache(tmp_path)
+    cache.set("abcdef", b"image")
+    cache.disk_writes.drain()
+
+    restarted = make_cache(tmp_path)
+    assert asyncio.run(restarted.get("abcdef")) == b"image"
+    assert asyncio.run(restarted.get("missing")) is None
+    assert restarted.stats()["disk"]["hits"] == 1
+    assert restarted.stats()["disk"]["misses"] == 1
+
+
+def test_disk_tier_is_pruned_to_its_budget(tmp_path):
+    cache = make_cache(tmp_path, disk_bytes=1000)
+    for index in range(5):
+        cache.set(f"key{index}", b"x" * 300)
+    cache.disk_writes.drain()
+
+    assert cache.stats()["disk"]["bytes"] <= 900
+    assert sum(len(files) for _, _, files in os.walk(tmp_path)) <= 3
@@ -0,0 +1,48 @@
+import asyncio
+import threading
+import time
+
+from app.apis import qr_generator, qr_render_pool
+from app.apis.qr_generator import BatchJob, batch_jobs, register_batch_job
+from app.apis.qr_render_pool import RenderPool
+from app.apis.qr_renderer import QRRenderSpec
+
+
+def test_cancelled_render_keeps_its_slot_until_it_finishes(monkeypatch):
+    started = threading.Event()
+    release = threading.Event()
+
+    def slow_render(spec):
+        started.set()
+        release.wait(5)
+        return b"image"
+
+    monkeypatch.setattr(qr_render_pool, "render_qr_image", slow_render)
+    pool = RenderPool(workers=0, max_pending=1, retry_after=1)
+
+    async def cancel_running_render():
+        task = asyncio.create_task(pool.render(QRRenderSpec(data="https://example.com")))
+        await asyncio.to_thread(started.wait, 5)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.run(cancel_running_render())
+    assert pool.stats()["pending"] == 1  # the render is still running
+
+    release.set()
+    deadline = time.time() + 5
+    while pool.stats()["pending"] and time.time() < deadline:
+        time.sleep(0.01)
+    assert pool.stats()["pending"] == 0
+    pool.shutdown()
+
+
+def test_batch_jobs_expire_by_age_even_while_running():
+    batch_jobs.clear()
+    stale = BatchJob(format="png", total=1, started_at=time.time() - qr_generator.QR_BATCH_JOB_MAX_AGE_SECONDS - 1)
+    register_batch_job(stale)
+    fresh = BatchJob(format="png", total=1)
+    register_batch_job(fresh)
+
+    assert list(batch_jobs) == [fresh.job_id]
+    batch_jobs.clear()
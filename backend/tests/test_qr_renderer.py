@@ -0,0 +1,35 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from pydantic import ValidationError
+
+from app.apis.qr_code import QRCodeStyle
+from app.apis.qr_generator import router as qr_generator_router
+from app.apis.qr_renderer import QRRenderSpec, render_qr_image
+
+
+@pytest.mark.parametrize("color", ['red"/><script>alert(1)</script>', "#FFF", "#GGGGGG", "000000", "#0000000"])
+def test_colors_must_be_six_digit_hex(color):
+    with pytest.raises(ValidationError):
+        QRRenderSpec(data="https://example.com", foreground_color=color)
+    with pytest.raises(ValidationError):
+        QRCodeStyle(background_color=color)
+
+
+def test_svg_uses_validated_colors():
+    svg = render_qr_image(QRRenderSpec(data="https://example.com", format="svg", foreground_color="#12ab34", background_color="#FFFFFF"))
+
+    assert b'fill="#12ab34"' in svg
+    assert b'fill="#FFFFFF"' in svg
+
+
+def test_invalid_color_override_is_rejected_before_rendering():
+    app = FastAPI()
+    app.include_router(qr_generator_router)
+
+    response = TestClient(app).get(
+        "/qr-image/temp-preview.svg",
+        params={"url": "https://example.com", "foreground_color_override": '"/><script>alert(1)</script>'}
+    )
+
+    assert response.status_code == 422
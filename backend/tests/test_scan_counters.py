@@ -0,0 +1,76 @@
+import threading
+
+from app.apis import scan_proxy
+from app.apis.qr_code import QRCode, get_scan_count
+from app.apis.scan_event import ScanEvent
+from app.apis.scan_stats import get_stats_document_id
+from app.apis.sharded_counter import ShardingPolicy
+
+
+def scan(qr_code: QRCode) -> ScanEvent:
+    return ScanEvent(qr_code_id=qr_code.id, store_hash=qr_code.store_hash, device_type="mobile")
+
+
+def test_concurrent_scans_are_counted_exactly(firestore_db, qr_code):
+    scan_proxy.qr_code_repo.add(qr_code, document_id=qr_code.id)
+    threads = 8
+    scans_per_thread = 50
+    start = threading.Barrier(threads)
+
+    def record_scans():
+        start.wait()
+        for _ in range(scans_per_thread):
+            scan_proxy.apply_scan_counters([scan(qr_code)])
+
+    workers = [threading.Thread(target=record_scans) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    total = threads * scans_per_thread
+    assert scan_proxy.qr_code_repo.get_by_id(qr_code.id).scan_count == total
+    stats = firestore_db.collection("scan_stats").document(get_stats_document_id(qr_code.id)).get().to_dict()
+    assert stats["total_scans"] == total
+    assert stats["device_breakdown"] == {"mobile": total}
+
+
+def test_batch_of_scans_is_one_counter_write_per_qr_code(firestore_db, qr_code):
+    scan_proxy.qr_code_repo.add(qr_code, document_id=qr_code.id)
+    batch = firestore_db.batch()
+    scan_proxy.add_scan_counter_writes(batch, qr_code.id, 25, scan_proxy.build_stats_increments([scan(qr_code)] * 25)[qr_code.id])
+
+    assert [op_type for op_type, _, _ in batch._operations] == ["update", "set_merge"]
+    batch.commit()
+    assert scan_proxy.qr_code_repo.get_by_id(qr_code.id).scan_count == 25
+
+
+def test_scans_of_legacy_document_do_not_create_a_stray_document(firestore_db, qr_code):
+    document_id = scan_proxy.qr_code_repo.add(qr_code)  # legacy: stored under a generated document ID
+
+    scan_proxy.apply_scan_counters([scan(qr_code), scan(qr_code)])
+
+    assert document_id != qr_code.id
+    assert not firestore_db.collection("qr_codes").document(qr_code.id).get().exists
+    assert firestore_db.collection("qr_codes").document(document_id).get().to_dict()["scan_count"] == 2
+    assert scan_proxy.resolve_qr_code(qr_code.id) is not None
+
+
+def test_sharded_scans_of_legacy_document_land_under_its_document(firestore_db, monkeypatch, qr_code):
+    # Shard every counter from the first write
+    monkeypatch.setattr(scan_proxy, "scan_counter_policy", ShardingPolicy(enabled=True, max_shards=4, writes_per_shard_per_second=0.001))
+    document_id = scan_proxy.qr_code_repo.add(qr_code)
+
+    scan_proxy.apply_scan_counters([scan(qr_code)] * 3)
+
+    qr_codes = firestore_db.collection("qr_codes")
+    assert not qr_codes.document(qr_code.id).get().exists
+    assert qr_codes.document(document_id).get().to_dict()["counter_shards"] == 4
+    assert get_scan_count(scan_proxy.qr_code_repo.get_by_id(qr_code.id)) == 3
+
+
+def test_stray_document_under_qr_code_id_does_not_hide_legacy_document(firestore_db, qr_code):
+    document_id = scan_proxy.qr_code_repo.add(qr_code)
+    firestore_db.collection("qr_codes").document(qr_code.id).set({"scan_count": 1})
+
+    assert scan_proxy.qr_code_repo.get_with_document_id(qr_code.id)[0] == document_id
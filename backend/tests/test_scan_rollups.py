@@ -0,0 +1,78 @@
+import pytest
+
+from app.apis import scan_rollups
+from app.apis.scan_event import ScanEvent
+
+
+def record_scan(firestore_db, timestamp: int) -> ScanEvent:
+    event = ScanEvent(qr_code_id="qr-1", store_hash="test-store", timestamp=timestamp, device_type="mobile")
+    firestore_db.collection("scan_events").document(event.id).set(event.dict())
+    batch = firestore_db.batch()
+    scan_rollups.add_rollup_writes(batch, [event])
+    batch.commit()
+    return event
+
+
+def total_scans(generation: int) -> int:
+    rollups = scan_rollups.query_rollups("store_hash", "test-store", generation, "2023-01-01", "2999-12-31")
+    return sum(rollup["total_scans"] for rollup in rollups)
+
+
+def test_backfill_keeps_scans_recorded_while_it_runs(firestore_db, monkeypatch):
+    monkeypatch.setattr(scan_rollups, "ROLLUP_BACKFILL_SETTLE_SECONDS", 0)
+    monkeypatch.setattr(scan_rollups, "ROLLUP_STATE_CACHE_TTL_SECONDS", 0)
+    scan_rollups.rollup_state_cache.invalidate("test-store")
+
+    first = record_scan(firestore_db, 1_700_000_000)
+    state = scan_rollups.start_store_backfill("test-store", "job-1")
+    record_scan(firestore_db, state.cutoff)
+    record_scan(firestore_db, state.cutoff + 1)  # after the cutoff: counted live
+    state = scan_rollups.finish_store_backfill(state)
+
+    assert state.generation == 1
+    assert state.events_processed == 2
+    assert scan_rollups.get_rollup_generation("test-store") == 1
+    assert total_scans(1) == 3
+
+    # Scans keep landing in the active generation, and a rerun replaces it without losing any
+    record_scan(firestore_db, first.timestamp)
+    monkeypatch.setattr(scan_rollups, "ROLLUP_BACKFILL_SETTLE_SECONDS", 10)  # rerun cutoff after every scan above
+    monkeypatch.setattr(scan_rollups.time, "sleep", lambda seconds: None)
+    state = scan_rollups.finish_store_backfill(scan_rollups.start_store_backfill("test-store", "job-2"))
+    assert state.generation == 2
+    assert total_scans(2) == 4
+    assert total_scans(1) == 0
+
+
+def test_stores_without_backfill_get_no_rollups(firestore_db):
+    scan_rollups.rollup_state_cache.invalidate("test-store")
+    record_scan(firestore_db, 1_700_000_000)
+
+    assert scan_rollups.get_rollup_generation("test-store") == 0
+    assert not list(firestore_db.collection("scan_rollups_daily").stream())
+
+
+def test_second_backfill_of_a_store_is_rejected_while_one_runs(firestore_db):
+    state = scan_rollups.start_store_backfill("test-store", "job-1")
+
+    with pytest.raises(scan_rollups.BackfillInProgress):
+        scan_rollups.start_store_backfill("test-store", "job-2")
+
+    assert scan_rollups.load_rollup_state("test-store").job_id == "job-1"
+    assert scan_rollups.load_rollup_state("test-store").building_generation == state.building_generation
+
+
+def test_backfill_job_records_its_progress_in_the_store_state(firestore_db, monkeypatch):
+    monkeypatch.setattr(scan_rollups, "ROLLUP_BACKFILL_SETTLE_SECONDS", 0)
+    monkeypatch.setattr(scan_rollups.time, "sleep", lambda seconds: None)
+    scan_rollups.rollup_state_cache.invalidate("test-store")
+    firestore_db.collection("qr_codes").document("qr-1").set({"id": "qr-1", "store_hash": "test-store"})
+    record_scan(firestore_db, 1_700_000_000)
+
+    scan_rollups.run_backfill_job("job-1", [], all_stores=True)
+
+    [state] = scan_rollups.get_backfill_job("job-1").backfills
+    assert state.status == "completed"
+    assert state.generation == 1
+    assert state.events_processed == 1
+    assert total_scans(1) == 1
@@ -0,0 +1,46 @@
+import asyncio
+
+import pytest
+
+from app.apis import store_manager
+from app.apis.store_manager import StoreAccessTracker, delete_store
+
+
+@pytest.fixture
+def tracker(firestore_db, monkeypatch):
+    access_tracker = StoreAccessTracker(flush_interval=3600)
+    monkeypatch.setattr(store_manager, "store_access_tracker", access_tracker)
+    monkeypatch.setattr(store_manager, "warning", lambda message, **kwargs: None)
+    yield access_tracker
+    access_tracker._stop.set()
+
+
+def create_store(firestore_db, store_hash):
+    firestore_db.collection("stores").document(store_hash).set({"store_hash": store_hash, "status": {"last_accessed": 0}})
+
+
+def test_flush_after_delete_store_does_not_recreate_the_store(firestore_db, tracker):
+    create_store(firestore_db, "deleted")
+    tracker.record("deleted", accessed_at=100)
+
+    asyncio.run(delete_store("deleted"))
+    tracker.flush()
+
+    assert not firestore_db.collection("stores").document("deleted").get().exists
+    assert tracker.stats()["pending"] == 0
+
+
+def test_flush_skips_a_store_deleted_after_its_access_was_recorded(firestore_db, tracker):
+    create_store(firestore_db, "deleted")
+    create_store(firestore_db, "kept")
+    asyncio.run(delete_store("deleted"))
+    # An in-flight request records an access after the store was deleted
+    tracker.record("deleted", accessed_at=100)
+    tracker.record("kept", accessed_at=200)
+
+    tracker.flush()
+
+    assert not firestore_db.collection("stores").document("deleted").get().exists
+    assert firestore_db.collection("stores").document("kept").get().to_dict()["status"]["last_accessed"] == 200
+    assert tracker.stats()["written"] == 1
+    assert tracker.stats()["skipped"] == 1
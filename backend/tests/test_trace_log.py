@@ -0,0 +1,28 @@
+import contextvars
+import logging
+
+from app.apis import trace_log
+from app.apis.trace_log import DebugSampleFilter, start_sampled_request
+
+
+def make_record(name, level):
+    return logging.LogRecord(name, level, __file__, 1, "message %s", ("argument",), None)
+
+
+def test_debug_records_of_a_request_are_kept_or_dropped_together(monkeypatch):
+    sampler = DebugSampleFilter(sample_rate=1.0, module_sample_rates={"app.apis.scan_proxy": 0.25})
+
+    def run_request(draw):
+        monkeypatch.setattr(trace_log.random, "random", lambda: draw)
+        start_sampled_request()
+        return [
+            sampler.filter(make_record("app.apis.scan_proxy", logging.DEBUG)),
+            sampler.filter(make_record("app.apis.scan_proxy", logging.DEBUG)),
+            sampler.filter(make_record("app.apis.scan_proxy", logging.WARNING)),
+            sampler.filter(make_record("app.apis.firestore_repository", logging.DEBUG)),
+        ]
+
+    assert contextvars.copy_context().run(run_request, 0.1) == [True, True, True, True]
+    assert contextvars.copy_context().run(run_request, 0.5) == [False, False, True, True]
+    # Outside a sampled request every record passes
+    assert sampler.filter(make_record("app.apis.scan_proxy", logging.DEBUG))
@@ -342,6 +342,8 @@ export interface QRCode {
    * @default "active"
    */
   status?: string;
+  /** Short Code */
+  short_code?: string | null;
 }
 
 /** QRCodeResponse */
@@ -44,6 +44,7 @@ interface QRCode {
   created_at: number;
   updated_at: number;
   scan_count: number;
+  short_code?: string | null;
 }
 
 export default function EditQr() {
@@ -323,7 +324,7 @@ export default function EditQr() {
                   // Update tracking URL to ensure consistency across environments
                   if (qrCode && qrCode.id) {
                     const storeHash = getStoreHash();
-                    qrCode.target.url = generateTrackingUrl(qrCode.id, storeHash);
+                    qrCode.target.url = generateTrackingUrl(qrCode.id, storeHash, qrCode.short_code);
                   }
                   return null;
                 })()}
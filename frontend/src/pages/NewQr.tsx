@@ -393,7 +393,7 @@ export default function NewQr() {
           // Update the preview with the actual saved QR code
           const savedQrData = data.qr_code;
           const storeHash = getStoreHash(); // Ensure getStoreHash is available in this scope
-          const trackingUrlForSaved = generateTrackingUrl(savedQrData.id, storeHash);
+          const trackingUrlForSaved = generateTrackingUrl(savedQrData.id, storeHash, savedQrData.short_code);
 
           setPreviewQRCode({
             qr_code: {
@@ -408,6 +408,7 @@ export default function NewQr() {
 
           // Update the global store
           qrCreationActions.setQrCodeId(savedQrData.id);
+          qrCreationActions.setQrShortCode(savedQrData.short_code ?? null);
           qrCreationActions.setStoreHash(storeHash); // storeHash is already available in this scope
           
           // Stay on the page and show success notification
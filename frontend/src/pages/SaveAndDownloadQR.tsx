@@ -45,6 +45,7 @@ export default function SaveAndDownloadQRPage() {
     qrLogoUrl,
     qrLogoSize,
     qrCodeId, // Added qrCodeId
+    qrShortCode,
     storeHash, // Added storeHash
     // qrType, // qrType is not used in this component, consider removing from destructuring if not needed elsewhere implicitly
     currentStep,
@@ -65,6 +66,7 @@ export default function SaveAndDownloadQRPage() {
     setCurrentStep: state.actions.setCurrentStep,
     resetQrCreationState: state.actions.resetQrCreationState,
     qrCodeId: state.qrCodeId, // Get qrCodeId from store
+    qrShortCode: state.qrShortCode,
     storeHash: state.storeHash, // Get storeHash from store
   }));
 
@@ -100,7 +102,7 @@ export default function SaveAndDownloadQRPage() {
     }
     setIsDownloading(true);
 
-    const urlToEncode = qrCodeId && storeHash ? generateTrackingUrl(qrCodeId, storeHash) : destinationUrl;
+    const urlToEncode = qrCodeId && storeHash ? generateTrackingUrl(qrCodeId, storeHash, qrShortCode) : destinationUrl;
     if (!urlToEncode) {
       toast.error("Cannot generate QR code: No URL to encode.");
       setIsDownloading(false);
@@ -314,7 +316,7 @@ export default function SaveAndDownloadQRPage() {
                 <div className="border rounded-lg p-4 bg-white">
                   {destinationUrl ? (
                     <QRCodePreview
-                      value={qrCodeId && storeHash ? generateTrackingUrl(qrCodeId, storeHash) : destinationUrl}
+                      value={qrCodeId && storeHash ? generateTrackingUrl(qrCodeId, storeHash, qrShortCode) : destinationUrl}
                       size={200}
                       fgColor={qrForegroundColor}
                       bgColor={qrBackgroundColor}
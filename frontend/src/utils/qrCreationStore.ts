@@ -14,6 +14,7 @@ const initialQrStyles: QrStyles = {
 
 const initialState: Omit<QrCreationState, "actions"> = {
   qrCodeId: null,
+  qrShortCode: null,
   storeHash: null,
   currentStep: 1,
   qrType: null,
@@ -31,6 +32,7 @@ export const useQrCreationStore = create<QrCreationState>()((set, get) => ({
   ...initialState,
   actions: {
     setQrCodeId: (id) => set({ qrCodeId: id }),
+    setQrShortCode: (shortCode) => set({ qrShortCode: shortCode }),
     setStoreHash: (hash) => set({ storeHash: hash }),
     setCurrentStep: (step) => set({ currentStep: step }),
     setQrType: (type) => set({ qrType: type }),
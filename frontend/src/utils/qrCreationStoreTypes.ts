@@ -11,6 +11,7 @@ export interface QrStyles {
 
 export interface QrCreationState {
   qrCodeId: string | null;
+  qrShortCode: string | null; // Short code of the saved QR code, used in its tracking URL
   storeHash: string | null;
   currentStep: number;
   qrType: 'customUrl' | 'product' | 'category' | 'homepage' | null;
@@ -24,6 +25,7 @@ export interface QrCreationState {
   savedQrCodeId: string | null;
   actions: {
     setQrCodeId: (id: string | null) => void;
+    setQrShortCode: (shortCode: string | null) => void;
     setStoreHash: (hash: string | null) => void;
     setCurrentStep: (step: number) => void;
     setQrType: (type: QrCreationState['qrType']) => void;
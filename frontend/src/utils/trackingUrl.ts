@@ -4,21 +4,25 @@ import { API_URL } from "./api";
  * Generates a standardized tracking URL for QR codes that works in both development and production environments
  * @param qrCodeId - The ID of the QR code
  * @param storeHash - The store hash
+ * @param shortCode - The QR code's short code, if it has one
  * @returns Properly formatted tracking URL
  */
-export const generateTrackingUrl = (qrCodeId: string, storeHash: string): string => {
+export const generateTrackingUrl = (qrCodeId: string, storeHash: string, shortCode?: string | null): string => {
   // Detect environment
   const isProduction = window.location.hostname === 'app.getrobo.xyz' || 
     window.location.hostname.includes('getrobo.xyz') || 
     !window.location.hostname.includes('localhost');
+  
+  // Short codes keep the URL (and so the QR code) small, and match the URL the backend encodes
+  const trackingPath = shortCode ? `/track/${shortCode}` : `/track/${qrCodeId}?store_hash=${storeHash}`;
     
   // In production, use the /api/track/ endpoint
   if (isProduction) {
-    return `https://app.getrobo.xyz/api/track/${qrCodeId}?store_hash=${storeHash}`;
+    return `https://app.getrobo.xyz/api${trackingPath}`;
   }
   
   // In development, use the full API URL path
-  return `${API_URL}/track/${qrCodeId}?store_hash=${storeHash}`;
+  return `${API_URL}${trackingPath}`;
 };
 
 /**